@@ -0,0 +1,88 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the time spent importing eventlib
+
+Run it from the root of the repository:
+
+    $ python benchmarks/import_time.py --runs 20
+
+Each run imports the modules in a fresh interpreter, so nothing is
+cached in `sys.modules`. A JSON object is written per module with the
+min and p50 import times (milliseconds) and the heavy dependencies that
+the import loaded.
+"""
+
+import argparse
+import json
+import platform
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+MODULES = ('eventlib', 'eventlib.listener', 'eventlib.tasks')
+
+HEAVY_DEPENDENCIES = ('celery', 'django', 'ejson', 'kombu', 'msgpack',
+                      'redis')
+
+SCRIPT = """
+import json, sys, time
+started = time.time()
+import {module}
+elapsed = (time.time() - started) * 1000
+loaded = sorted(set(m.split('.')[0] for m in sys.modules) & set({heavy!r}))
+sys.stdout.write(json.dumps([elapsed, loaded]))
+"""
+
+
+def measure(module):
+    script = SCRIPT.format(module=module, heavy=HEAVY_DEPENDENCIES)
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT)
+    return json.loads(output.decode('utf-8'))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--modules', type=lambda v: v.split(','),
+                        default=list(MODULES))
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    for module in options.modules:
+        results = [measure(module) for _ in range(options.runs)]
+        timings = sorted(elapsed for elapsed, loaded in results)
+        options.output.write(json.dumps({
+            'benchmark': 'import',
+            'module': module,
+            'runs': options.runs,
+            'min_ms': timings[0],
+            'p50_ms': timings[len(timings) // 2],
+            'loaded': results[-1][1],
+            'python': platform.python_version(),
+        }))
+        options.output.write('\n')
+        options.output.flush()
+
+
+if __name__ == '__main__':
+    main()
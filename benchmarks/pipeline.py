@@ -0,0 +1,300 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks for the log -> process -> broadcast -> listen pipeline
+
+Run it from the root of the repository:
+
+    $ python benchmarks/pipeline.py --iterations 1000 > results.json
+
+Each benchmark runs once for every combination of the parameters it
+depends on. A JSON object is written per line to the output with the
+throughput (events/sec) and the p50/p99 latencies (microseconds) of
+each combination, so results of different releases can be compared.
+
+Celery runs in eager mode and redis is replaced by fakeredis, when it
+is installed, or by the small in-process stand-in declared here.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+from collections import defaultdict, deque
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from django.conf import settings
+settings.configure(INSTALLED_APPS=('benchapp',))
+
+from celery import current_app
+current_app.conf.CELERY_ALWAYS_EAGER = True
+current_app.conf.CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
+
+import eventlib
+from eventlib import conf, core, listener, serializers
+from eventlib.util import redis_connection
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+EVENT_NAME = 'benchapp.BenchEvent'
+
+# Parameters that each benchmark depends on
+BENCHMARKS = {
+    'find_handlers': ('handlers', 'patterns'),
+    'find_handlers_uncached': ('handlers', 'patterns'),
+    'process': ('handlers', 'patterns', 'payload_keys', 'serializer'),
+    'broadcast': ('payload_keys', 'serializer'),
+    'log': ('handlers', 'patterns', 'payload_keys', 'serializer'),
+    'listen': ('handlers', 'payload_keys', 'serializer'),
+}
+
+
+class LocalRedis(object):
+    """In-process stand-in for the redis commands used by eventlib"""
+
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+
+    def publish(self, channel, message):
+        for pubsub in self.subscribers[channel]:
+            pubsub.messages.append(
+                {'type': 'message', 'channel': channel, 'data': message})
+        return len(self.subscribers[channel])
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def pubsub(self):
+        return LocalPubSub(self)
+
+
+class LocalPipeline(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def publish(self, channel, message):
+        self.commands.append((channel, message))
+
+    def execute(self):
+        return [self.client.publish(*command) for command in self.commands]
+
+
+class LocalPubSub(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.messages = deque()
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            self.client.subscribers[channel].append(self)
+
+    def listen(self):
+        while self.messages:
+            yield self.messages.popleft()
+
+
+class Done(BaseException):
+    """Stops the listener, it's not an `Exception` so the handler
+    failure isolation doesn't catch it"""
+
+
+def noop(data):
+    pass
+
+
+def make_payload(keys):
+    return dict(('key{}'.format(i), 'value {}'.format(i))
+                for i in range(keys))
+
+
+def setup(client, handlers=1, patterns=0, serializer='ejson', external=False,
+          **params):
+    """Register the handlers and configure eventlib for a benchmark"""
+    core.cleanup_handlers()
+    core.invalidate_event_cache()
+    redis_connection.reset()
+    redis_connection.connections[None] = client
+    settings.EVENTLIB_SERIALIZER = serializer
+    conf.refresh_settings()
+
+    register = eventlib.external_handler if external else eventlib.handler
+    for i in range(handlers):
+        register(EVENT_NAME)(noop)
+    for i in range(patterns):
+        # Only the last pattern matches the event name
+        register('app{}.*'.format(i) if i < patterns - 1 else 'bench*.*')(
+            noop)
+
+
+def timed(operation, iterations):
+    latencies = []
+    for i in range(iterations):
+        started = time.time()
+        operation()
+        latencies.append(time.time() - started)
+    return latencies
+
+
+def bench_find_handlers(client, iterations, **params):
+    setup(client, **params)
+    return timed(lambda: core.find_handlers(EVENT_NAME), iterations)
+
+
+def bench_find_handlers_uncached(client, iterations, **params):
+    setup(client, **params)
+    index = core.get_dispatch_index(core.HANDLER_REGISTRY)
+
+    def operation():
+        index.invalidate()
+        core.find_handlers(EVENT_NAME)
+    return timed(operation, iterations)
+
+
+def bench_process(client, iterations, payload_keys=10, **params):
+    setup(client, **params)
+    payload = serializers.dumps(make_payload(payload_keys))
+    return timed(lambda: core.process(EVENT_NAME, payload), iterations)
+
+
+def bench_broadcast(client, iterations, payload_keys=10, **params):
+    setup(client, **params)
+    event_cls = core.find_event(EVENT_NAME)
+    data = make_payload(payload_keys)
+    payload = serializers.dumps(data)
+
+    def operation():
+        event_cls(EVENT_NAME, dict(data))._broadcast(payload)
+    return timed(operation, iterations)
+
+
+def bench_log(client, iterations, payload_keys=10, **params):
+    setup(client, **params)
+    data = make_payload(payload_keys)
+    return timed(lambda: eventlib.log(EVENT_NAME, dict(data)), iterations)
+
+
+def bench_listen(client, iterations, payload_keys=10, **params):
+    setup(client, external=True, **params)
+    pubsub = client.pubsub()
+    client.pubsub = lambda: pubsub
+
+    # The messages are broadcasted before the listener starts, so only
+    # the time spent reading and handling them is measured.
+    event_cls = core.find_event(EVENT_NAME)
+    data = make_payload(payload_keys)
+    pubsub.subscribe('eventlib')
+    for i in range(iterations):
+        event_cls(EVENT_NAME, dict(data))._broadcast()
+
+    handled = []
+
+    def last_handler(data):
+        handled.append(time.time())
+        if len(handled) == iterations:
+            raise Done()
+    eventlib.external_handler(EVENT_NAME)(last_handler)
+
+    started = time.time()
+    try:
+        listener.listen_for_events()
+    except Done:
+        pass
+    return [b - a for a, b in zip([started] + handled, handled)]
+
+
+def percentile(latencies, value):
+    index = int(round(value / 100.0 * (len(latencies) - 1)))
+    return sorted(latencies)[index]
+
+
+def report(benchmark, params, latencies):
+    total = sum(latencies)
+    return {
+        'benchmark': benchmark,
+        'params': params,
+        'iterations': len(latencies),
+        'events_per_sec': len(latencies) / total if total else None,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'eventlib': eventlib.__version__,
+        'python': platform.python_version(),
+    }
+
+
+def sweep(names, options):
+    """Yield the benchmark name and params of each combination"""
+    for name in names:
+        keys = BENCHMARKS[name]
+        values = [getattr(options, key) for key in keys]
+        for combination in itertools.product(*values):
+            yield name, dict(zip(keys, combination))
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def str_list(value):
+    return value.split(',')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--benchmarks', type=str_list,
+                        default=sorted(BENCHMARKS))
+    parser.add_argument('--handlers', type=int_list, default=[1, 10, 100])
+    parser.add_argument('--patterns', type=int_list, default=[0, 10, 100])
+    parser.add_argument('--payload-keys', dest='payload_keys',
+                        type=int_list, default=[10, 100, 1000])
+    parser.add_argument('--serializer', type=str_list,
+                        default=sorted(serializers.REGISTRY))
+    parser.add_argument('--redis', choices=('fakeredis', 'local'),
+                        default='fakeredis' if fakeredis else 'local')
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    for name, params in sweep(options.benchmarks, options):
+        if options.redis == 'fakeredis':
+            client = fakeredis.FakeStrictRedis()
+        else:
+            client = LocalRedis()
+        bench = globals()['bench_{}'.format(name)]
+        latencies = bench(client, options.iterations, **params)
+        options.output.write(json.dumps(report(name, params, latencies)))
+        options.output.write('\n')
+        options.output.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -15,15 +15,23 @@
 
 """implementation of the RFC00001-event-log-spec proposal"""
 
-# Registering the serializers for eventlib
-import ejson.serializers        # pyflakes:ignore
+import sys
 
 # Imports to register and expose things in the "eventlib" namespace.
-from .api import log, handler, external_handler, BaseEvent  # pyflakes: ignore
+from .api import (  # pyflakes: ignore
+    log, log_many, LogBatch, handler, external_handler, BaseEvent,
+)
+
+# Celery workers register the tasks and the `task_postrun` hook as soon
+# as they import eventlib. Other processes only import the tasks when an
+# event is sent, since celery takes long to import.
+if 'celery' in sys.modules:
+    from . import tasks  # pyflakes: ignore
 
 
 __version__ = '0.1.5'
 
 __all__ = (
-    'BaseEvent', 'handler', 'external_handler', 'log',
+    'BaseEvent', 'handler', 'external_handler', 'log', 'log_many',
+    'LogBatch',
 )
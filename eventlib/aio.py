@@ -0,0 +1,165 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""asyncio version of the pubsub listener
+
+This module requires Python 3.8+ and the `redis.asyncio` client that
+ships with redis-py 4.2+, installed with the `aio` extra of the package
+(`pip install eventlib[aio]`). Run the listener in the event loop of
+your service:
+
+    >>> asyncio.run(listen_for_events_async())
+
+External handlers are registered with the `external_handler` decorator
+as usual and can be either coroutine functions, that are awaited in the
+event loop, or regular functions, that run in an executor. Only the
+pubsub transport is supported.
+"""
+
+import asyncio
+import logging
+import time
+
+from .conf import getsetting
+from .core import (
+    EXTERNAL_HANDLER_REGISTRY, find_external_handlers, get_handler_timeout,
+    handler_failed, handler_finished, handler_name, handler_succeeded,
+    import_event_modules, is_batch_handler, run_handler)
+from .exceptions import HandlerTimeoutError
+from .guards import get_breaker
+from .metrics import get_sink
+from .transport import decode_message, subscriptions
+from .util import POOL_OPTIONS
+
+
+logger = logging.getLogger('event')
+
+
+def get_async_connection():
+    """Return an asyncio redis client configured like the sync one
+
+    It uses the same `REDIS_CONNECTIONS` and `EVENTLIB_REDIS_CONFIG_NAME`
+    settings of the `util.ConnectionManager`.
+    """
+    from redis.asyncio import ConnectionPool, Redis
+
+    redis_configs = getsetting('REDIS_CONNECTIONS')
+    config_name = getsetting('EVENTLIB_REDIS_CONFIG_NAME', 'default')
+    config = redis_configs[config_name]
+    options = dict((param, config[key]) for key, param in POOL_OPTIONS
+                   if key in config)
+    pool = ConnectionPool(host=config['HOST'], port=config['PORT'], **options)
+    return Redis(connection_pool=pool)
+
+
+async def run_handler_async(event_name, handler, data, sink):
+    """Await a coroutine handler, just like `core.run_handler()` calls
+    the regular ones
+
+    Timeouts cancel the coroutine instead of raising a signal.
+    """
+    name = handler_name(handler)
+    breaker = get_breaker(name)
+    if breaker is not None and not breaker.allow():
+        sink.incr(u'handlers.{}.skipped'.format(name))
+        return
+
+    timeout = get_handler_timeout(name)
+    started = time.time()
+    try:
+        try:
+            await asyncio.wait_for(handler(data), timeout or None)
+        except asyncio.TimeoutError:
+            raise HandlerTimeoutError(
+                u'The handler took more than {}s'.format(timeout))
+    except Exception as exc:
+        handler_failed(event_name, name, exc, breaker, sink)
+        if getsetting('DEBUG'):
+            raise exc
+    else:
+        handler_succeeded(name, breaker)
+    finally:
+        handler_finished(event_name, name, started, sink)
+
+
+async def process_external_async(event_name, data, executor=None):
+    """Execute the external handlers found for an event
+
+    Works just like `core.process_external()`, but coroutine handlers
+    are awaited and regular ones run in `executor`, so they don't block
+    the event loop. Batch handlers receive a list with the `data` as
+    its only item.
+    """
+    loop = asyncio.get_event_loop()
+    sink = get_sink()
+    sink.incr(u'events.{}.external'.format(event_name))
+    for handler in find_external_handlers(event_name):
+        payload = [data] if is_batch_handler(handler) else data
+        if asyncio.iscoroutinefunction(handler):
+            await run_handler_async(event_name, handler, payload, sink)
+        else:
+            await loop.run_in_executor(
+                executor, run_handler, event_name, handler, payload, sink)
+
+
+async def listen_for_events_async(client=None, concurrency=None,
+                                  executor=None):
+    """Pubsub event listener for asyncio applications
+
+    Each message received is handled in its own task, so slow handlers
+    don't stop the listener from reading the channel. At most
+    `concurrency` events are handled at the same time, defaulting to the
+    `EVENTLIB_ASYNC_CONCURRENCY` setting (100). When that limit is
+    reached, the listener waits for a running event to finish before
+    reading the next message.
+    """
+    import_event_modules()
+    if client is None:
+        client = get_async_connection()
+    if concurrency is None:
+        concurrency = getsetting('EVENTLIB_ASYNC_CONCURRENCY', 100)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    running = set()
+
+    async def handle(event_name, data):
+        try:
+            await process_external_async(event_name, data, executor)
+        except Exception:
+            logger.exception(
+                u'The listener failed to process the event "{}"'.format(
+                    event_name))
+        finally:
+            semaphore.release()
+
+    channels, patterns = subscriptions(EXTERNAL_HANDLER_REGISTRY)
+    pubsub = client.pubsub()
+    if channels:
+        await pubsub.subscribe(*channels)
+    if patterns:
+        await pubsub.psubscribe(*patterns)
+    try:
+        async for message in pubsub.listen():
+            if message['type'] not in ('message', 'pmessage'):
+                continue
+            event_name, data = decode_message(message["data"])
+            if event_name is not None:
+                await semaphore.acquire()
+                task = asyncio.ensure_future(handle(event_name, data))
+                running.add(task)
+                task.add_done_callback(running.discard)
+    finally:
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
@@ -15,21 +15,32 @@
 
 """This file implements the public interface of our event tracker lib"""
 
-import ejson
+from . import coalesce
 from . import conf
 from . import core
-from . import tasks
+from . import serializers
+from . import shipper
+from . import spill
+from . import throttle
+from . import transport
+from .compat import get_function, string_types, with_metaclass
 from .exceptions import ValidationError
+from .lazy import LazyImport
 from .util import redis_connection
 
 
-def _register_handler(event, fun, external=False):
+tasks = LazyImport('eventlib.tasks')
+
+
+def _register_handler(event, fun, external=False, name=None):
     """Register a function to be an event handler"""
+    if name is not None:
+        core.register_handler_name(fun, name)
     registry = core.HANDLER_REGISTRY
     if external:
         registry = core.EXTERNAL_HANDLER_REGISTRY
 
-    if not isinstance(event, basestring):
+    if not isinstance(event, string_types):
         # If not basestring, it is a BaseEvent subclass.
         # This occurs when class methods are registered as handlers
         event = core.parse_event_to_name(event)
@@ -38,13 +49,19 @@ def _register_handler(event, fun, external=False):
         registry[event].append(fun)
     else:
         registry[event] = [fun]
+    core.invalidate_dispatch_indexes()
     return fun
 
 
 class MetaEvent(type):
-    """Takes care of the methods marked as handlers in an Event class"""
+    """Takes care of the methods marked as handlers in an Event class
+
+    Event classes also get empty `__slots__` unless they declare their
+    own, so their instances don't get a `__dict__`.
+    """
 
     def __new__(mcs, name, bases, attrs):
+        attrs.setdefault('__slots__', ())
         newcls = type.__new__(mcs, name, bases, attrs)
 
         # Collecting the methods that were registered as handlers for
@@ -59,11 +76,28 @@ class MetaEvent(type):
         return newcls
 
 
-class BaseEvent(object):
+class BaseEvent(with_metaclass(MetaEvent, object)):
     """Marker class for all events
+
+    Instances only hold the `name` and the `data` of the event in slots,
+    since one is built for every event logged and processed. Subclasses
+    that need attributes of their own must declare them in `__slots__`,
+    or declare `__slots__ = ('__dict__',)` to accept any attribute.
     """
 
-    __metaclass__ = MetaEvent
+    __slots__ = ('name', 'data')
+
+    # Options of the task that processes the event, see
+    # `core.get_task_options()`
+    task_options = None
+
+    # Fraction of the events that are logged and max events logged per
+    # period, like '100/s', see the `throttle` module
+    sample_rate = None
+    rate_limit = None
+
+    # Seconds during which duplicates are collapsed, see `coalesce_key()`
+    coalesce_window = None
 
     def __init__(self, name, data):
         """Stores event name and data param as instance attributes"""
@@ -97,28 +131,74 @@ class BaseEvent(object):
         called locally, making it easier to debug things and find
         problems.
         """
-        current_keys = set(self.data.keys())
-        needed_keys = set(keys)
-        if not needed_keys.issubset(current_keys):
+        missing_keys = [key for key in keys if key not in self.data]
+        if missing_keys:
             raise ValidationError(
                 'One of the following keys are missing from the '
-                'event\'s data: {}'.format(
-                    ', '.join(needed_keys.difference(current_keys)))
+                'event\'s data: {}'.format(', '.join(missing_keys))
             )
         return True
 
-    def _broadcast(self):
+    def _broadcast(self, payload=None):
+        """Publish the event data to the external handlers
+
+        When the `EVENTLIB_FRAMED_BROADCAST` setting is true and the
+        `broadcast()` method is not overriden, the serialized `payload`
+        received by the worker is published as it is, framed with the
+        event name, instead of serializing the data once again. Notice
+        that changes done to the data by `clean()` or by the handlers
+        are not broadcasted in this case.
+
+        When the `EVENTLIB_BROADCAST_MODE` setting is `'buffered'`, the
+        message is added to the broadcast buffer and published later
+        along with other messages through a redis pipeline.
+
+        Messages are published in the pubsub channel chosen by the
+        `EVENTLIB_BROADCAST_ROUTING` setting or added to the `eventlib`
+        stream, depending on the `EVENTLIB_TRANSPORT` setting. Messages
+        that redis refuses are written to the spill buffer, if enabled.
+        """
         if conf.getsetting('UNIT_TESTING'):
             raise AssertionError(
                 'Eventlib calls must be mocked when settings.UNIT_TESTING is True')
 
-        data = self.broadcast(self.data)
         client = redis_connection.get_connection()
-        if client:
+        if not client:
             # If not redis client, don't broadcast
+            return
+
+        if (payload is not None and not self.overrides_broadcast() and
+                conf.getsetting('EVENTLIB_FRAMED_BROADCAST')):
+            message = transport.encode_frame(self.name, payload)
+        else:
+            data = self.broadcast(self.data)
             data['name'] = self.name
-            data = ejson.dumps(data)
-            client.publish("eventlib", data)
+            message = serializers.dumps(data)
+
+        channel = transport.channel_for(self.name)
+        if conf.getsetting('EVENTLIB_BROADCAST_MODE') == 'buffered':
+            transport.get_buffer().add(client, channel, message)
+        else:
+            try:
+                transport.publish(client, channel, message)
+            except Exception:
+                if not spill.spill_messages([(channel, message)]):
+                    raise
+
+    def coalesce_key(self):
+        """Override this method to collapse the duplicates of an event
+
+        Events logged with the same name and key within the coalescing
+        window are sent as a single one, see the `coalesce` module.
+        Returning `None` sends the event as usual.
+        """
+        return None
+
+    @classmethod
+    def overrides_broadcast(cls):
+        """Tells if the `broadcast()` method was overriden by `cls`"""
+        return (get_function(cls.broadcast) is not
+                get_function(BaseEvent.broadcast))
 
     def broadcast(self, data):
         """Returns all the data that will be passed to the external handlers
@@ -129,7 +209,7 @@ class BaseEvent(object):
         return data
 
 
-def handler(param):
+def handler(param=None, batch=False, name=None):
     """Decorator that associates a handler to an event class
 
     This decorator works for both methods and functions. Since it only
@@ -152,16 +232,61 @@ def handler(param):
         ...     def another_blah(data):
         ...         sys.stdout.write('Stuff!\n')
 
+    Handlers registered with `batch` set receive a list of event data
+    instead of a single one. When many events are processed in the
+    same task, like the ones sent by `log_many()`, batch handlers are
+    called once per event name with all of them:
+
+        >>> @handler('deal.ActionLog', batch=True)
+        ... def save_actions(items):
+        ...     Action.objects.bulk_create(Action(**i) for i in items)
+
+    Methods are marked as batch handlers with `@handler(batch=True)`.
+
+    Handlers are identified by their module and function names, or by
+    their classes and method names, in the settings, the metrics and
+    the tasks sent to the workers. Handlers that can't be told apart by
+    those, like lambdas or `functools.partial` objects of the same
+    function, can't be sent to their own tasks or be found in the
+    settings, raising `HandlerNameError`, unless they get a `name`:
+
+        >>> handler('deal.ActionLog', name='deal.notify_sales')(
+        ...     partial(notify, team='sales'))
     """
-    if isinstance(param, basestring):
-        return lambda f: _register_handler(param, f)
+    if isinstance(param, string_types):
+        return lambda f: _register_handler(
+            param, _mark_batch(f, batch), name=name)
+    elif param is None:
+        return lambda f: handler(_mark_batch(f, batch))
     else:
         core.HANDLER_METHOD_REGISTRY.append(param)
         return param
 
 
-def external_handler(param):
-    return lambda f: _register_handler(param, f, external=True)
+def _mark_batch(fun, batch):
+    if batch:
+        fun.batch_handler = True
+    return fun
+
+
+def external_handler(param, batch=False, name=None):
+    """Decorator that registers a handler for the broadcasted events
+
+    External handlers run in the listener process started by the
+    `read_events` command instead of the celery workers. With `batch`
+    set, the handler receives a list with the data of many events at
+    once, which is useful to write them to a database in bulk:
+
+        >>> @external_handler('deal.ActionLog', batch=True)
+        ... def save_actions(items):
+        ...     Action.objects.bulk_create(Action(**i) for i in items)
+
+    Batches are as large as the listener reads at once, see the
+    `EVENTLIB_LISTENER_BATCH_SIZE` setting. Handlers are named just like
+    in `handler()`.
+    """
+    return lambda f: _register_handler(
+        param, _mark_batch(f, batch), external=True, name=name)
 
 
 def log(name, data=None):
@@ -180,23 +305,152 @@ def log(name, data=None):
 
     The `data` param *must* be a dictionary, otherwise a `TypeError`
     will be rised. All keys *must* be strings and all values *must* be
-    serializable by the `json.dumps` function. If you need to pass any
-    unsupported object, you will have to register a serializer
-    function. Consult the RFC-00003-serialize-registry for more
-    information.
+    serializable by the serializer chosen in the `EVENTLIB_SERIALIZER`
+    setting (`ejson` by default). If you need to pass any unsupported
+    object, you will have to register a serializer function. Consult
+    the RFC-00003-serialize-registry for more information.
+
+    When the `EVENTLIB_LOG_MODE` setting is `'background'`, the event is
+    queued and sent to celery by a background thread, see the `shipper`
+    module. Events that can't be sent because the broker is down are
+    written to the spill buffer, if it's enabled, see the `spill` module.
+    The first event logged also starts replaying the buffer, so events
+    spilled by processes that died are sent again.
+
+    The task is sent with the options returned by
+    `core.get_task_options()`, so events can have their own queue,
+    priority and expiration.
+
+    Events can be sampled and rate limited before anything else is done
+    with them, see the `throttle` module. Duplicated events can be
+    collapsed into a single one, see the `coalesce` module.
     """
-    data = data or {}
-    data.update(core.get_default_values(data))
+    event, data = _serialize_event(name, data)
+    if event is None:
+        return
+
+    # We don't use celery when developing
+    if conf.getsetting('DEBUG'):
+        core.process(name, data)
+        transport.flush_buffer()
+        return
+
+    spill.start_replayer()
+    if _coalesce(event, data):
+        return
+    if conf.getsetting('EVENTLIB_LOG_MODE') == 'background':
+        shipper.get_shipper().put(name, data)
+    else:
+        try:
+            core.apply_task(tasks.process_task, (name, data),
+                            core.get_task_options(name))
+        except Exception:
+            # The broker is down, keep the event on disk if possible
+            if not spill.spill_events([(name, data)]):
+                raise
 
+
+def _serialize_event(name, data):
+    """Validate the event locally and return it with its serialized data
+
+    Returns `(None, None)` when the event is dropped by the sampling
+    rates or the rate limits.
+    """
     # InvalidEventNameError, EventNotFoundError
     event_cls = core.find_event(name)
+    if not throttle.admit(name, event_cls):
+        return None, None
+
+    data = data or {}
+    core.set_default_values(data, data.get('request'))
     event = event_cls(name, data)
     event.validate()                # ValidationError
     data = core.filter_data_values(data)
-    data = ejson.dumps(data)        # TypeError
+    return event, serializers.task_payload(
+        serializers.dumps(data))  # TypeError
+
+
+def _coalesce(event, data):
+    """Hold the event in its coalescing window, returning `False` if its
+    class doesn't coalesce events"""
+    if not isinstance(event, BaseEvent):
+        return False
+    key = event.coalesce_key()
+    if key is None:
+        return False
+    coalesce.get_coalescer(_send_events).add(
+        event.name, key, data, coalesce.get_window(event))
+    return True
 
+
+def _send_events(events):
+    """Send a list of `(name, data)` pairs of serialized events"""
     # We don't use celery when developing
     if conf.getsetting('DEBUG'):
-        core.process(name, data)
+        core.process_batch(events)
+        transport.flush_buffer()
+        return
+
+    spill.start_replayer()
+    if conf.getsetting('EVENTLIB_LOG_MODE') == 'background':
+        for name, data in events:
+            shipper.get_shipper().put(name, data)
     else:
-        tasks.process_task.delay(name, data)
+        for options, group in core.group_by_task_options(events):
+            try:
+                core.apply_task(tasks.process_batch_task, (group,), options)
+            except Exception:
+                if not spill.spill_events(group):
+                    raise
+
+
+def log_many(events):
+    """Log a sequence of `(name, data)` pairs with a single celery task
+
+    Each event is validated and serialized locally, exactly like the
+    `log()` function does. If any of them fails, the exception is
+    raised and none of the events will be sent.
+
+        >>> log_many([
+        ...     ('deal.ActionLog', {'action': 'click'}),
+        ...     ('deal.ActionLog', {'action': 'buy'}),
+        ... ])
+    """
+    with LogBatch() as batch:
+        for name, data in events:
+            batch.log(name, data)
+
+
+class LogBatch(object):
+    """Collects events to log them all at once
+
+    Events are validated as soon as they're added to the batch and are
+    sent with a single celery task when the `with' block exits without
+    errors or when the `flush()` method is called.
+
+        >>> with LogBatch() as batch:
+        ...     batch.log('deal.ActionLog', {'action': 'click'})
+        ...     batch.log('deal.ActionLog', {'action': 'buy'})
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def log(self, name, data=None):
+        """Validate an event and add it to the batch"""
+        event, data = _serialize_event(name, data)
+        if event is not None:
+            self.events.append((name, data))
+
+    def flush(self):
+        """Send all the events collected so far"""
+        events, self.events = self.events, []
+        if events:
+            _send_events(events)
@@ -0,0 +1,153 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Coalescing of the duplicated events logged in a short time window
+
+Event classes opt in by overriding `BaseEvent.coalesce_key()`. Events
+logged with the same name and key within `coalesce_window` seconds are
+collapsed into the first one, that is sent when the window is over with
+the number of events it stands for under the `__count__` key:
+
+    >>> class ActionLog(BaseEvent):
+    ...     coalesce_window = 5
+    ...
+    ...     def coalesce_key(self):
+    ...         return self.data['user'], self.data['action']
+
+Windows not declared by the classes default to the
+`EVENTLIB_COALESCE_WINDOW` setting (5). The windows are kept in memory
+by a daemon thread and the events still waiting are sent when the
+process exits.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from .conf import getsetting
+from .serializers import dumps, loads, task_payload
+
+
+logger = logging.getLogger('event')
+
+COUNT_KEY = '__count__'
+
+
+class Coalescer(object):
+    """Holds the events in their windows and passes them to `send` when
+    the windows are over
+
+    `send` receives a list of `(name, data)` pairs, like the ones taken
+    by `log_many()`. Windows are checked every `interval` seconds.
+    """
+
+    def __init__(self, send, interval=0.1):
+        self.send = send
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pid = None
+        self.pending = OrderedDict()
+        self.thread = None
+
+    def start(self):
+        """Start the thread that closes the windows, unless it's already
+        running in this process"""
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        # The windows of the parent process are sent by the parent
+        self.pending = OrderedDict()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, name, key, data, window):
+        """Hold the serialized `data` of an event, unless an event with
+        the same `name` and `key` is already waiting"""
+        with self.lock:
+            self.start()
+            entry = self.pending.get((name, key))
+            if entry is not None:
+                entry[2] += 1
+            else:
+                self.pending[(name, key)] = [time.time() + window, data, 1]
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush(time.time())
+
+    def stop(self):
+        """Stop the thread and send all the events still waiting"""
+        self.stopped.set()
+        self.thread.join(1)
+        self.flush()
+
+    def flush(self, until=None):
+        """Send the events whose windows end before `until`, or all of
+        them"""
+        with self.lock:
+            expired = [(name, key) for (name, key), (deadline, _, _)
+                       in self.pending.items()
+                       if until is None or deadline <= until]
+            entries = [(name, self.pending.pop((name, key)))
+                       for name, key in expired]
+        if not entries:
+            return
+
+        events = []
+        for name, (deadline, data, count) in entries:
+            data = loads(data)
+            data[COUNT_KEY] = count
+            events.append((name, task_payload(dumps(data))))
+        try:
+            self.send(events)
+        except Exception as exc:
+            logger.warning(
+                (u'The event system could not send {} coalesced events and '
+                 u'failed with the following exception: {}').format(
+                     len(events), str(exc)))
+
+
+_coalescer = None
+
+
+def get_coalescer(send):
+    """Return the coalescer, creating it with `send` on the first call"""
+    global _coalescer
+    if _coalescer is None:
+        _coalescer = Coalescer(send)
+        # Registered here so the events are sent before the background
+        # shipper stops at exit
+        atexit.register(flush_coalescer)
+    return _coalescer
+
+
+def get_window(event):
+    """Return the coalescing window of `event`, in seconds"""
+    window = event.coalesce_window
+    if window is None:
+        window = getsetting('EVENTLIB_COALESCE_WINDOW', 5)
+    return window
+
+
+def flush_coalescer():
+    """Send all the events waiting in their windows"""
+    if _coalescer is not None and _coalescer.pid == os.getpid():
+        _coalescer.stop()
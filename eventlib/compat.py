@@ -0,0 +1,46 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Names that moved between Python 2 and Python 3
+
+The celery side of the library runs on Python 2, but the `eventlib.aio`
+listener needs Python 3. Modules shared by both import these names from
+here instead of trying both spellings on their own.
+"""
+
+try:
+    from Queue import Empty, Full, Queue
+except ImportError:
+    from queue import Empty, Full, Queue
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+def with_metaclass(meta, *bases):
+    """Create a base class built by the metaclass `meta`, since Python 2
+    and Python 3 declare the metaclasses differently"""
+    class metaclass(type):
+        def __new__(mcs, name, this_bases, attrs):
+            return meta(name, bases, attrs)
+    return type.__new__(metaclass, 'temporary_class', (), {})
+
+
+def get_function(method):
+    """Return the function of a method, that Python 2 also wraps when
+    it's looked up in the class"""
+    return getattr(method, '__func__', method)
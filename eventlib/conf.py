@@ -14,9 +14,121 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """Holds a very thin wrapper to get default values for configuration
-keys in the django settings system"""
+keys in the django settings system
 
-from django.conf import settings
+The settings read by eventlib are resolved at once into a snapshot, so
+the code processing events doesn't go through the django settings on
+every read. The snapshot is built again when the `setting_changed`
+signal is sent, like `override_settings` does in tests. Code changing
+the settings by hand must call `refresh_settings()`.
+"""
+
+import sys
+
+from .lazy import LazyImport
+
+
+settings = LazyImport('django.conf', 'settings')
+
+# Settings kept in the snapshot, all the others are read directly
+SETTINGS = (
+    'DEBUG',
+    'UNIT_TESTING',
+    'LOCAL_GEOLOCATION_IP',
+    'INSTALLED_APPS',
+    'REDIS_CONNECTIONS',
+    'EVENTLIB_ASYNC_CONCURRENCY',
+    'EVENTLIB_BREAKER_RESET_TIMEOUT',
+    'EVENTLIB_BREAKER_THRESHOLD',
+    'EVENTLIB_BROADCAST_BUFFER_DELAY',
+    'EVENTLIB_BROADCAST_BUFFER_SIZE',
+    'EVENTLIB_BROADCAST_MODE',
+    'EVENTLIB_BROADCAST_ROUTING',
+    'EVENTLIB_COALESCE_WINDOW',
+    'EVENTLIB_DISPATCH_MODE',
+    'EVENTLIB_EVENT_ROUTES',
+    'EVENTLIB_FRAMED_BROADCAST',
+    'EVENTLIB_HANDLER_ROUTES',
+    'EVENTLIB_HANDLER_TIMEOUT',
+    'EVENTLIB_HANDLER_TIMEOUTS',
+    'EVENTLIB_HANDLER_TIMEOUT_THREADS',
+    'EVENTLIB_LISTENER_BACKEND',
+    'EVENTLIB_LISTENER_BATCH_SIZE',
+    'EVENTLIB_LISTENER_BATCH_TIMEOUT',
+    'EVENTLIB_LISTENER_ORDERED',
+    'EVENTLIB_LISTENER_OVERFLOW',
+    'EVENTLIB_LISTENER_QUEUE_SIZE',
+    'EVENTLIB_LISTENER_WORKERS',
+    'EVENTLIB_LOG_MODE',
+    'EVENTLIB_METRICS_OPTIONS',
+    'EVENTLIB_METRICS_SINK',
+    'EVENTLIB_RATE_LIMITS',
+    'EVENTLIB_REDIS_CONFIG_NAME',
+    'EVENTLIB_SAMPLE_RATES',
+    'EVENTLIB_SERIALIZER',
+    'EVENTLIB_SHIPPER_BATCH_SIZE',
+    'EVENTLIB_SHIPPER_EXIT_TIMEOUT',
+    'EVENTLIB_SHIPPER_OVERFLOW',
+    'EVENTLIB_SHIPPER_QUEUE_SIZE',
+    'EVENTLIB_SLOW_HANDLER_THRESHOLD',
+    'EVENTLIB_SPILL_DIR',
+    'EVENTLIB_SPILL_MAX_SEGMENTS',
+    'EVENTLIB_SPILL_REPLAY_INTERVAL',
+    'EVENTLIB_SPILL_SEGMENT_SIZE',
+    'EVENTLIB_STREAM_BATCH_SIZE',
+    'EVENTLIB_STREAM_BLOCK',
+    'EVENTLIB_STREAM_CLAIM_IDLE',
+    'EVENTLIB_STREAM_CONSUMER',
+    'EVENTLIB_STREAM_GROUP',
+    'EVENTLIB_STREAM_MAXLEN',
+    'EVENTLIB_TRANSPORT',
+)
+
+SNAPSHOT_KEYS = frozenset(SETTINGS)
+
+
+class SettingsSnapshot(object):
+    """Values of the settings listed in `SETTINGS` read from `source`
+
+    Settings that are not defined are left unset, so `getattr()` falls
+    back to its default value.
+    """
+
+    __slots__ = ('source',) + SETTINGS
+
+    def __init__(self, source):
+        self.source = source
+        for key in SETTINGS:
+            try:
+                setattr(self, key, getattr(source, key))
+            except AttributeError:
+                pass
+
+
+_snapshot = None
+
+
+def get_snapshot():
+    """Return the snapshot of the settings, building it if needed"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is None or snapshot.source is not settings:
+        snapshot = _snapshot = SettingsSnapshot(settings)
+
+        # Only the test framework sends the signal and importing it
+        # just to listen to the signal would cost more than importing
+        # eventlib itself
+        signals = sys.modules.get('django.test.signals')
+        if signals is not None:
+            signals.setting_changed.connect(
+                refresh_settings, dispatch_uid='eventlib.conf')
+    return snapshot
+
+
+def refresh_settings(**kwargs):
+    """Drop the snapshot, so the settings are read again on next use"""
+    global _snapshot
+    _snapshot = None
 
 
 def getsetting(key, default=None):
@@ -25,4 +137,6 @@ def getsetting(key, default=None):
     Also, this makes it easier to find places that are using
     configuration values and change them if we need in the future.
     """
+    if key in SNAPSHOT_KEYS:
+        return getattr(get_snapshot(), key, default)
     return getattr(settings, key, default)
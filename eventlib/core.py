@@ -16,18 +16,30 @@
 """Implementation of the basic operations for the eventlib"""
 
 import fnmatch
+import functools
+import json
 import logging
 import os
+import pkgutil
+import re
+import threading
+import time
+import types
 
 from datetime import datetime
 from collections import OrderedDict
 from importlib import import_module
-from ejson import loads
 
+from .compat import string_types
 from .conf import getsetting
+from .guards import call_with_timeout, get_breaker, get_timeout
+from .lazy import LazyImport
+from .metrics import Timer, get_sink
+from .serializers import dumps, loads, task_payload
 from .util import get_ip
 from .exceptions import (
-    ValidationError, EventNotFoundError, InvalidEventNameError
+    ValidationError, EventNotFoundError, InvalidEventNameError,
+    HandlerTimeoutError, HandlerNameError,
 )
 
 
@@ -36,10 +48,123 @@ EXTERNAL_HANDLER_REGISTRY = OrderedDict()
 
 HANDLER_METHOD_REGISTRY = []
 
+# Names given to the handlers, see `register_handler_name()`
+HANDLER_NAMES = {}
+
 EVENTS_MODULE_NAME = 'events'
 
+celery = LazyImport('celery')
+
+tasks = LazyImport('eventlib.tasks')
+
 logger = logging.getLogger('event')
 
+# Characters that make `fnmatch' treat a registry key as a pattern
+WILDCARD_CHARS = re.compile(r'[*?[]')
+
+
+class PatternIndex(object):
+    """Resolves names against the keys of a mapping of `fnmatch' patterns
+
+    Exact keys are looked up in a dictionary and the wildcard ones are
+    compiled only once, when the index is built. The result of
+    `resolve()` is cached per name until `invalidate()` is called, so
+    resolving a name that was already seen is a single dict lookup.
+
+    The values of the matched keys are returned in the same order of
+    the mapping and the `combine` callable receives them to build the
+    result that is actually cached.
+    """
+
+    def __init__(self, mapping, combine=list):
+        self.mapping = mapping
+        self.combine = combine
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop the compiled patterns and all the cached results"""
+        with self.lock:
+            self.generation += 1
+            self.compiled = None
+            self.cache = {}
+
+    def build(self):
+        """Split exact keys from wildcards and compile the later ones,
+        returning both as an `(exact, patterns)` pair"""
+        exact = {}
+        patterns = []
+        for position, key in enumerate(list(self.mapping.keys())):
+            if WILDCARD_CHARS.search(key):
+                regex = re.compile(fnmatch.translate(key))
+                patterns.append((position, key, regex.match))
+            else:
+                exact[key] = position
+        return exact, patterns
+
+    def resolve(self, name):
+        """Return the combined values of all keys matching `name`
+
+        The index is shared by the threads of the listener and of the
+        background shipper. Results computed while the index was being
+        invalidated are returned but never cached.
+        """
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+
+        with self.lock:
+            generation = self.generation
+            if self.compiled is None:
+                self.compiled = self.build()
+            exact, patterns = self.compiled
+
+        matched = []
+        if name in exact:
+            matched.append((exact[name], name))
+        matched.extend((position, key) for position, key, match
+                       in patterns if match(name))
+        matched.sort()
+
+        result = self.combine([self.mapping[key] for _, key in matched])
+        with self.lock:
+            if self.generation == generation:
+                self.cache[name] = result
+        return result
+
+
+def _flatten(values):
+    return [item for value in values for item in value]
+
+
+# Dispatch indexes of the handler registries, keyed by the registry id
+# since `find_handlers()` can receive any registry.
+DISPATCH_INDEXES = {}
+
+
+def get_dispatch_index(registry):
+    """Return the `PatternIndex` that resolves handlers in `registry`"""
+    try:
+        return DISPATCH_INDEXES[id(registry)]
+    except KeyError:
+        index = DISPATCH_INDEXES[id(registry)] = \
+            PatternIndex(registry, combine=_flatten)
+        return index
+
+
+# Registered handlers by name, built by `get_handlers_by_name()`
+_handlers_by_name = None
+
+
+def invalidate_dispatch_indexes():
+    """Must be called every time a handler registry changes"""
+    global _handlers_by_name
+    for index in DISPATCH_INDEXES.values():
+        index.invalidate()
+    _handlers_by_name = None
+
 
 def parse_event_name(name):
     """Returns the python module and obj given an event name
@@ -60,20 +185,92 @@ def parse_event_to_name(event):
     return u"{}.{}".format(app_name, class_name)
 
 
+# Cache of the event classes already resolved by `find_event()`. Names
+# whose modules or classes are missing are also cached, pointing to the
+# message of the `EventNotFoundError` that must be raised for them.
+EVENT_CLASS_CACHE = {}
+
+
+class EventNotFound(object):
+    """Negative entry of the `EVENT_CLASS_CACHE`"""
+
+    def __init__(self, message):
+        self.message = message
+
+
 def find_event(name):
     """Actually import the event represented by name
 
     Raises the `EventNotFoundError` if it's not possible to find the
     event class refered by `name`.
+
+    Both found and missing events are cached, use the
+    `invalidate_event_cache()` function if the event modules change
+    after they were first looked up.
     """
     try:
-        module, klass = parse_event_name(name)
-        return getattr(import_module(module), klass)
-    except (ImportError, AttributeError):
-        raise EventNotFoundError(
-            ('Event "{}" not found. '
-             'Make sure you have a class called "{}" inside the "{}" '
-             'module.'.format(name, klass, module)))
+        event_cls = EVENT_CLASS_CACHE[name]
+    except KeyError:
+        event_cls = EVENT_CLASS_CACHE[name] = _import_event(name)
+    if isinstance(event_cls, EventNotFound):
+        raise EventNotFoundError(event_cls.message)
+    return event_cls
+
+
+def _import_event(name):
+    module_name, klass = parse_event_name(name)
+    message = (
+        'Event "{}" not found. '
+        'Make sure you have a class called "{}" inside the "{}" '
+        'module.'.format(name, klass, module_name))
+    try:
+        module = import_module(module_name)
+    except ImportError:
+        if _module_exists(module_name):
+            # The module failed while being imported, like in a circular
+            # import, so it's not cached and is tried again next time
+            raise EventNotFoundError(message)
+        return EventNotFound(message)
+    try:
+        return getattr(module, klass)
+    except AttributeError:
+        return EventNotFound(message)
+
+
+def _module_exists(name):
+    """Tells if the module `name` can be found, without importing it"""
+    parent = name.rpartition('.')[0]
+    if parent and not _module_exists(parent):
+        return False
+    try:
+        return pkgutil.find_loader(name) is not None
+    except ImportError:
+        # The parent package is there, but can't be imported
+        return True
+
+
+def invalidate_event_cache(name=None):
+    """Forget the class resolved for the event `name`, or for all events
+    if no name is informed.
+    """
+    if name:
+        EVENT_CLASS_CACHE.pop(name, None)
+    else:
+        EVENT_CLASS_CACHE.clear()
+
+
+def cache_event_module(app, module):
+    """Fill the `EVENT_CLASS_CACHE` with the classes found in `module`
+
+    Only the classes actually declared in the events module of `app`
+    are cached, since those are the ones reachable by an event name.
+    """
+    if '.' in app:
+        # Events of dotted apps can't be named in the "app.Klass" format
+        return
+    for attr, value in vars(module).items():
+        if isinstance(value, type) and value.__module__ == module.__name__:
+            EVENT_CLASS_CACHE[u'{}.{}'.format(app, attr)] = value
 
 
 def cleanup_handlers(event=None):
@@ -94,6 +291,8 @@ def cleanup_handlers(event=None):
     else:
         HANDLER_REGISTRY.clear()
         EXTERNAL_HANDLER_REGISTRY.clear()
+        HANDLER_NAMES.clear()
+    invalidate_dispatch_indexes()
 
 
 def find_handlers(event_name, registry=HANDLER_REGISTRY):
@@ -102,38 +301,199 @@ def find_handlers(event_name, registry=HANDLER_REGISTRY):
     If the event can't be found, an empty list will be returned, since
     this is an internal function and all validation against the event
     name and its existence was already performed.
-    """
-    handlers = []
 
+    Handlers are resolved through the dispatch index of the registry,
+    so the patterns are only matched the first time an event name is
+    seen after a change in the registry.
+    """
     # event_name can be a BaseEvent or the string representation
-    if isinstance(event_name, basestring):
-        matched_events = [event for event in registry.keys()
-            if fnmatch.fnmatchcase(event_name, event)]
-        for matched_event in matched_events:
-            handlers.extend(registry.get(matched_event))
-    else:
-        handlers = registry.get(find_event(event_name), [])
-
-    return handlers
+    if isinstance(event_name, string_types):
+        return list(get_dispatch_index(registry).resolve(event_name))
+    return registry.get(find_event(event_name), [])
 
 
 def find_external_handlers(event_name):
     return find_handlers(event_name, registry=EXTERNAL_HANDLER_REGISTRY)
 
 
-def process(event_name, data):
+def handler_name(handler):
+    """Return the dotted name that identifies `handler` in the settings,
+    the metrics and the tasks sent by `fan_out()`"""
+    try:
+        return HANDLER_NAMES[handler]
+    except (KeyError, TypeError):
+        return default_handler_name(handler)
+
+
+def default_handler_name(handler):
+    """Build the name of `handler` from its module and its own name
+
+    Methods are named after their classes too and `functools.partial`
+    objects after the function they wrap.
+    """
+    if isinstance(handler, functools.partial):
+        return default_handler_name(handler.func)
+    name = getattr(handler, '__qualname__', None)
+    if name is not None:
+        # Functions and classes declared inside functions
+        name = name.rsplit('<locals>.', 1)[-1]
+    else:
+        name = getattr(handler, '__name__', type(handler).__name__)
+        if isinstance(handler, types.MethodType):
+            # Python 2 methods don't have a `__qualname__`
+            name = u'{}.{}'.format(handler.im_class.__name__, name)
+    return u'{}.{}'.format(getattr(handler, '__module__', None), name)
+
+
+def register_handler_name(handler, name):
+    """Give `handler` a name of its own instead of the one built by
+    `default_handler_name()`"""
+    HANDLER_NAMES[handler] = name
+    return name
+
+
+def get_handlers_by_name():
+    """Return the handlers of both registries grouped by their names"""
+    global _handlers_by_name
+    handlers_by_name = _handlers_by_name
+    if handlers_by_name is None:
+        handlers_by_name = {}
+        for registry in (HANDLER_REGISTRY, EXTERNAL_HANDLER_REGISTRY):
+            for handlers in registry.values():
+                for handler in handlers:
+                    named = handlers_by_name.setdefault(
+                        handler_name(handler), [])
+                    if handler not in named:
+                        named.append(handler)
+        _handlers_by_name = handlers_by_name
+    return handlers_by_name
+
+
+def check_handler_name(name, handlers=None):
+    """Raise `HandlerNameError` if more than one of `handlers`, or of
+    all the registered handlers, is named `name`
+
+    Handlers can share names, like the lambdas of a module or the ones
+    declared in a loop, until a name must point to a single handler: to
+    be sent to the workers by `fan_out()` or to be found in the
+    `EVENTLIB_HANDLER_ROUTES` and `EVENTLIB_HANDLER_TIMEOUTS` settings.
+    """
+    if handlers is None:
+        named = get_handlers_by_name().get(name, ())
+    else:
+        named = []
+        for handler in handlers:
+            if handler not in named and handler_name(handler) == name:
+                named.append(handler)
+    if len(named) > 1:
+        raise HandlerNameError(
+            (u'The handler name "{}" is shared by {} handlers, register '
+             u'them with names of their own').format(name, len(named)))
+
+
+def get_handler_timeout(name):
+    """Return the timeout of the handler `name`, making sure a timeout
+    declared for that name only applies to a single handler"""
+    if name in (getsetting('EVENTLIB_HANDLER_TIMEOUTS') or {}):
+        check_handler_name(name)
+    return get_timeout(name)
+
+
+def is_batch_handler(handler):
+    """Tells if `handler` was registered to receive lists of events"""
+    return getattr(handler, 'batch_handler', False) is True
+
+
+def run_handler(event_name, handler, data, sink):
+    """Execute a single handler, measuring how long it takes
+
+    Failures are logged and counted, but the exception is only raised
+    again when we're debugging. Handlers taking longer than the
+    `EVENTLIB_SLOW_HANDLER_THRESHOLD` setting (in milliseconds) are
+    also logged.
+
+    Handlers are interrupted when they time out and skipped for a while
+    when they keep failing, see the `guards` module.
+    """
+    name = handler_name(handler)
+    breaker = get_breaker(name)
+    if breaker is not None and not breaker.allow():
+        sink.incr(u'handlers.{}.skipped'.format(name))
+        return
+
+    timeout = get_handler_timeout(name)
+    started = time.time()
+    try:
+        call_with_timeout(handler, data, timeout)
+    except Exception as exc:
+        handler_failed(event_name, name, exc, breaker, sink)
+        if getsetting('DEBUG'):
+            raise exc
+    else:
+        handler_succeeded(name, breaker)
+    finally:
+        handler_finished(event_name, name, started, sink)
+
+
+def handler_failed(event_name, name, exc, breaker, sink):
+    """Count and log the failure of the handler `name`, opening its
+    breaker when it fails too often"""
+    sink.incr(u'handlers.{}.failed'.format(name))
+    sink.incr(u'events.{}.failed'.format(event_name))
+    if isinstance(exc, HandlerTimeoutError):
+        sink.incr(u'handlers.{}.timeout'.format(name))
+    logger.warning(
+        (u'One of the handlers for the event "{}" has failed with the '
+         u'following exception: {}').format(event_name, str(exc)))
+    if breaker is not None and breaker.failure():
+        logger.warning(
+            (u'The handler "{}" failed {} times in a row and will be '
+             u'skipped for {}s').format(
+                 name, breaker.failures, breaker.reset_timeout))
+
+
+def handler_succeeded(name, breaker):
+    """Close the breaker of the handler `name` if it was open"""
+    if breaker is not None and breaker.success():
+        logger.info(u'The handler "{}" is back to work'.format(name))
+
+
+def handler_finished(event_name, name, started, sink):
+    """Measure the handler `name` that started at `started`, logging it
+    when it's too slow"""
+    elapsed = (time.time() - started) * 1000
+    sink.timing(u'handlers.{}'.format(name), elapsed)
+    threshold = getsetting('EVENTLIB_SLOW_HANDLER_THRESHOLD')
+    if threshold is not None and elapsed >= threshold:
+        logger.warning(
+            (u'The handler "{}" took {:.1f}ms to process the event '
+             u'"{}"').format(name, elapsed, event_name))
+
+
+def process(event_name, data, batches=None):
     """Iterates over the event handler registry and execute each found
     handler.
 
     It takes the event name and its its `data`, passing the return of
-    `ejson.loads(data)` to the found handlers.
+    `serializers.loads(data)` to the found handlers. Batch handlers
+    receive a list with the deserialized data as its only item, unless
+    a `batches` dictionary is informed. In that case, the data is added
+    to the list found under the `(event_name, handler)` key and the
+    caller is responsible for running the handler later.
+
+    The time spent cleaning the data, running each handler and
+    broadcasting the event is reported to the metrics sink.
     """
+    sink = get_sink()
+    sink.incr(u'events.{}.processed'.format(event_name))
     deserialized = loads(data)
     event_cls = find_event(event_name)
     event = event_cls(event_name, deserialized)
     try:
-        event.clean()
+        with Timer(sink, u'events.{}.clean'.format(event_name)):
+            event.clean()
     except ValidationError as exc:
+        sink.incr(u'events.{}.invalid'.format(event_name))
         if os.environ.get('EVENTLIB_RAISE_ERRORS'):
             raise
         else:
@@ -143,16 +503,134 @@ def process(event_name, data):
                     event_name, data, str(exc)))
             return
 
-    for handler in find_handlers(event_name):
+    fanout = fanout_enabled()
+    with Timer(sink, u'events.{}.handlers'.format(event_name)):
+        remote = []
+        for handler in find_handlers(event_name):
+            if batches is not None and is_batch_handler(handler):
+                batches.setdefault((event_name, handler), []).append(
+                    deserialized)
+            elif fanout:
+                remote.append(handler)
+            elif is_batch_handler(handler):
+                run_handler(event_name, handler, [deserialized], sink)
+            else:
+                run_handler(event_name, handler, deserialized, sink)
+        if remote:
+            fan_out(event_name, remote, [deserialized])
+    with Timer(sink, u'events.{}.broadcast'.format(event_name)):
+        event._broadcast(data)
+
+
+def process_batch(events):
+    """Process a sequence of `(event_name, data)` pairs
+
+    Each event is processed by the `process()` function. A failure in
+    one of them is logged and doesn't stop the rest of the batch from
+    being processed, unless we're debugging.
+
+    Batch handlers are called after all the events are processed, once
+    per event name, with the list of the data of the valid events with
+    that name.
+    """
+    sink = get_sink()
+    batches = OrderedDict()
+    for event_name, data in events:
         try:
-            handler(deserialized)
+            process(event_name, data, batches)
         except Exception as exc:
             logger.warning(
-                (u'One of the handlers for the event "{}" has failed with the '
-                 u'following exception: {}').format(event_name, str(exc)))
-            if getsetting('DEBUG'):
-                raise exc
-    event._broadcast()
+                (u'The event "{}" could not be processed in a batch and '
+                 u'failed with the following exception: {}').format(
+                     event_name, str(exc)))
+            if getsetting('DEBUG') or os.environ.get('EVENTLIB_RAISE_ERRORS'):
+                raise
+
+    if not fanout_enabled():
+        for (event_name, handler), items in batches.items():
+            run_handler(event_name, handler, items, sink)
+        return
+
+    # All the batch handlers of an event name got the same items
+    remote = OrderedDict()
+    for (event_name, handler), items in batches.items():
+        remote.setdefault(event_name, ([], items))[0].append(handler)
+    for event_name, (handlers, items) in remote.items():
+        fan_out(event_name, handlers, items)
+
+
+def fanout_enabled():
+    """Tells if the handlers run in their own tasks, see `fan_out()`"""
+    return (getsetting('EVENTLIB_DISPATCH_MODE') in ('handler', 'route') and
+            not getsetting('DEBUG'))
+
+
+def fan_out(event_name, handlers, items):
+    """Send `handlers` to the celery workers instead of running them here
+
+    The handlers receive the event data found in the `items` list, see
+    `run_handlers()`. The tasks are sent at once as a celery group and
+    are split according to the `EVENTLIB_DISPATCH_MODE` setting:
+
+      * `'handler'`: one task per handler
+      * `'route'`: one task per route, so the handlers sent to the same
+        queue run one after another in the same task
+
+    Tasks are sent with the options of the event, see
+    `get_task_options()`. The `EVENTLIB_HANDLER_ROUTES` setting maps
+    handler names, as built by `handler_name()`, to options that are
+    applied on top of those, so heavy handlers can go to their own
+    queues and workers:
+
+        >>> EVENTLIB_HANDLER_ROUTES = {
+        ...     'deal.handlers.resize_images': {'queue': 'images'},
+        ... }
+    """
+    routes = getsetting('EVENTLIB_HANDLER_ROUTES') or {}
+    per_route = getsetting('EVENTLIB_DISPATCH_MODE') == 'route'
+    event_options = get_task_options(event_name)
+    groups = OrderedDict()
+    for handler in handlers:
+        name = handler_name(handler)
+        check_handler_name(name, handlers)
+        options = event_options
+        if name in routes:
+            check_handler_name(name)
+            options = dict(event_options, **routes[name])
+        key = options_key(options) if per_route else name
+        options, names = groups.setdefault(key, (options, []))
+        if name not in names:
+            names.append(name)
+
+    payload = task_payload(dumps(items))
+    celery.group([
+        tasks.run_handlers_task.subtask((event_name, names, payload),
+                                        **options)
+        for options, names in groups.values()
+    ]).apply_async()
+
+
+def run_handlers(event_name, names, items):
+    """Run the handlers of `event_name` sent by `fan_out()`
+
+    Handlers are found by their names in `names`. Batch handlers receive
+    the whole `items` list and the other ones are called once per item.
+    """
+    sink = get_sink()
+    found = False
+    for handler in find_handlers(event_name):
+        if handler_name(handler) not in names:
+            continue
+        found = True
+        if is_batch_handler(handler):
+            run_handler(event_name, handler, items, sink)
+        else:
+            for data in items:
+                run_handler(event_name, handler, data, sink)
+    if not found:
+        logger.warning(
+            u'None of the handlers {} was found for the event "{}"'.format(
+                ', '.join(names), event_name))
 
 
 def process_external(event_name, data):
@@ -160,49 +638,160 @@ def process_external(event_name, data):
     handler.
 
     It takes the event name and its `data`, passing the return of
-    data to the found handlers.
+    data to the found handlers. Batch handlers receive a list with the
+    `data` as its only item.
     """
+    sink = get_sink()
+    sink.incr(u'events.{}.external'.format(event_name))
     for handler in find_external_handlers(event_name):
-        try:
-            handler(data)
-        except Exception as exc:
-            logger.warning(
-                (u'One of the handlers for the event "{}" has failed with the '
-                 u'following exception: {}').format(event_name, str(exc)))
-            if getsetting('DEBUG'):
-                raise exc
+        if is_batch_handler(handler):
+            run_handler(event_name, handler, [data], sink)
+        else:
+            run_handler(event_name, handler, data, sink)
+
+
+def process_external_batch(events):
+    """Execute the external handlers of a sequence of `(event_name, data)`
+    pairs
+
+    Regular handlers are called once per event, in order. Batch handlers
+    are called after them, once per event name, with the list of the
+    data of all the events with that name found in the batch.
+    """
+    sink = get_sink()
+    batches = OrderedDict()
+    for event_name, data in events:
+        sink.incr(u'events.{}.external'.format(event_name))
+        for handler in find_external_handlers(event_name):
+            if is_batch_handler(handler):
+                batches.setdefault((event_name, handler), []).append(data)
+            else:
+                run_handler(event_name, handler, data, sink)
+    for (event_name, handler), items in batches.items():
+        run_handler(event_name, handler, items, sink)
+
+
+def _merge(values):
+    result = {}
+    for value in values:
+        result.update(value)
+    return result
+
+
+_event_routes = None
+
+# Used when there are no routes in the settings, so the index isn't
+# built again on every call
+NO_ROUTES = {}
+
+
+def get_task_options(event_name):
+    """Return the options used to send the task that processes an event
+
+    Options are passed to `apply_async()`, so events can be sent to
+    their own queues with their own priority and expiration. They're
+    declared in the `task_options` attribute of the event class:
+
+        >>> class PageViewed(BaseEvent):
+        ...     task_options = {'queue': 'analytics', 'expires': 300}
+
+    Or in the `EVENTLIB_EVENT_ROUTES` setting, that maps event names or
+    patterns to options and takes precedence over the event classes.
+    The options of all the matching keys are merged in the order of the
+    mapping, so use an `OrderedDict` when the keys overlap:
+
+        >>> EVENTLIB_EVENT_ROUTES = {'analytics.*': {'queue': 'bulk'}}
+    """
+    global _event_routes
+    routes = getsetting('EVENTLIB_EVENT_ROUTES') or NO_ROUTES
+    if _event_routes is None or _event_routes.mapping is not routes:
+        _event_routes = PatternIndex(routes, combine=_merge)
+
+    try:
+        event_cls = find_event(event_name)
+    except (InvalidEventNameError, EventNotFoundError):
+        # Validating the events is up to `log()`, the worker will
+        # complain about it anyway
+        event_cls = None
+    options = dict(getattr(event_cls, 'task_options', None) or {})
+    options.update(_event_routes.resolve(event_name))
+    return options
+
+
+def group_by_task_options(events):
+    """Split `(event_name, data)` pairs in lists of events that share the
+    same task options, returning `(options, events)` pairs"""
+    groups = OrderedDict()
+    for event_name, data in events:
+        options = get_task_options(event_name)
+        groups.setdefault(options_key(options), (options, []))[1].append(
+            (event_name, data))
+    return list(groups.values())
+
+
+def options_key(options):
+    """Return a hashable key of task options, which can hold dicts like
+    `retry_policy` and `headers`"""
+    return json.dumps(options, sort_keys=True, default=repr)
+
+
+def apply_task(task, args, options):
+    """Send `task`, with `delay()` unless there are options to apply"""
+    if options:
+        return task.apply_async(args, **options)
+    return task.delay(*args)
 
 
 def get_default_values(data):
     """Return all default values that an event should have"""
-    request = data.get('request')
     result = {}
-    result['__datetime__'] = datetime.now()
-    result['__ip_address__'] = request and get_ip(request) or '0.0.0.0'
+    set_default_values(result, data.get('request'))
     return result
 
 
+def set_default_values(data, request=None):
+    """Write the default values straight into `data`
+
+    Used by `log()` to avoid building a dictionary per event just to
+    merge it into the event data.
+    """
+    data['__datetime__'] = datetime.now()
+    data['__ip_address__'] = request and get_ip(request) or '0.0.0.0'
+    return data
+
+
+BANNED_KEYS = ('request',)
+
+
 def filter_data_values(data):
     """Remove special values that log function can take
 
     There are some special values, like "request" that the `log()`
     function can take, but they're not meant to be passed to the celery
     task neither for the event handlers. This function filter these keys
-    and return another dict without them.
+    and return another dict without them. When none of them is present,
+    `data` itself is returned instead of a copy.
     """
-    banned = ('request',)
-    return {key: val for key, val in data.items() if not key in banned}
+    for key in BANNED_KEYS:
+        if key in data:
+            break
+    else:
+        return data
+    return {key: val for key, val in data.items() if key not in BANNED_KEYS}
 
 
 def import_event_modules():
     """Import all events declared for all currently installed apps
 
     This function walks through the list of installed apps and tries to
-    import a module named `EVENTS_MODULE_NAME`.
+    import a module named `EVENTS_MODULE_NAME`. The event classes found
+    are used to pre-warm the cache of the `find_event()` function.
     """
     for installed_app in getsetting('INSTALLED_APPS'):
         module_name = u'{}.{}'.format(installed_app, EVENTS_MODULE_NAME)
         try:
-            import_module(module_name)
+            module = import_module(module_name)
         except ImportError:
             pass
+        else:
+            cache_event_module(installed_app, module)
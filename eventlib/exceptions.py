@@ -18,6 +18,7 @@
 
 __all__ = (
     'ValidationError', 'EventNotFoundError', 'InvalidEventNameError',
+    'SerializerNotFoundError', 'HandlerTimeoutError', 'HandlerNameError',
 )
 
 
@@ -32,3 +33,16 @@ class EventNotFoundError(Exception):
 class ValidationError(Exception):
     """Raised when a problem with data passed to an event class is found
     """
+
+
+class SerializerNotFoundError(Exception):
+    """Raised when the configured serializer is not registered"""
+
+
+class HandlerTimeoutError(Exception):
+    """Raised when a handler takes longer than its timeout"""
+
+
+class HandlerNameError(Exception):
+    """Raised when a handler name that must be unique is shared by many
+    handlers"""
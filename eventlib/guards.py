@@ -0,0 +1,254 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Protections against handlers that hang or keep failing
+
+Handlers are called by `core.run_handler()` with a timeout and behind a
+circuit breaker, when they're enabled by the settings:
+
+  * `EVENTLIB_HANDLER_TIMEOUT`: seconds a handler can take (`None`)
+  * `EVENTLIB_HANDLER_TIMEOUTS`: timeouts of specific handlers, keyed by
+    their names as built by `core.handler_name()` (`{}`)
+  * `EVENTLIB_HANDLER_TIMEOUT_THREADS`: threads that run the handlers
+    with a timeout outside the main thread (10)
+  * `EVENTLIB_BREAKER_THRESHOLD`: failures in a row that make a handler
+    be skipped (`None`)
+  * `EVENTLIB_BREAKER_RESET_TIMEOUT`: seconds a handler is skipped
+    before it's tried again (30)
+
+Breakers live in memory, so each worker and listener process keeps
+track of its own failures.
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+
+from .compat import Queue
+from .conf import getsetting
+from .exceptions import HandlerTimeoutError
+
+
+logger = logging.getLogger('event')
+
+
+def get_timeout(name):
+    """Return the timeout of the handler `name`, in seconds"""
+    timeouts = getsetting('EVENTLIB_HANDLER_TIMEOUTS') or {}
+    return timeouts.get(name, getsetting('EVENTLIB_HANDLER_TIMEOUT'))
+
+
+def call_with_timeout(func, arg, timeout):
+    """Call `func(arg)`, raising `HandlerTimeoutError` if it takes more
+    than `timeout` seconds
+
+    In the main thread, like in the celery workers, the call is
+    interrupted by a `SIGALRM`. Anywhere else, like in the threads of
+    the listener, signals can't be used, so `func` runs in a thread of
+    the `ThreadPool` and is abandoned when it times out. It can't be
+    stopped and keeps its thread busy until it returns.
+    """
+    if not timeout:
+        return func(arg)
+    if can_use_alarm():
+        return _call_with_alarm(func, arg, timeout)
+    return get_thread_pool().call(func, arg, timeout)
+
+
+def can_use_alarm():
+    """Tells if `SIGALRM` is available and not used by anyone else"""
+    return (hasattr(signal, 'setitimer') and
+            isinstance(threading.current_thread(), threading._MainThread) and
+            signal.getitimer(signal.ITIMER_REAL)[0] == 0)
+
+
+def _call_with_alarm(func, arg, timeout):
+    def expire(signum, frame):
+        raise HandlerTimeoutError(
+            u'The handler took more than {}s'.format(timeout))
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(arg)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class ThreadPool(object):
+    """Threads that run the handlers called with a timeout
+
+    Threads are started on demand, up to `size` of them, and are reused
+    by the following calls. A thread running a handler that timed out
+    only goes back to the pool when the handler returns, so handlers
+    that hang can't start new threads forever: when all the threads are
+    busy, calls fail right away with a `HandlerTimeoutError`.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.idle = []
+        self.threads = 0
+
+    def call(self, func, arg, timeout):
+        """Call `func(arg)` in one of the threads, waiting `timeout`
+        seconds for it to return"""
+        tasks = self.acquire()
+        done = threading.Event()
+        outcome = {}
+        tasks.put((func, arg, outcome, done))
+        if not done.wait(timeout):
+            raise HandlerTimeoutError(
+                u'The handler took more than {}s'.format(timeout))
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('result')
+
+    def acquire(self):
+        """Return the task queue of an idle thread, starting a new one
+        if there's room for it"""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            if self.threads >= self.size:
+                logger.warning(
+                    (u'All the {} threads that run the handlers with a '
+                     u'timeout are busy, probably with handlers that '
+                     u'hang').format(self.size))
+                raise HandlerTimeoutError(
+                    u'There are no threads left to run the handler')
+            self.threads += 1
+        tasks = Queue()
+        thread = threading.Thread(target=self.work, args=(tasks,))
+        thread.daemon = True
+        thread.start()
+        return tasks
+
+    def work(self, tasks):
+        while True:
+            func, arg, outcome, done = tasks.get()
+            try:
+                outcome['result'] = func(arg)
+            except BaseException as exc:
+                outcome['error'] = exc
+            # Back to the pool before the caller is woken up, so its
+            # next call finds the thread idle
+            with self.lock:
+                self.idle.append(tasks)
+            done.set()
+
+
+_thread_pool = None
+
+_thread_pool_lock = threading.Lock()
+
+
+def get_thread_pool():
+    """Return the thread pool of this process"""
+    global _thread_pool
+    pool = _thread_pool
+    if pool is None or pool.pid != os.getpid():
+        with _thread_pool_lock:
+            pool = _thread_pool
+            if pool is None or pool.pid != os.getpid():
+                pool = _thread_pool = ThreadPool(
+                    getsetting('EVENTLIB_HANDLER_TIMEOUT_THREADS', 10))
+    return pool
+
+
+class CircuitBreaker(object):
+    """Skips a handler after `threshold` failures in a row
+
+    The breaker opens when the handler fails `threshold` times in a row
+    and stays open for `reset_timeout` seconds, skipping the handler.
+    After that, a single call is let through to probe the handler: the
+    breaker closes again if it succeeds and stays open for another
+    `reset_timeout` seconds if it fails.
+    """
+
+    def __init__(self, threshold, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """Tells if the handler can be called now"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or \
+                    time.time() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def success(self):
+        """Record a successful call, returning `True` if it closed the
+        breaker"""
+        with self.lock:
+            closed = self.opened_at is not None
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            return closed
+
+    def failure(self):
+        """Record a failed call, returning `True` if it opened the
+        breaker"""
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                opened = self.opened_at is None
+                self.opened_at = time.time()
+                self.probing = False
+                return opened
+            return False
+
+
+BREAKERS = {}
+
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return the breaker of the handler `name`, or `None` when the
+    breakers are disabled"""
+    threshold = getsetting('EVENTLIB_BREAKER_THRESHOLD')
+    if not threshold:
+        return None
+    try:
+        return BREAKERS[name]
+    except KeyError:
+        with _breakers_lock:
+            return BREAKERS.setdefault(name, CircuitBreaker(
+                threshold,
+                getsetting('EVENTLIB_BREAKER_RESET_TIMEOUT', 30)))
+
+
+def reset_breakers():
+    """Forget the failures of all the handlers"""
+    BREAKERS.clear()
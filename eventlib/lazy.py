@@ -0,0 +1,50 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Deferred imports of the heavy dependencies
+
+Celery, redis, ejson and the django settings take most of the time
+spent importing eventlib. The modules that use them hold a `LazyImport`
+in their place, which imports the real thing when one of its attributes
+is accessed for the first time. Scripts that just register handlers
+don't pay for what they don't use.
+"""
+
+from importlib import import_module
+
+
+class LazyImport(object):
+    """Stands for the module `name`, or for its `attribute`, until it's
+    used"""
+
+    def __init__(self, name, attribute=None):
+        self._name = name
+        self._attribute = attribute
+        self._target = None
+
+    def _resolve(self):
+        if self._target is None:
+            target = import_module(self._name)
+            if self._attribute is not None:
+                target = getattr(target, self._attribute)
+            self._target = target
+        return self._target
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __repr__(self):
+        return '<LazyImport {}{}>'.format(
+            self._name, ':' + self._attribute if self._attribute else '')
@@ -13,25 +13,256 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from ejson import loads
-from eventlib.core import process_external, import_event_modules
+import logging
+import multiprocessing
+import threading
+import time
+
+from eventlib.compat import Full, Queue
+from eventlib.conf import getsetting
+from eventlib.core import (
+    EXTERNAL_HANDLER_REGISTRY, process_external, process_external_batch,
+    import_event_modules)
+from eventlib.transport import (
+    decode_message, get_stream_reader, subscriptions)
 from eventlib.util import redis_connection
 
 
+logger = logging.getLogger('event')
+
+
+class WorkerPool(object):
+    """Runs the external handlers in a pool of threads or processes
+
+    Messages read from the bus are put in bounded queues consumed by the
+    workers. When `ordered` is true, each worker has its own queue and
+    all the events with the same name go to the same worker, so they're
+    handled in the order they were received. Otherwise, all workers
+    share a single queue.
+
+    The `overflow` policy tells what happens when a queue is full:
+    `'block'` waits for room, slowing down the reader, and `'drop'`
+    discards the message with a warning.
+    """
+
+    BACKENDS = {
+        'thread': (threading.Thread, Queue),
+        'process': (multiprocessing.Process, multiprocessing.Queue),
+    }
+
+    def __init__(self, workers, backend='thread', queue_size=1000,
+                 overflow='block', ordered=False):
+        worker_cls, queue_cls = self.BACKENDS[backend]
+        self.overflow = overflow
+        self.queues = [queue_cls(queue_size)
+                       for _ in range(workers if ordered else 1)]
+        self.workers = []
+        for i in range(workers):
+            queue = self.queues[i % len(self.queues)]
+            worker = worker_cls(target=work, args=(queue,))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, event_name, data):
+        """Queue an event to be handled by one of the workers"""
+        queue = self.queues[hash(event_name) % len(self.queues)]
+        self.put(queue, (event_name, data),
+                 u'the event "{}"'.format(event_name))
+
+    def submit_batch(self, events):
+        """Queue a list of `(event_name, data)` pairs to be handled
+        together by the workers
+
+        With ordered queues, the batch is split by queue, keeping the
+        events with the same name in the same worker.
+        """
+        batches = [[] for _ in self.queues]
+        for event_name, data in events:
+            batches[hash(event_name) % len(self.queues)].append(
+                (event_name, data))
+        for queue, batch in zip(self.queues, batches):
+            if batch:
+                # A `None` name tells the worker that it's a batch
+                self.put(queue, (None, batch),
+                         u'a batch of {} events'.format(len(batch)))
+
+    def put(self, queue, item, description):
+        if self.overflow == 'drop':
+            try:
+                queue.put_nowait(item)
+            except Full:
+                logger.warning(
+                    u'The listener queue is full, dropping {}'.format(
+                        description))
+        else:
+            queue.put(item)
+
+    def close(self):
+        """Wait for the workers to handle all the queued events"""
+        for i in range(len(self.workers)):
+            self.queues[i % len(self.queues)].put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def work(queue):
+    """Consume events from `queue` until a `None` is found"""
+    for event_name, data in iter(queue.get, None):
+        try:
+            if event_name is None:
+                process_external_batch(data)
+            else:
+                process_external(event_name, data)
+        except Exception:
+            logger.exception(
+                u'The listener failed to process the event "{}"'.format(
+                    event_name or u', '.join(sorted(
+                        set(name for name, _ in data)))))
+
+
+def get_worker_pool():
+    """Return a `WorkerPool` configured by the following settings
+
+      * `EVENTLIB_LISTENER_WORKERS`: number of workers (0)
+      * `EVENTLIB_LISTENER_BACKEND`: `'thread'` or `'process'`
+      * `EVENTLIB_LISTENER_QUEUE_SIZE`: max events per queue (1000)
+      * `EVENTLIB_LISTENER_OVERFLOW`: `'block'` or `'drop'`
+      * `EVENTLIB_LISTENER_ORDERED`: keep the order per event name
+
+    If no workers are configured, `None` is returned and the handlers
+    run inline, in the same loop that reads the messages.
+    """
+    workers = getsetting('EVENTLIB_LISTENER_WORKERS', 0)
+    if not workers:
+        return None
+    return WorkerPool(
+        workers,
+        backend=getsetting('EVENTLIB_LISTENER_BACKEND', 'thread'),
+        queue_size=getsetting('EVENTLIB_LISTENER_QUEUE_SIZE', 1000),
+        overflow=getsetting('EVENTLIB_LISTENER_OVERFLOW', 'block'),
+        ordered=getsetting('EVENTLIB_LISTENER_ORDERED', False))
+
+
+def dispatch(pool, message):
+    """Hand a broadcasted message to the pool or to its handlers"""
+    event_name, data = decode_message(message)
+    if event_name is not None:
+        if pool:
+            pool.submit(event_name, data)
+        else:
+            process_external(event_name, data)
+
+
+def dispatch_batch(pool, messages):
+    """Hand a list of broadcasted messages to the pool or to their
+    handlers, so batch handlers receive all of them at once"""
+    events = [event for event in map(decode_message, messages)
+              if event[0] is not None]
+    if not events:
+        return
+    if pool:
+        pool.submit_batch(events)
+    else:
+        process_external_batch(events)
+
+
+def subscribe(conn):
+    """Subscribe to the channels where the handled events are published
+
+    The subscriptions are computed from the external handlers found in
+    the registry, see `transport.subscriptions()`.
+    """
+    channels, patterns = subscriptions(EXTERNAL_HANDLER_REGISTRY)
+    pubsub = conn.pubsub()
+    if channels:
+        pubsub.subscribe(*channels)
+    if patterns:
+        pubsub.psubscribe(*patterns)
+    return pubsub
+
+
+def read_pubsub(conn, pool):
+    for message in subscribe(conn).listen():
+        if message['type'] not in ('message', 'pmessage'):
+            continue
+        dispatch(pool, message["data"])
+
+
+def drain(pubsub, size, timeout):
+    """Yield lists of messages read with the non-blocking `get_message()`
+
+    A batch is complete when it has `size` messages or when `timeout`
+    seconds have passed since its first message arrived.
+    """
+    while pubsub.subscribed:
+        batch = []
+        deadline = None
+        while len(batch) < size:
+            wait = 1.0 if deadline is None else deadline - time.time()
+            message = pubsub.get_message(timeout=max(wait, 0))
+            if message is None:
+                if deadline is not None and time.time() >= deadline:
+                    break
+                if not pubsub.subscribed:
+                    break
+                continue
+            if message['type'] not in ('message', 'pmessage'):
+                continue
+            if deadline is None:
+                deadline = time.time() + timeout
+            batch.append(message['data'])
+        if batch:
+            yield batch
+
+
+def read_pubsub_batches(conn, pool, size, timeout):
+    for messages in drain(subscribe(conn), size, timeout):
+        dispatch_batch(pool, messages)
+
+
+def read_stream(conn, pool):
+    """Read the `eventlib` stream through the consumer group
+
+    Messages are handled in the batches read from the stream and are
+    acknowledged once their batch is handled or, when a worker pool is
+    used, once they're queued in the pool.
+    """
+    reader = get_stream_reader(conn)
+    for entries in reader.read():
+        dispatch_batch(pool, [message for entry_id, message in entries
+                              if message is not None])
+        reader.ack([entry_id for entry_id, message in entries])
+
+
 def listen_for_events():
     """Pubsub event listener
 
     Listen for events in the pubsub bus and calls the process function
-    when somebody comes to play.
+    when somebody comes to play. When the `EVENTLIB_TRANSPORT` setting
+    is `'streams'`, the events are read from the `eventlib` stream
+    instead.
+
+    Pubsub messages are handled one by one, unless batches are enabled
+    by the following settings:
+
+      * `EVENTLIB_LISTENER_BATCH_SIZE`: max messages per batch (0)
+      * `EVENTLIB_LISTENER_BATCH_TIMEOUT`: seconds waiting for a batch
+        to be filled after its first message arrives (0.05)
     """
     import_event_modules()
     conn = redis_connection.get_connection()
-    pubsub = conn.pubsub()
-    pubsub.subscribe("eventlib")
-    for message in pubsub.listen():
-        if message['type'] != 'message':
-            continue
-        data = loads(message["data"])
-        if 'name' in data:
-            event_name = data.pop('name')
-            process_external(event_name, data)
+    pool = get_worker_pool()
+    try:
+        batch_size = getsetting('EVENTLIB_LISTENER_BATCH_SIZE', 0)
+        if getsetting('EVENTLIB_TRANSPORT', 'pubsub') == 'streams':
+            read_stream(conn, pool)
+        elif batch_size:
+            read_pubsub_batches(
+                conn, pool, batch_size,
+                getsetting('EVENTLIB_LISTENER_BATCH_TIMEOUT', 0.05))
+        else:
+            read_pubsub(conn, pool)
+    finally:
+        if pool:
+            pool.close()
@@ -0,0 +1,137 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Sinks for the timings and counters collected while processing events
+
+The sink is chosen by the `EVENTLIB_METRICS_SINK` setting, that must be
+either a sink instance or the dotted path of a `MetricsSink` subclass.
+Classes are instantiated with the keyword arguments found in the
+`EVENTLIB_METRICS_OPTIONS` setting:
+
+    >>> EVENTLIB_METRICS_SINK = 'eventlib.metrics.StatsdSink'
+    >>> EVENTLIB_METRICS_OPTIONS = {'host': 'statsd', 'port': 8125}
+
+Metric names are built with the event names and the handler names
+(`module.function`), like `events.deal.ActionLog.clean` or
+`handlers.deal.handlers.save_action.failed`.
+"""
+
+import socket
+import threading
+import time
+
+from collections import defaultdict
+from importlib import import_module
+
+from .conf import getsetting
+from .compat import string_types
+
+
+class MetricsSink(object):
+    """Base class of the metrics sinks, it just discards everything"""
+
+    def timing(self, name, value):
+        """Record that `name` took `value` milliseconds"""
+
+    def incr(self, name, count=1):
+        """Increment the counter `name` by `count`"""
+
+
+class InMemorySink(MetricsSink):
+    """Keeps the metrics in memory, useful for tests and debugging"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all the metrics collected so far"""
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(list)
+
+    def timing(self, name, value):
+        with self.lock:
+            self.timings[name].append(value)
+
+    def incr(self, name, count=1):
+        with self.lock:
+            self.counters[name] += count
+
+
+class StatsdSink(MetricsSink):
+    """Sends the metrics to a statsd server through UDP
+
+    Metrics are fire and forget, errors while sending them are ignored.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='eventlib'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, stat):
+        try:
+            self.socket.sendto(stat.encode('utf-8'), self.address)
+        except socket.error:
+            pass
+
+    def timing(self, name, value):
+        self.send(u'{}.{}:{:.3f}|ms'.format(self.prefix, name, value))
+
+    def incr(self, name, count=1):
+        self.send(u'{}.{}:{}|c'.format(self.prefix, name, count))
+
+
+class Timer(object):
+    """Context manager that reports the time spent in its block"""
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+        self.elapsed = None
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = (time.time() - self.started) * 1000
+        self.sink.timing(self.name, self.elapsed)
+
+
+_sink = None
+_sink_path = None
+
+
+def get_sink():
+    """Return the sink configured in the settings
+
+    The sink is built once and rebuilt only if `EVENTLIB_METRICS_SINK`
+    changes. If it's not set, a `MetricsSink` that discards everything
+    is returned.
+    """
+    global _sink, _sink_path
+    path = getsetting('EVENTLIB_METRICS_SINK')
+    if _sink is None or path != _sink_path:
+        if not path:
+            _sink = MetricsSink()
+        elif isinstance(path, string_types):
+            module, klass = path.rsplit('.', 1)
+            sink_cls = getattr(import_module(module), klass)
+            _sink = sink_cls(**getsetting('EVENTLIB_METRICS_OPTIONS', {}))
+        else:
+            _sink = path
+        _sink_path = path
+    return _sink
@@ -0,0 +1,135 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Registry of the serializers used to send the event data through the
+wire
+
+The serializer used to encode new payloads is chosen by the
+`EVENTLIB_SERIALIZER` setting. Payloads written by any serializer but
+the default one start with a marker containing the serializer name, so
+the `loads()` function can decode payloads of all registered formats.
+That makes it possible to switch the serializer without stopping the
+workers that are still running the previous configuration.
+
+Payloads are sent to the celery tasks as text, so they can go through
+any task serializer, including JSON. `task_payload()` encodes the ones
+written by binary serializers, like msgpack, with base64.
+
+The `msgpack` serializer is registered when the msgpack package is
+installed. On Python 2.7, only the releases before 1.0 ship its C
+extension, and the pure Python fallback is slower than ejson, so pin
+`msgpack<1.0` there.
+"""
+
+import base64
+
+from .conf import getsetting
+from .exceptions import SerializerNotFoundError
+from .lazy import LazyImport
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Importing ejson also loads its converters of the datetime and decimal
+# types, from the `ejson.serializers` module
+ejson = LazyImport('ejson')
+
+DEFAULT_SERIALIZER = 'ejson'
+
+MARKER = b'\x00'
+
+BASE64_MARKER = u'\x01'
+
+REGISTRY = {}
+
+
+def register_serializer(name, dumps, loads):
+    """Register the `dumps` and `loads` functions of a serializer"""
+    REGISTRY[name] = (dumps, loads)
+
+
+def get_serializer(name):
+    """Return the `(dumps, loads)` pair of the serializer `name`"""
+    try:
+        return REGISTRY[name]
+    except KeyError:
+        raise SerializerNotFoundError(
+            u'There is no serializer called "{}" registered'.format(name))
+
+
+def dumps(data):
+    """Serialize `data` with the serializer chosen in the settings
+
+    Raises `TypeError` if `data` can't be serialized.
+    """
+    name = getsetting('EVENTLIB_SERIALIZER', DEFAULT_SERIALIZER)
+    payload = get_serializer(name)[0](data)
+    if name == DEFAULT_SERIALIZER:
+        return payload
+    return MARKER + name.encode('ascii') + MARKER + payload
+
+
+def loads(payload):
+    """Deserialize a payload written by any of the registered serializers
+    """
+    payload = binary_payload(payload)
+    if payload[:1] != MARKER:
+        return get_serializer(DEFAULT_SERIALIZER)[1](payload)
+    _, name, payload = payload.split(MARKER, 2)
+    return get_serializer(name.decode('ascii'))[1](payload)
+
+
+def task_payload(payload):
+    """Return `payload` as text, encoding the binary ones with base64"""
+    if payload[:1] == MARKER:
+        return BASE64_MARKER + base64.b64encode(payload).decode('ascii')
+    if isinstance(payload, bytes):
+        return payload.decode('utf-8')
+    return payload
+
+
+def binary_payload(payload):
+    """Undo the base64 encoding done by `task_payload()`, if any"""
+    if payload[:1] == BASE64_MARKER:
+        return base64.b64decode(payload[1:])
+    return payload
+
+
+def ejson_dumps(data):
+    return ejson.dumps(data)
+
+
+def ejson_loads(payload):
+    return ejson.loads(payload)
+
+
+register_serializer('ejson', ejson_dumps, ejson_loads)
+
+
+if msgpack is not None:
+    def msgpack_dumps(data):
+        """Pack `data` converting custom types just like ejson does"""
+        return msgpack.packb(
+            data, default=ejson._converter, use_bin_type=True)
+
+    def msgpack_loads(payload):
+        """Unpack `data` rebuilding the types converted by ejson"""
+        return msgpack.unpackb(
+            payload, object_hook=ejson._convert_from, raw=False)
+
+    register_serializer('msgpack', msgpack_dumps, msgpack_loads)
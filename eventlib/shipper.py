@@ -0,0 +1,161 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Background shipping of the logged events to celery
+
+When the `EVENTLIB_LOG_MODE` setting is `'background'`, `log()` just
+puts the serialized event in a bounded in-memory queue. A daemon thread
+takes the events from the queue and sends them to the workers in bulk,
+so the broker latency doesn't slow down the code logging the events.
+
+Events still in the queue are shipped when the process exits.
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+from . import core
+from .compat import Empty, Full, Queue
+from .conf import getsetting
+from .lazy import LazyImport
+from .spill import spill_events
+
+
+tasks = LazyImport('eventlib.tasks')
+
+logger = logging.getLogger('event')
+
+
+class Shipper(object):
+    """Ships the queued events to celery from a daemon thread
+
+    Up to `batch_size` events are taken from the queue at once and sent
+    in a single task. The `overflow` policy tells what happens when the
+    queue is full: `'drop'` discards the event with a warning, `'block'`
+    waits for room and `'spill'` writes the event to the spill buffer,
+    see the `spill` module. Events that can't be sent to celery are also
+    written to the spill buffer, when it's enabled.
+    """
+
+    def __init__(self, queue_size=10000, batch_size=100, overflow='drop'):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.lock = threading.Lock()
+        self.pid = None
+        self.thread = None
+
+    def start(self):
+        """Start the shipping thread, unless it's already running
+
+        The queue and the thread are created again after forking, since
+        the thread doesn't survive the fork.
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.queue = Queue(self.queue_size)
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def put(self, name, data):
+        """Queue an event to be shipped, following the overflow policy
+        when the queue is full"""
+        self.start()
+        try:
+            self.queue.put_nowait((name, data))
+        except Full:
+            if self.overflow == 'block':
+                self.queue.put((name, data))
+            elif not (self.overflow == 'spill' and
+                      spill_events([(name, data)])):
+                logger.warning(
+                    u'The shipper queue is full, dropping the event "{}"'
+                    .format(name))
+
+    def run(self):
+        """Take the queued events and ship them until a `None` is found"""
+        while True:
+            events = [self.queue.get()]
+            while events[-1] is not None and len(events) < self.batch_size:
+                try:
+                    events.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            stop = events[-1] is None
+            if stop:
+                events.pop()
+            if events:
+                self.ship(events)
+            if stop:
+                return
+
+    def ship(self, events):
+        for options, group in core.group_by_task_options(events):
+            try:
+                if len(group) == 1:
+                    core.apply_task(tasks.process_task, group[0], options)
+                else:
+                    core.apply_task(tasks.process_batch_task, (group,),
+                                    options)
+            except Exception as exc:
+                logger.warning(
+                    (u'The event system could not ship {} events and failed '
+                     u'with the following exception: {}').format(
+                         len(group), str(exc)))
+                spill_events(group)
+
+    def flush(self, timeout=None):
+        """Stop the thread after shipping all the queued events"""
+        with self.lock:
+            running = self.pid == os.getpid() and self.thread.is_alive()
+            self.pid = None
+        if running:
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+
+_shipper = None
+
+
+def get_shipper():
+    """Return the shipper, creating it on the first call
+
+    The shipper is configured with the following settings:
+
+      * `EVENTLIB_SHIPPER_QUEUE_SIZE`: max events in memory (10000)
+      * `EVENTLIB_SHIPPER_BATCH_SIZE`: max events per task (100)
+      * `EVENTLIB_SHIPPER_OVERFLOW`: `'drop'`, `'block'` or `'spill'`
+    """
+    global _shipper
+    if _shipper is None:
+        _shipper = Shipper(
+            queue_size=getsetting('EVENTLIB_SHIPPER_QUEUE_SIZE', 10000),
+            batch_size=getsetting('EVENTLIB_SHIPPER_BATCH_SIZE', 100),
+            overflow=getsetting('EVENTLIB_SHIPPER_OVERFLOW', 'drop'))
+    return _shipper
+
+
+def flush_shipper():
+    """Ship the queued events, waiting for at most
+    `EVENTLIB_SHIPPER_EXIT_TIMEOUT` seconds (5)"""
+    if _shipper is not None:
+        _shipper.flush(getsetting('EVENTLIB_SHIPPER_EXIT_TIMEOUT', 5))
+
+atexit.register(flush_shipper)
@@ -0,0 +1,368 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Disk buffer for the events that can't be sent while the broker or
+redis are down
+
+When the `EVENTLIB_SPILL_DIR` setting points to a directory, events
+that celery refuses and messages that redis refuses are appended to
+segment files in that directory instead of being lost. A background
+thread replays them in bulk once the broker is reachable again.
+
+Segments are preallocated files of `EVENTLIB_SPILL_SEGMENT_SIZE` bytes
+mapped in memory. Each process writes its own segments and at most
+`EVENTLIB_SPILL_MAX_SEGMENTS` of them are kept, so the disk usage is
+capped. Segments left behind by processes that died are replayed by
+the other ones, as soon as they log an event. Records are delivered
+at least once: a segment that fails in the middle of its replay is sent
+again from its beginning.
+"""
+
+import errno
+import logging
+import mmap
+import os
+import struct
+import threading
+
+from .compat import string_types
+from .conf import getsetting
+from .serializers import task_payload
+
+
+logger = logging.getLogger('event')
+
+RECORD_HEADER = struct.Struct('>cII')
+
+EVENT = b'e'
+
+MESSAGE = b'm'
+
+END = b'\x00'
+
+
+class Segment(object):
+    """Append-only file of records mapped in memory
+
+    The file is created with its final size, filled with zeros, so the
+    end of the records is found by a header with an `END` kind.
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        self.file = open(path, 'r+b' if size is None else 'w+b')
+        if size is not None:
+            self.file.truncate(size)
+        self.size = os.path.getsize(path)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.offset = 0
+        for record in self.records():
+            pass
+
+    def records(self):
+        """Yield the `(kind, key, data)` records found in the segment"""
+        offset = 0
+        while offset + RECORD_HEADER.size <= self.size:
+            kind, key_size, data_size = RECORD_HEADER.unpack_from(
+                self.map, offset)
+            if kind == END:
+                break
+            start = offset + RECORD_HEADER.size
+            end = start + key_size + data_size
+            yield kind, self.map[start:start + key_size].decode('utf-8'), \
+                self.map[start + key_size:end]
+            offset = self.offset = end
+
+    def append(self, record):
+        """Write a record, returning `False` if it doesn't fit"""
+        end = self.offset + len(record)
+        if end > self.size:
+            return False
+        self.map[self.offset:end] = record
+        self.offset = end
+        return True
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class SpillBuffer(object):
+    """Keeps the events and messages that couldn't be sent in segments
+    written to `directory`"""
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024,
+                 max_segments=16, batch_size=100):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the segments of the parent process after forking"""
+        self.pid = os.getpid()
+        self.segments = []
+        self.thread = None
+
+    def add_event(self, name, data):
+        return self.append(EVENT, name, data)
+
+    def add_message(self, channel, message):
+        return self.append(MESSAGE, channel, message)
+
+    def append(self, kind, key, data):
+        """Write a record to the last segment, creating a new one when it
+        gets full. Returns `False` when the record is dropped because
+        the buffer is full"""
+        key = key.encode('utf-8')
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        record = RECORD_HEADER.pack(kind, len(key), len(data)) + key + data
+
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            if self.segments and self.segments[-1].append(record):
+                return True
+            if (len(self.segments) >= self.max_segments or
+                    len(record) > self.segment_size):
+                logger.warning(
+                    u'The spill buffer is full, dropping a record of {} '
+                    u'bytes'.format(len(record)))
+                return False
+            self.sequence += 1
+            segment = Segment(self.segment_path(self.sequence),
+                              self.segment_size)
+            self.segments.append(segment)
+            return segment.append(record)
+
+    def segment_path(self, sequence):
+        return os.path.join(self.directory, '{}-{:010d}.spill'.format(
+            os.getpid(), sequence))
+
+    def orphans(self):
+        """Return the paths of the segments left by dead processes"""
+        paths = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.spill'):
+                continue
+            pid = int(name.split('-', 1)[0])
+            if pid != os.getpid() and not pid_exists(pid):
+                paths.append(os.path.join(self.directory, name))
+        return paths
+
+    def pending(self):
+        """Tells if there's anything to replay"""
+        with self.lock:
+            if self.pid == os.getpid() and self.segments:
+                return True
+        return bool(self.orphans())
+
+    def replay(self, send_events, send_messages):
+        """Send the spilled records through `send_events` and
+        `send_messages`, oldest segment first
+
+        Both functions receive lists of up to `batch_size` pairs. The
+        replay stops at the first failure, keeping the segments that
+        weren't sent for the next try.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            segments, self.segments = self.segments, []
+        segments += self.claim_orphans()
+
+        while segments:
+            try:
+                self.send(segments[0], send_events, send_messages)
+            except Exception as exc:
+                logger.warning(
+                    (u'The event system could not replay the spill buffer '
+                     u'and failed with the following exception: {}').format(
+                         str(exc)))
+                break
+            segment = segments.pop(0)
+            segment.close()
+            os.remove(segment.path)
+
+        with self.lock:
+            self.segments = segments + self.segments
+
+    def claim_orphans(self):
+        """Take over the segments left by dead processes
+
+        Segments are renamed after the current process, so they're not
+        replayed by other processes at the same time.
+        """
+        claimed = []
+        for path in self.orphans():
+            with self.lock:
+                self.sequence += 1
+                new_path = self.segment_path(self.sequence)
+            try:
+                os.rename(path, new_path)
+            except OSError:
+                # Another process claimed it first
+                continue
+            claimed.append(Segment(new_path))
+        return claimed
+
+    def send(self, segment, send_events, send_messages):
+        batches = {EVENT: [], MESSAGE: []}
+        senders = {EVENT: send_events, MESSAGE: send_messages}
+        for kind, key, data in segment.records():
+            batch = batches[kind]
+            batch.append((key, data))
+            if len(batch) >= self.batch_size:
+                senders[kind](batch)
+                batches[kind] = []
+        for kind, batch in batches.items():
+            if batch:
+                senders[kind](batch)
+
+    def start_replayer(self, interval):
+        """Start the thread that replays the buffer every `interval`
+        seconds, unless it's already running in this process"""
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            if self.thread is not None:
+                return
+            self.stopped = threading.Event()
+            self.thread = threading.Thread(target=self.run, args=(interval,))
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self, interval):
+        while not self.stopped.wait(interval):
+            if self.pending():
+                self.replay(send_events, send_messages)
+
+    def stop_replayer(self):
+        """Stop the thread started by `start_replayer()`"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stopped.set()
+            thread.join(1)
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+def send_events(events):
+    """Send spilled events to the celery workers
+
+    Records are read back as bytes, so the payloads are turned into text
+    again before going through the task serializer.
+    """
+    # Imported here since both modules depend on this one
+    from .core import apply_task, group_by_task_options
+    from .tasks import process_batch_task
+
+    events = [(name, task_payload(data)) for name, data in events]
+    for options, group in group_by_task_options(events):
+        apply_task(process_batch_task, (group,), options)
+
+
+def send_messages(messages):
+    """Publish spilled messages to the external handlers"""
+    from .transport import publish
+    from .util import redis_connection
+
+    pipeline = redis_connection.get_connection().pipeline(transaction=False)
+    for channel, message in messages:
+        publish(pipeline, channel, message)
+    pipeline.execute()
+
+
+_buffer = None
+
+
+def get_spill_buffer():
+    """Return the spill buffer, or `None` if it's not enabled
+
+    The buffer is configured with the following settings:
+
+      * `EVENTLIB_SPILL_DIR`: directory of the segments (`None`)
+      * `EVENTLIB_SPILL_SEGMENT_SIZE`: bytes per segment (16MB)
+      * `EVENTLIB_SPILL_MAX_SEGMENTS`: segments per process (16)
+      * `EVENTLIB_SPILL_REPLAY_INTERVAL`: seconds between replays (5)
+    """
+    global _buffer
+    directory = getsetting('EVENTLIB_SPILL_DIR')
+    if not directory or not isinstance(directory, string_types):
+        return None
+    if _buffer is None:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        _buffer = SpillBuffer(
+            directory,
+            segment_size=getsetting(
+                'EVENTLIB_SPILL_SEGMENT_SIZE', 16 * 1024 * 1024),
+            max_segments=getsetting('EVENTLIB_SPILL_MAX_SEGMENTS', 16))
+    _buffer.start_replayer(getsetting('EVENTLIB_SPILL_REPLAY_INTERVAL', 5))
+    return _buffer
+
+
+def start_replayer():
+    """Start replaying the spill buffer, if it's enabled
+
+    Called when events are logged, so the segments left behind by dead
+    processes are replayed even if this process never spills anything.
+    """
+    get_spill_buffer()
+
+
+def stop_replayer():
+    """Stop replaying the spill buffer in this process"""
+    if _buffer is not None:
+        _buffer.stop_replayer()
+
+
+def spill_events(events):
+    """Write events that celery refused to the spill buffer
+
+    Returns `False` if the buffer is not enabled.
+    """
+    spill_buffer = get_spill_buffer()
+    if spill_buffer is None:
+        return False
+    for name, data in events:
+        spill_buffer.add_event(name, data)
+    return True
+
+
+def spill_messages(messages):
+    """Write messages that redis refused to the spill buffer
+
+    Returns `False` if the buffer is not enabled.
+    """
+    spill_buffer = get_spill_buffer()
+    if spill_buffer is None:
+        return False
+    for channel, message in messages:
+        spill_buffer.add_message(channel, message)
+    return True
@@ -14,11 +14,32 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from celery.signals import task_postrun
 from celery.task import task
-from .core import process
+from .core import process, process_batch, run_handlers
+from .serializers import loads
+from .transport import flush_buffer
 
 
 @task
 def process_task(name, data):
     """Thin wrapper to transform `core.process()` in a celery task"""
     process(name, data)
+
+
+@task
+def process_batch_task(events):
+    """Thin wrapper to transform `core.process_batch()` in a celery task"""
+    process_batch(events)
+
+
+@task
+def run_handlers_task(event_name, names, data):
+    """Run the handlers sent to the workers by `core.fan_out()`"""
+    run_handlers(event_name, names, loads(data))
+
+
+@task_postrun.connect
+def flush_broadcast_buffer(**kwargs):
+    """Publish the messages buffered while the task was running"""
+    flush_buffer()
@@ -0,0 +1,170 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Sampling and rate limiting of the logged events
+
+Events logged at very high rates can be thinned out before `log()`
+validates, serializes and sends them. Event classes declare a sampling
+rate, the fraction of the events that is kept, and a rate limit, in
+events per second, minute or hour:
+
+    >>> class PageViewed(BaseEvent):
+    ...     sample_rate = 0.1
+    ...     rate_limit = '100/s'
+
+The `EVENTLIB_SAMPLE_RATES` and `EVENTLIB_RATE_LIMITS` settings map
+event names or patterns to the same values and take precedence over
+the event classes. When many keys match a name, the last one in the
+mapping wins:
+
+    >>> EVENTLIB_SAMPLE_RATES = {'analytics.*': 0.5}
+    >>> EVENTLIB_RATE_LIMITS = {'analytics.PageViewed': '1000/m'}
+
+Rate limits are token buckets that hold up to a period worth of events,
+but at least one, so rates below one event per period still let events
+through. There's one bucket per event name and process. Dropped events
+are counted in the metrics sink as `events.<name>.sampled_out` and
+`events.<name>.rate_limited`.
+"""
+
+import random
+import threading
+import time
+
+from .conf import getsetting
+from .core import PatternIndex
+from .metrics import get_sink
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60}
+
+# Used when there are no rules in the settings, so the throttle isn't
+# built again on every call
+NO_RULES = {}
+
+
+def parse_rate(value):
+    """Return the `(events, seconds)` of a rate like `'100/s'`
+
+    Numbers are taken as events per second.
+    """
+    if isinstance(value, (int, float)):
+        return value, 1
+    events, period = value.split('/')
+    return float(events), PERIODS[period.strip()]
+
+
+class TokenBucket(object):
+    """Lets through up to `capacity` events at once and `rate` events
+    per second after that"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self):
+        """Take a token, returning `False` if there's none left"""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def _last(values):
+    return values[-1] if values else None
+
+
+class Throttle(object):
+    """Decides which events are logged, following the sampling rates and
+    the rate limits found in the `sample_rates` and `rate_limits`
+    mappings or in the event classes"""
+
+    def __init__(self, sample_rates, rate_limits):
+        self.sample_rates = PatternIndex(sample_rates, combine=_last)
+        self.rate_limits = PatternIndex(rate_limits, combine=_last)
+        self.lock = threading.Lock()
+        self.rules = {}
+
+    def rule(self, name, event_cls):
+        """Return the sampling rate and the token bucket of an event"""
+        try:
+            return self.rules[name]
+        except KeyError:
+            pass
+
+        if not isinstance(event_cls, type):
+            event_cls = None
+        sample_rate = self.sample_rates.resolve(name)
+        if sample_rate is None:
+            sample_rate = getattr(event_cls, 'sample_rate', None)
+        rate_limit = self.rate_limits.resolve(name)
+        if rate_limit is None:
+            rate_limit = getattr(event_cls, 'rate_limit', None)
+
+        bucket = None
+        if rate_limit is not None:
+            events, seconds = parse_rate(rate_limit)
+            bucket = TokenBucket(float(events) / seconds, max(events, 1))
+        with self.lock:
+            return self.rules.setdefault(name, (sample_rate, bucket))
+
+    def admit(self, name, event_cls):
+        """Tells if the event `name` should be logged, counting the ones
+        that are dropped"""
+        sample_rate, bucket = self.rule(name, event_cls)
+        if sample_rate is not None and random.random() >= sample_rate:
+            get_sink().incr(u'events.{}.sampled_out'.format(name))
+            return False
+        if bucket is not None and not bucket.consume():
+            get_sink().incr(u'events.{}.rate_limited'.format(name))
+            return False
+        return True
+
+
+_throttle = None
+
+
+def get_throttle():
+    """Return the throttle, built again when the settings change"""
+    global _throttle
+    sample_rates = getsetting('EVENTLIB_SAMPLE_RATES') or NO_RULES
+    rate_limits = getsetting('EVENTLIB_RATE_LIMITS') or NO_RULES
+    throttle = _throttle
+    if (throttle is None or
+            throttle.sample_rates.mapping is not sample_rates or
+            throttle.rate_limits.mapping is not rate_limits):
+        throttle = _throttle = Throttle(sample_rates, rate_limits)
+    return throttle
+
+
+def reset_throttle():
+    """Forget the rules and the buckets of all the events, useful after
+    changing the event classes"""
+    global _throttle
+    _throttle = None
+
+
+def admit(name, event_cls):
+    """Tells if the event `name` of the class `event_cls` should be
+    logged, see `Throttle`"""
+    return get_throttle().admit(name, event_cls)
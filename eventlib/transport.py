@@ -0,0 +1,394 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Delivery of the messages broadcasted to the external handlers
+
+Messages are delivered through the transport chosen by the
+`EVENTLIB_TRANSPORT` setting:
+
+  * `'pubsub'` (default): messages are published in the `eventlib`
+    channel and each listener receives all of them. Messages published
+    while no listener is running are lost.
+  * `'streams'`: messages are appended to the `eventlib` redis stream
+    and read through a consumer group, so the listeners share the load
+    and catch up with the messages they missed while stopped. Requires
+    redis 5.0+.
+"""
+
+import atexit
+import fnmatch
+import logging
+import os
+import socket
+import threading
+import time
+
+from .conf import getsetting
+from .core import WILDCARD_CHARS
+from .lazy import LazyImport
+from .serializers import binary_payload, loads
+from .spill import spill_messages
+
+
+redis = LazyImport('redis')
+
+
+logger = logging.getLogger('event')
+
+FRAME_MARKER = b'\x01'
+
+STREAM_FIELD = b'message'
+
+CHANNEL = 'eventlib'
+
+
+def encode_frame(name, payload):
+    """Build a message carrying the event name and its serialized data
+
+    The payload is framed as it is, without being deserialized, since
+    the name doesn't have to be added to the data.
+    """
+    payload = binary_payload(payload)
+    if not isinstance(payload, bytes):
+        payload = payload.encode('utf-8')
+    return FRAME_MARKER + name.encode('utf-8') + FRAME_MARKER + payload
+
+
+def decode_message(message):
+    """Return the event name and the data of a broadcasted message
+
+    Both framed messages and the ones carrying the event name in the
+    `name` key of the data are understood. If the name can't be found,
+    `None` is returned in its place.
+    """
+    if message[:1] == FRAME_MARKER:
+        _, name, payload = message.split(FRAME_MARKER, 2)
+        return name.decode('utf-8'), loads(payload)
+    data = loads(message)
+    return data.pop('name', None), data
+
+
+def get_routing():
+    """Return how events are routed to the pubsub channels
+
+    The `EVENTLIB_BROADCAST_ROUTING` setting can be `None` (default),
+    sending all the events to the `eventlib` channel, `'app'`, sending
+    them to a channel per app like `eventlib:deal`, or `'event'`, using
+    a channel per event like `eventlib:deal.ActionLog`. Streams always
+    use a single `eventlib` stream.
+    """
+    if getsetting('EVENTLIB_TRANSPORT', 'pubsub') == 'streams':
+        return None
+    return getsetting('EVENTLIB_BROADCAST_ROUTING')
+
+
+def channel_for(event_name):
+    """Return the channel where the event `event_name` is published"""
+    routing = get_routing()
+    if routing == 'app':
+        return u'{}:{}'.format(CHANNEL, event_name.split('.', 1)[0])
+    elif routing == 'event':
+        return u'{}:{}'.format(CHANNEL, event_name)
+    return CHANNEL
+
+
+def subscriptions(names):
+    """Return the channels and the channel patterns to subscribe to in
+    order to receive the events matching the handler names `names`
+
+    Handler names can be wildcard patterns, which are subscribed with
+    `PSUBSCRIBE`. When routing by app, a pattern whose app part isn't
+    literal subscribes to all the apps starting with its literal prefix.
+    """
+    routing = get_routing()
+    if not routing:
+        return [CHANNEL], []
+
+    channels, patterns = set(), set()
+    for name in names:
+        if routing == 'app':
+            app = name.split('.', 1)[0]
+            if '.' in name and not WILDCARD_CHARS.search(app):
+                channels.add(u'{}:{}'.format(CHANNEL, app))
+            else:
+                prefix = WILDCARD_CHARS.split(name, 1)[0].split('.', 1)[0]
+                patterns.add(u'{}:{}*'.format(CHANNEL, prefix))
+        elif WILDCARD_CHARS.search(name):
+            # fnmatch negates character sets with `!` and redis with `^`
+            patterns.add(u'{}:{}'.format(CHANNEL, name.replace('[!', '[^')))
+        else:
+            channels.add(u'{}:{}'.format(CHANNEL, name))
+
+    if not channels and not patterns:
+        # Nothing is handled, but keep listening instead of leaving
+        channels.add(CHANNEL)
+    return _drop_overlaps(channels, patterns)
+
+
+def _covers(pattern, name):
+    """Tells if the redis `pattern` matches the channel or pattern `name`"""
+    return fnmatch.fnmatchcase(name, pattern.replace('[^', '[!'))
+
+
+def _drop_overlaps(channels, patterns):
+    """Leave out the subscriptions already covered by a pattern
+
+    Redis delivers a message once per matching subscription, so a
+    channel also matched by a pattern would have its events handled
+    twice. A pattern is only dropped in favor of a pattern made of
+    literals and `*`, since those are the ones known to match every
+    channel matched by the first.
+    """
+    kept = []
+    for pattern in sorted(patterns, key=len):
+        if not any(_covers(other, pattern) for other in kept
+                   if '?' not in other and '[' not in other):
+            kept.append(pattern)
+    channels = [channel for channel in channels
+                if not any(_covers(pattern, channel) for pattern in kept)]
+    return sorted(channels), sorted(kept)
+
+
+def publish(client, channel, message):
+    """Send a message through the transport chosen in the settings
+
+    With streams, the message is appended to the stream named after the
+    channel, which is trimmed to about `EVENTLIB_STREAM_MAXLEN` entries
+    (100000). `client` can also be a redis pipeline.
+    """
+    if getsetting('EVENTLIB_TRANSPORT', 'pubsub') == 'streams':
+        client.xadd(channel, {STREAM_FIELD: message},
+                    maxlen=getsetting('EVENTLIB_STREAM_MAXLEN', 100000),
+                    approximate=True)
+    else:
+        client.publish(channel, message)
+
+
+class StreamReader(object):
+    """Reads the messages of a stream through a consumer group
+
+    Messages must be acknowledged with `ack()` after being handled. The
+    ones that are not, because the listener died while handling them,
+    are delivered again when it restarts. Pending messages of consumers
+    that are gone are claimed after staying `claim_idle` milliseconds
+    without being acknowledged, so they're not lost when a listener
+    doesn't come back with the same consumer name. Readers look for
+    those messages when they start and every `claim_idle` milliseconds
+    after that.
+    """
+
+    def __init__(self, client, stream, group, consumer, count=100,
+                 block=5000, claim_idle=60000):
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.count = count
+        self.block = block
+        self.claim_idle = claim_idle
+
+    def create_group(self):
+        """Create the consumer group and the stream, if they don't exist"""
+        try:
+            self.client.xgroup_create(
+                self.stream, self.group, id='0', mkstream=True)
+        except redis.ResponseError as exc:
+            if 'BUSYGROUP' not in str(exc):
+                raise
+
+    def claim(self):
+        """Take over the messages left pending by other consumers,
+        returning lists of the `(id, message)` tuples claimed
+
+        The pending entries are listed `count` at a time, until all of
+        them are seen.
+        """
+        batches = []
+        start = '-'
+        while True:
+            pending = self.client.xpending_range(
+                self.stream, self.group, start, '+', self.count)
+            ids = [entry['message_id'] for entry in pending
+                   if entry['time_since_delivered'] >= self.claim_idle]
+            if ids:
+                batches.append(entry_messages(self.client.xclaim(
+                    self.stream, self.group, self.consumer,
+                    self.claim_idle, ids)))
+            if len(pending) < self.count:
+                return batches
+            start = next_id(pending[-1]['message_id'])
+
+    def read(self):
+        """Yield lists of `(id, message)` tuples read from the stream
+
+        The messages delivered to this consumer but never acknowledged
+        are read first, then the new ones, up to `count` per batch. The
+        messages claimed from other consumers come in batches of their
+        own.
+        """
+        self.create_group()
+        last_id = '0'
+        claimed_at = None
+        while True:
+            now = time.time()
+            if claimed_at is None or \
+                    (now - claimed_at) * 1000 >= self.claim_idle:
+                claimed_at = now
+                for batch in self.claim():
+                    yield batch
+            response = self.client.xreadgroup(
+                self.group, self.consumer, {self.stream: last_id},
+                count=self.count, block=self.block)
+            entries = response[0][1] if response else []
+            if last_id != '>':
+                if not entries:
+                    # No more pending messages, start reading new ones
+                    last_id = '>'
+                    continue
+                last_id = entries[-1][0]
+            if entries:
+                yield entry_messages(entries)
+
+    def ack(self, ids):
+        """Acknowledge the messages with the given ids"""
+        if ids:
+            self.client.xack(self.stream, self.group, *ids)
+
+
+def entry_messages(entries):
+    """Return the `(id, message)` tuples of stream entries
+
+    Entries trimmed from the stream while pending come without fields,
+    so their message is `None` and they're just acknowledged.
+    """
+    return [(entry_id, (fields or {}).get(STREAM_FIELD))
+            for entry_id, fields in entries]
+
+
+def next_id(entry_id):
+    """Return the smallest stream id greater than `entry_id`"""
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode('ascii')
+    milliseconds, sequence = entry_id.split('-')
+    return '{}-{}'.format(milliseconds, int(sequence) + 1)
+
+
+def get_stream_reader(client, stream='eventlib'):
+    """Return a reader for `stream` configured by the settings below
+
+      * `EVENTLIB_STREAM_GROUP`: consumer group name (`'eventlib'`)
+      * `EVENTLIB_STREAM_CONSUMER`: consumer name, unique per listener
+        (`'<hostname>-<pid>'`)
+      * `EVENTLIB_STREAM_BATCH_SIZE`: messages read at once (100)
+      * `EVENTLIB_STREAM_BLOCK`: milliseconds waiting for messages (5000)
+      * `EVENTLIB_STREAM_CLAIM_IDLE`: milliseconds before pending
+        messages of other consumers are claimed (60000)
+    """
+    consumer = getsetting('EVENTLIB_STREAM_CONSUMER') or '{}-{}'.format(
+        socket.gethostname(), os.getpid())
+    return StreamReader(
+        client, stream,
+        group=getsetting('EVENTLIB_STREAM_GROUP', 'eventlib'),
+        consumer=consumer,
+        count=getsetting('EVENTLIB_STREAM_BATCH_SIZE', 100),
+        block=getsetting('EVENTLIB_STREAM_BLOCK', 5000),
+        claim_idle=getsetting('EVENTLIB_STREAM_CLAIM_IDLE', 60000))
+
+
+class BroadcastBuffer(object):
+    """Publishes broadcasted messages in bulk through a redis pipeline
+
+    Messages are kept in memory until `max_size` of them are buffered or
+    `max_delay` seconds have passed since the first one was added. The
+    buffer is also flushed when a celery task finishes and when the
+    process exits.
+    """
+
+    def __init__(self, max_size=100, max_delay=1.0):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop the buffered messages without publishing them"""
+        self.pid = os.getpid()
+        self.client = None
+        self.messages = []
+        self.started_at = None
+
+    def add(self, client, channel, message):
+        """Buffer a message and flush the buffer if it's full"""
+        with self.lock:
+            if self.pid != os.getpid():
+                # Messages buffered before forking belong to the parent
+                self.reset()
+            if not self.messages:
+                self.started_at = time.time()
+            self.client = client
+            self.messages.append((channel, message))
+            full = (len(self.messages) >= self.max_size or
+                    time.time() - self.started_at >= self.max_delay)
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Publish all the buffered messages in a single round trip"""
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            client, messages = self.client, self.messages
+            self.messages = []
+        if not messages:
+            return
+
+        pipeline = client.pipeline(transaction=False)
+        for channel, message in messages:
+            publish(pipeline, channel, message)
+        try:
+            pipeline.execute()
+        except Exception as exc:
+            logger.warning(
+                (u'The event system could not broadcast {} buffered '
+                 u'messages and failed with the following exception: {}'
+                 ).format(len(messages), str(exc)))
+            spill_messages(messages)
+
+
+_buffer = None
+
+
+def get_buffer():
+    """Return the broadcast buffer, creating it on the first call
+
+    The size of the buffer is configured with the following settings:
+
+      * `EVENTLIB_BROADCAST_BUFFER_SIZE`: number of messages (100)
+      * `EVENTLIB_BROADCAST_BUFFER_DELAY`: seconds (1.0)
+    """
+    global _buffer
+    if _buffer is None:
+        _buffer = BroadcastBuffer(
+            max_size=getsetting('EVENTLIB_BROADCAST_BUFFER_SIZE', 100),
+            max_delay=getsetting('EVENTLIB_BROADCAST_BUFFER_DELAY', 1.0))
+    return _buffer
+
+
+def flush_buffer():
+    """Publish the buffered messages, if the buffer was ever used"""
+    if _buffer is not None:
+        _buffer.flush()
+
+atexit.register(flush_buffer)
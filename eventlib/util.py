@@ -13,8 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import redis
+import os
+import threading
+
 from .conf import getsetting
+from .lazy import LazyImport
+
+
+redis = LazyImport('redis')
 
 
 UNKNOWN_IP = '0.0.0.0'
@@ -46,12 +52,44 @@ def get_ip(request):
     return UNKNOWN_IP
 
 
+# Optional keys of a `REDIS_CONNECTIONS` entry and the name of the
+# `redis.ConnectionPool` param that each one of them configures.
+POOL_OPTIONS = (
+    ('DB', 'db'),
+    ('PASSWORD', 'password'),
+    ('MAX_CONNECTIONS', 'max_connections'),
+    ('SOCKET_TIMEOUT', 'socket_timeout'),
+    ('SOCKET_CONNECT_TIMEOUT', 'socket_connect_timeout'),
+    ('SOCKET_KEEPALIVE', 'socket_keepalive'),
+    ('SOCKET_KEEPALIVE_OPTIONS', 'socket_keepalive_options'),
+)
+
+
 class ConnectionManager(object):
-    """Helper redis connector"""
+    """Helper redis connector
+
+    Keeps a connection pool for each entry of the `REDIS_CONNECTIONS`
+    setting that was used. Pools are thread-safe and they're rebuilt
+    when the process id changes, so processes forked after connecting
+    (like the celery prefork workers) don't share sockets with their
+    parent.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
 
-    conn = None
+    def reset(self):
+        """Forget all the connections created so far
 
-    def get_connection(self):
+        The pools are just dropped, not disconnected. Disconnecting them
+        in a forked process would shutdown the sockets that are still
+        being used by its parent.
+        """
+        self.pid = os.getpid()
+        self.connections = {}
+
+    def get_connection(self, config_name=None):
         """Return a valid redis connection based on the following settings
 
           * `REDIS_CONNECTIONS`
@@ -60,26 +98,50 @@ class ConnectionManager(object):
         The first one is a dictionary in the following format:
 
           >>> {
-          ...   'server1': {'HOST': 'redis-server-1', 'POST': 9001},
-          ...   'server2': {'HOST': 'redis-server-2', 'POST': 9002},
-          ... ]
+          ...   'server1': {'HOST': 'redis-server-1', 'PORT': 9001},
+          ...   'server2': {'HOST': 'redis-server-2', 'PORT': 9002,
+          ...               'MAX_CONNECTIONS': 50, 'SOCKET_TIMEOUT': 5,
+          ...               'SOCKET_KEEPALIVE': True},
+          ... }
 
-        The second one is the name of the entry present in the above
-        dict, like `server1` or `server2`.
-        """
+        Besides `HOST` and `PORT`, each entry accepts the keys listed in
+        `POOL_OPTIONS` to configure its connection pool.
 
-        if self.conn:
-            return self.conn
+        The second one is the name of the entry present in the above
+        dict, like `server1` or `server2`. It's used when no
+        `config_name` is informed.
 
+        Settings are read only once per entry, even when there's no
+        redis configured and `None` is returned.
+        """
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.reset()
+
+        try:
+            return self.connections[config_name]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if config_name not in self.connections:
+                self.connections[config_name] = self.connect(config_name)
+            return self.connections[config_name]
+
+    def connect(self, config_name=None):
+        """Create a new client with its own pool for `config_name`"""
         redis_configs = getsetting('REDIS_CONNECTIONS')
-        if redis_configs:
+        if not redis_configs:
+            return None
+
+        if config_name is None:
             config_name = getsetting('EVENTLIB_REDIS_CONFIG_NAME', 'default')
-            config = redis_configs[config_name]
-            host = config['HOST']
-            port = config['PORT']
-            self.conn = redis.StrictRedis(host=host, port=port)
-        else:
-            self.conn = None
-        return self.conn
+        config = redis_configs[config_name]
+        options = dict((param, config[key]) for key, param in POOL_OPTIONS
+                       if key in config)
+        pool = redis.ConnectionPool(
+            host=config['HOST'], port=config['PORT'], **options)
+        return redis.StrictRedis(connection_pool=pool)
 
 redis_connection = ConnectionManager()
@@ -30,7 +30,7 @@ def parse_requirements():
     """
     try:
         requirements = \
-            map(str.strip, local_file('requirements.txt').split('\n'))
+            [req.strip() for req in local_file('requirements.txt').split('\n')]
     except IOError:
         raise RuntimeError("Couldn't find the `requirements.txt' file :(")
 
@@ -66,8 +66,11 @@ if __name__ == '__main__':
         author=u'Lincoln de Sousa',
         author_email=u'lincoln@yipit.com',
         url='https://github.com/Yipit/eventlib',
-        packages=filter(lambda n: not n.startswith('tests'), find_packages()),
+        packages=[n for n in find_packages() if not n.startswith('tests')],
         install_requires=install_requires,
+        extras_require={
+            'aio': ['redis>=4.2; python_version >= "3.8"'],
+        },
         dependency_links=dependency_links,
         entry_points={
             'console_scripts': [
@@ -1 +1,6 @@
 import sure
+from django.conf import settings
+
+# Settings that aren't mocked by the tests fallback to the defaults
+if not settings.configured:
+    settings.configure()
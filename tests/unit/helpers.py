@@ -0,0 +1,40 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import Mock
+
+
+# Settings read by `core.run_handler()` that have to be turned off when
+# the settings are mocked
+HANDLER_SETTINGS = {
+    'DEBUG': False,
+    'EVENTLIB_HANDLER_TIMEOUT': None,
+    'EVENTLIB_HANDLER_TIMEOUTS': {},
+    'EVENTLIB_HANDLER_TIMEOUT_THREADS': 10,
+    'EVENTLIB_BREAKER_THRESHOLD': None,
+    'EVENTLIB_SLOW_HANDLER_THRESHOLD': None,
+    'EVENTLIB_METRICS_SINK': None,
+}
+
+
+def handler_settings(settings=None, **options):
+    """Fill the mocked `settings`, or a new mock, with the guards of the
+    handlers turned off and the `options` informed"""
+    if settings is None:
+        settings = Mock()
+    values = dict(HANDLER_SETTINGS, **options)
+    for key, value in values.items():
+        setattr(settings, key, value)
+    return settings
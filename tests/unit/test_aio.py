@@ -0,0 +1,174 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import time
+from nose.plugins.skip import SkipTest
+
+if sys.version_info < (3, 8):
+    raise SkipTest('The asyncio listener requires Python 3.8+')
+
+import asyncio
+import ejson
+from unittest.mock import AsyncMock, Mock, call, patch
+
+import eventlib
+from eventlib import aio, core, guards
+
+from .helpers import handler_settings
+
+
+class FakePubSub(object):
+    """Async iterator over the messages of the `messages()` function"""
+
+    def __init__(self, messages):
+        self.messages = iter(messages)
+        self.subscribe = AsyncMock()
+
+    def listen(self):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        try:
+            return asyncio.sleep(0, result=next(self.messages))
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def messages(count):
+    for i in range(count):
+        data = ejson.dumps({'name': 'app.TestEvent', 'i': i})
+        yield {'type': 'message', 'data': data}
+    yield {'type': 'subscribe', 'data': 1}
+
+
+@patch('eventlib.conf.settings', handler_settings())
+def test_process_external_async():
+    core.cleanup_handlers()
+
+    coroutine_handler = AsyncMock()
+    eventlib.external_handler('app.Event')(coroutine_handler)
+    handler = Mock()
+    eventlib.external_handler('app.Event')(handler)
+
+    asyncio.run(aio.process_external_async('app.Event', {'a': 1}))
+
+    coroutine_handler.assert_awaited_once_with({'a': 1})
+    handler.assert_called_once_with({'a': 1})
+
+
+@patch('eventlib.core.logger')
+@patch('eventlib.conf.settings', handler_settings())
+def test_process_external_async_fails_gracefully(logger):
+    core.cleanup_handlers()
+
+    eventlib.external_handler('app.Event')(
+        AsyncMock(side_effect=ValueError('P0wned!!!')))
+    handler = AsyncMock()
+    eventlib.external_handler('app.Event')(handler)
+
+    asyncio.run(aio.process_external_async('app.Event', {'a': 1}))
+
+    logger.warning.assert_called_once_with(
+        'One of the handlers for the event "app.Event" has '
+        'failed with the following exception: P0wned!!!')
+    handler.assert_awaited_once_with({'a': 1})
+
+
+@patch('eventlib.conf.settings', handler_settings())
+def test_process_external_async_with_batch_handlers():
+    core.cleanup_handlers()
+
+    coroutine_handler = AsyncMock()
+    eventlib.external_handler('app.Event', batch=True)(coroutine_handler)
+    handler = Mock()
+    eventlib.external_handler('app.Event', batch=True)(handler)
+
+    asyncio.run(aio.process_external_async('app.Event', {'a': 1}))
+
+    # Batch handlers get a list, just like in `core.process_external()`
+    coroutine_handler.assert_awaited_once_with([{'a': 1}])
+    handler.assert_called_once_with([{'a': 1}])
+
+
+sink = Mock()
+
+
+@patch('eventlib.guards._thread_pool', None)
+@patch('eventlib.conf.settings', handler_settings(
+    EVENTLIB_HANDLER_TIMEOUT=0.01, EVENTLIB_BREAKER_THRESHOLD=1,
+    EVENTLIB_BREAKER_RESET_TIMEOUT=30, EVENTLIB_METRICS_SINK=sink))
+def test_process_external_async_guards_the_handlers():
+    core.cleanup_handlers()
+    guards.reset_breakers()
+    sink.reset_mock()
+
+    # Sleeps for as many seconds as the event data says
+    eventlib.external_handler('app.Event')(
+        AsyncMock(side_effect=asyncio.sleep))
+    calls = []
+
+    def failing_handler(data):
+        calls.append(data)
+        raise ValueError('P0wned!!!')
+    eventlib.external_handler('app.Event')(failing_handler)
+
+    # When the handlers time out and fail
+    asyncio.run(aio.process_external_async('app.Event', 1))
+
+    # Then the failures are counted like in `core.run_handler()`
+    sink.incr.assert_has_calls([
+        call('events.app.Event.external'),
+        call('handlers.unittest.mock.AsyncMock.failed'),
+        call('events.app.Event.failed'),
+        call('handlers.unittest.mock.AsyncMock.timeout'),
+    ])
+    sink.incr.assert_any_call(
+        'handlers.tests.unit.test_aio.failing_handler.failed')
+
+    # And the breakers skip both handlers the next time
+    sink.reset_mock()
+    asyncio.run(aio.process_external_async('app.Event', 1))
+    sink.incr.assert_has_calls([
+        call('events.app.Event.external'),
+        call('handlers.unittest.mock.AsyncMock.skipped'),
+        call('handlers.tests.unit.test_aio.failing_handler.skipped'),
+    ])
+    calls.should.equal([1])
+    guards.reset_breakers()
+
+
+@patch('eventlib.aio.process_external_async', new_callable=Mock)
+@patch('eventlib.conf.settings',
+       Mock(INSTALLED_APPS=[], EVENTLIB_BROADCAST_ROUTING=None))
+def test_listen_for_events_async(process_external_async):
+    process_external_async.side_effect = lambda *args: asyncio.sleep(0.05)
+    client = Mock()
+    client.pubsub.return_value = FakePubSub(messages(5))
+
+    # When I listen to the events allowing two of them at the same time
+    started = time.time()
+    asyncio.run(aio.listen_for_events_async(client, concurrency=2))
+
+    # Then all events should be processed
+    client.pubsub.return_value.subscribe.assert_awaited_once_with('eventlib')
+    process_external_async.assert_has_calls(
+        [call('app.TestEvent', {'i': i}, None) for i in range(5)])
+
+    # But in three rounds, since no more than two run concurrently
+    (time.time() - started).should.be.greater_than(0.15)
@@ -0,0 +1,98 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ejson
+import eventlib
+from mock import Mock, patch
+from eventlib import coalesce
+
+
+class ActionLog(eventlib.BaseEvent):
+    coalesce_window = 5
+
+    def coalesce_key(self):
+        return self.data['user'], self.data['action']
+
+
+@patch('eventlib.coalesce.time')
+def test_coalescer_collapses_the_events_of_a_window(time):
+    send = Mock()
+    time.time.return_value = 100
+    coalescer = coalesce.Coalescer(send)
+    coalescer.pid = coalesce.os.getpid()
+
+    # Given that the same event was logged many times in the window
+    coalescer.add('app.ActionLog', (1, 'click'), ejson.dumps({'a': 1}), 5)
+    coalescer.add('app.ActionLog', (1, 'click'), ejson.dumps({'a': 2}), 5)
+    coalescer.add('app.ActionLog', (2, 'click'), ejson.dumps({'a': 3}), 5)
+    time.time.return_value = 102
+    coalescer.add('app.ActionLog', (1, 'buy'), ejson.dumps({'a': 4}), 5)
+
+    # When the window is not over yet, then nothing should be sent
+    coalescer.flush(104)
+    send.called.should.be.false
+
+    # And when it is, the first event of each key should be sent with
+    # the number of events it stands for
+    coalescer.flush(105)
+    send.assert_called_once_with([
+        ('app.ActionLog', ejson.dumps({'a': 1, '__count__': 2})),
+        ('app.ActionLog', ejson.dumps({'a': 3, '__count__': 1})),
+    ])
+
+    # And the events still waiting are sent by a full flush
+    coalescer.flush()
+    send.assert_called_with([
+        ('app.ActionLog', ejson.dumps({'a': 4, '__count__': 1})),
+    ])
+    coalescer.pending.should.be.empty
+
+
+@patch('eventlib.coalesce.logger')
+def test_coalescer_logs_failures(logger):
+    coalescer = coalesce.Coalescer(Mock(side_effect=IOError('Down')))
+    coalescer.pid = coalesce.os.getpid()
+    coalescer.add('app.ActionLog', 1, ejson.dumps({}), 5)
+    coalescer.flush()
+    logger.warning.assert_called_once_with(
+        'The event system could not send 1 coalesced events and failed '
+        'with the following exception: Down')
+
+
+@patch('eventlib.api.tasks')
+@patch('eventlib.api.coalesce.get_coalescer')
+@patch('eventlib.core.find_event')
+@patch('eventlib.core.datetime')
+@patch('eventlib.api.conf')
+def test_log_coalesces_the_events_that_have_a_key(
+        conf, datetime, find_event, get_coalescer, tasks):
+    conf.getsetting.return_value = False
+    datetime.now.return_value = 'tea time'
+    find_event.return_value = ActionLog
+
+    # When I log an event that has a coalescing key
+    eventlib.log('app.ActionLog', {'user': 1, 'action': 'click'})
+
+    # Then it should wait in the coalescer instead of being sent
+    get_coalescer.return_value.add.assert_called_once_with(
+        'app.ActionLog', (1, 'click'), ejson.dumps({
+            'user': 1, 'action': 'click',
+            '__ip_address__': '0.0.0.0', '__datetime__': 'tea time'}), 5)
+    tasks.process_task.delay.called.should.be.false
+
+    # And events without a key should be sent as usual
+    find_event.return_value = eventlib.BaseEvent
+    eventlib.log('app.Other', {})
+    tasks.process_task.delay.called.should.be.true
@@ -35,6 +35,25 @@ def test_event_validate():
         'One of the following keys are missing from the event\'s data: '
         'unknown, blah')
 
+
+def test_event_slots():
+    class MyEvent(eventlib.BaseEvent):
+        pass
+
+    # Event classes don't get a __dict__ unless they ask for it
+    event = MyEvent('stuff', {})
+    hasattr(event, '__dict__').should.be.false
+    setattr.when.called_with(event, 'product', 1).should.throw(
+        AttributeError)
+
+    class MyLooseEvent(eventlib.BaseEvent):
+        __slots__ = ('__dict__',)
+
+    event = MyLooseEvent('stuff', {})
+    event.product = 1
+    event.__dict__.should.equal({'product': 1})
+
+
 channel_name = None
 channel_data = None
 
@@ -59,6 +78,70 @@ def test_event_broadcast(redis_connection, conf):
     )
 
 
+@patch('eventlib.api.transport')
+@patch('eventlib.api.conf')
+@patch('eventlib.api.redis_connection')
+def test_event_buffered_broadcast(redis_connection, conf, transport):
+    settings = {'EVENTLIB_BROADCAST_MODE': 'buffered'}
+    conf.getsetting.side_effect = settings.get
+
+    class MyEvent(eventlib.BaseEvent):
+        pass
+
+    transport.channel_for.return_value = 'eventlib'
+
+    event = MyEvent('stuff', {'answer': 42})
+    event._broadcast()
+
+    client = redis_connection.get_connection.return_value
+    client.publish.called.should.be.false
+    transport.channel_for.assert_called_once_with('stuff')
+    transport.get_buffer.return_value.add.assert_called_once_with(
+        client, 'eventlib', '{"answer": 42, "name": "stuff"}')
+
+
+@patch('eventlib.api.conf')
+@patch('eventlib.api.redis_connection')
+def test_event_framed_broadcast(redis_connection, conf):
+    settings = {'EVENTLIB_FRAMED_BROADCAST': True}
+    conf.getsetting.side_effect = settings.get
+
+    class MyEvent(eventlib.BaseEvent):
+        pass
+
+    # Given that the event received the serialized payload
+    event = MyEvent('app.MyEvent', {'answer': 42})
+    event._broadcast('{"answer": 42}')
+
+    # Then the payload should be published without being serialized
+    # again, framed with the event name
+    redis_connection.get_connection.return_value.publish.assert_called_once_with(
+        'eventlib', b'\x01app.MyEvent\x01{"answer": 42}')
+
+
+@patch('eventlib.api.conf')
+@patch('eventlib.api.redis_connection')
+def test_event_framed_broadcast_with_custom_broadcast(redis_connection, conf):
+    settings = {'EVENTLIB_FRAMED_BROADCAST': True}
+    conf.getsetting.side_effect = settings.get
+
+    class MyEvent(eventlib.BaseEvent):
+        def broadcast(self, data):
+            data['extra'] = 'extra_data'
+            return data
+
+    MyEvent.overrides_broadcast().should.be.true
+    eventlib.BaseEvent.overrides_broadcast().should.be.false
+
+    # When the event has its own broadcast method, the data returned by
+    # it must be serialized
+    event = MyEvent('app.MyEvent', {'answer': 42})
+    event._broadcast('{"answer": 42}')
+    redis_connection.get_connection.return_value.publish.assert_called_once_with(
+        'eventlib',
+        '{"answer": 42, "extra": "extra_data", "name": "app.MyEvent"}')
+
+
 @patch('eventlib.api.conf')
 @patch('eventlib.api.redis_connection')
 def test_event_broadcast_with_testing_settings(redis_connection, conf):
@@ -13,6 +13,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import subprocess
+import sys
+
 from ejson import serializers
 from mock import Mock, call, patch
 from datetime import datetime
@@ -20,6 +24,21 @@ from datetime import datetime
 from eventlib import exceptions, conf, core, tasks
 
 
+def test_tasks_are_registered_when_celery_is_loaded():
+    def imports_tasks(setup):
+        script = 'import sys; {}import eventlib; ' \
+            'print("eventlib.tasks" in sys.modules)'.format(setup)
+        return subprocess.check_output(
+            [sys.executable, '-c', script],
+            cwd=os.path.join(os.path.dirname(__file__), '..', '..')).strip()
+
+    # Processes that don't use celery don't pay for importing it
+    imports_tasks('').should.equal(b'False')
+
+    # But the workers, that already imported celery, get the tasks
+    imports_tasks('import celery; ').should.equal(b'True')
+
+
 def test_parse_event_name():
     core.parse_event_name('app.Event').should.be.equal(
         ('app.events', 'Event'))
@@ -37,6 +56,7 @@ def test_parse_event_name():
 
 @patch('eventlib.core.import_module')
 def test_find_event(import_module):
+    core.invalidate_event_cache()
     fake_module = Mock()
     fake_module.Event = 'my-lol-module'
 
@@ -51,6 +71,68 @@ def test_find_event(import_module):
         'called "Event2" inside the "app.events" module.')
 
 
+@patch('eventlib.core.import_module')
+def test_find_event_caches_found_and_missing_events(import_module):
+    core.invalidate_event_cache()
+    fake_module = Mock()
+    fake_module.Event = 'my-lol-module'
+    import_module.return_value = fake_module
+
+    # Given that I find an event once
+    core.find_event('app.Event').should.be.equals('my-lol-module')
+
+    # When I find it again, then the module should not be imported
+    # one more time
+    core.find_event('app.Event').should.be.equals('my-lol-module')
+    import_module.assert_called_once_with('app.events')
+
+    # And missing events should be cached as well
+    import_module.side_effect = ImportError
+    core.find_event.when.called_with('app.Missing').should.throw(
+        exceptions.EventNotFoundError)
+    core.find_event.when.called_with('app.Missing').should.throw(
+        exceptions.EventNotFoundError,
+        'Event "app.Missing" not found. Make sure you have a class '
+        'called "Missing" inside the "app.events" module.')
+    import_module.call_count.should.equal(2)
+
+    # Until the cache is invalidated
+    core.invalidate_event_cache('app.Missing')
+    import_module.side_effect = None
+    fake_module.Missing = 'found'
+    core.find_event('app.Missing').should.be.equals('found')
+    core.invalidate_event_cache()
+    core.EVENT_CLASS_CACHE.should.be.empty
+
+
+@patch('eventlib.core._module_exists')
+@patch('eventlib.core.import_module')
+def test_find_event_does_not_cache_broken_modules(import_module,
+                                                  module_exists):
+    core.invalidate_event_cache()
+
+    # Given an events module that fails while being imported
+    import_module.side_effect = ImportError('cannot import name Deal')
+    module_exists.return_value = True
+    core.find_event.when.called_with('app.Event').should.throw(
+        exceptions.EventNotFoundError,
+        'Event "app.Event" not found. Make sure you have a class '
+        'called "Event" inside the "app.events" module.')
+    module_exists.assert_called_once_with('app.events')
+
+    # When it's fixed, then the event should be found
+    import_module.side_effect = None
+    import_module.return_value.Event = 'found'
+    core.find_event('app.Event').should.be.equals('found')
+    core.invalidate_event_cache()
+
+
+def test_module_exists():
+    core._module_exists('eventlib.core').should.be.true
+    core._module_exists('eventlib.nothing').should.be.false
+    core._module_exists('nothing.events').should.be.false
+
+
 def test_filter_data_values():
     core.filter_data_values({'a': 'b', 'c': 'd'}).should.be.equals(
         {'a': 'b', 'c': 'd'}
@@ -60,6 +142,16 @@ def test_filter_data_values():
     )
 
 
+def test_filter_data_values_does_not_copy_clean_data():
+    data = {'a': 'b'}
+    core.filter_data_values(data).should.be(data)
+
+    # But the data received is never changed
+    data = {'a': 'b', 'request': None}
+    core.filter_data_values(data)
+    data.should.equal({'a': 'b', 'request': None})
+
+
 @patch('eventlib.core.datetime')
 @patch('eventlib.core.get_ip')
 def test_get_default_values_with_request(get_ip, datetime):
@@ -72,12 +164,36 @@ def test_get_default_values_with_request(get_ip, datetime):
     })
 
 
+@patch('eventlib.core.datetime')
+def test_set_default_values(datetime):
+    datetime.now.return_value = 'tea time!'
+    data = {'foo': 'bar'}
+    core.set_default_values(data).should.be(data)
+    data.should.equal({
+        'foo': 'bar',
+        '__datetime__': 'tea time!',
+        '__ip_address__': '0.0.0.0',
+    })
+
+
 @patch('eventlib.tasks.process')
 def test_celery_process_wrapper(process):
     tasks.process_task('name', 'data')
     process.assert_called_once_with('name', 'data')
 
 
+@patch('eventlib.tasks.process_batch')
+def test_celery_process_batch_wrapper(process_batch):
+    tasks.process_batch_task([('name', 'data')])
+    process_batch.assert_called_once_with([('name', 'data')])
+
+
+@patch('eventlib.tasks.flush_buffer')
+def test_celery_tasks_flush_the_broadcast_buffer(flush_buffer):
+    tasks.flush_broadcast_buffer(task=Mock())
+    flush_buffer.assert_called_once_with()
+
+
 @patch('eventlib.conf.settings')
 def test_django_integration(settings):
     # Given I mock django conf
@@ -88,6 +204,26 @@ def test_django_integration(settings):
     conf.getsetting('LOCAL_GEOLOCATION_IP').should.equal('CHUCK NORRIS')
 
 
+@patch('eventlib.conf.settings')
+def test_settings_snapshot(settings):
+    # Given that a setting was already read
+    settings.EVENTLIB_LOG_MODE = 'sync'
+    conf.getsetting('EVENTLIB_LOG_MODE').should.equal('sync')
+
+    # When it's changed by hand, then the snapshot still holds the old
+    # value until it's refreshed
+    settings.EVENTLIB_LOG_MODE = 'background'
+    conf.getsetting('EVENTLIB_LOG_MODE').should.equal('sync')
+    conf.refresh_settings()
+    conf.getsetting('EVENTLIB_LOG_MODE').should.equal('background')
+
+    # And settings left out of the snapshot are always read again
+    settings.SOMETHING_ELSE = 1
+    conf.getsetting('SOMETHING_ELSE').should.equal(1)
+    settings.SOMETHING_ELSE = 2
+    conf.getsetting('SOMETHING_ELSE').should.equal(2)
+
+
 @patch('eventlib.conf.settings')
 @patch('eventlib.core.import_module')
 def test_importing_events(import_module, settings):
@@ -100,3 +236,30 @@ def test_importing_events(import_module, settings):
     settings.INSTALLED_APPS = ['tester']
     import_module.side_effect = ImportError('P0wned!!!')
     core.import_event_modules()
+
+
+@patch('eventlib.conf.settings')
+@patch('eventlib.core.import_module')
+def test_importing_events_warms_up_the_event_cache(import_module, settings):
+    core.invalidate_event_cache()
+    settings.INSTALLED_APPS = ['test_app', 'dotted.app']
+
+    # Given that the events module declares a class and imports another
+    # one from somewhere else
+    class Imported(object):
+        pass
+
+    module = type(core)('test_app.events')
+    module.Imported = Imported
+    module.MyEvent = type('MyEvent', (object,), {
+        '__module__': 'test_app.events'})
+    import_module.return_value = module
+
+    # When the event modules are imported
+    core.import_event_modules()
+
+    # Then only the class declared in the events module should be cached
+    dict(core.EVENT_CLASS_CACHE).should.be.equals({
+        u'test_app.MyEvent': module.MyEvent,
+    })
+    core.invalidate_event_cache()
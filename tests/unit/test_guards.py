@@ -0,0 +1,151 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import eventlib
+from mock import Mock, patch
+from eventlib import core, guards
+from eventlib.exceptions import HandlerTimeoutError
+
+from .helpers import handler_settings
+
+
+def sleepy(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def test_call_with_timeout_in_the_main_thread():
+    guards.can_use_alarm().should.be.true
+    guards.call_with_timeout(sleepy, 0, 1).should.equal(0)
+    guards.call_with_timeout.when.called_with(sleepy, 1, 0.05).should.throw(
+        HandlerTimeoutError)
+
+
+@patch('eventlib.guards._thread_pool', None)
+def test_call_with_timeout_in_other_threads():
+    outcome = []
+
+    def run():
+        outcome.append(guards.can_use_alarm())
+        outcome.append(guards.call_with_timeout(sleepy, 0, 1))
+        try:
+            guards.call_with_timeout(sleepy, 1, 0.05)
+        except HandlerTimeoutError:
+            outcome.append('timeout')
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    outcome.should.equal([False, 0, 'timeout'])
+
+
+@patch('eventlib.guards.logger')
+def test_thread_pool_reuses_and_caps_its_threads(logger):
+    pool = guards.ThreadPool(size=1)
+
+    # Threads are reused by the following calls
+    pool.call(sleepy, 0, 1).should.equal(0)
+    pool.call(sleepy, 0, 1).should.equal(0)
+    pool.threads.should.equal(1)
+
+    # When a handler hangs, its thread is abandoned
+    pool.call.when.called_with(sleepy, 0.2, 0.01).should.throw(
+        HandlerTimeoutError, 'The handler took more than 0.01s')
+
+    # Then no other thread is started while it's busy
+    pool.call.when.called_with(sleepy, 0, 1).should.throw(
+        HandlerTimeoutError, 'There are no threads left to run the handler')
+    logger.warning.assert_called_once_with(
+        'All the 1 threads that run the handlers with a timeout are busy, '
+        'probably with handlers that hang')
+
+    # And the thread is back to the pool when the handler returns
+    time.sleep(0.3)
+    pool.call(sleepy, 0, 1).should.equal(0)
+    pool.threads.should.equal(1)
+
+
+@patch('eventlib.guards.time')
+def test_circuit_breaker(time):
+    time.time.return_value = 100
+    breaker = guards.CircuitBreaker(threshold=2, reset_timeout=30)
+
+    # Given a handler that fails twice in a row
+    breaker.failure().should.be.false
+    breaker.failure().should.be.true
+
+    # Then it should be skipped until the reset timeout
+    breaker.allow().should.be.false
+    time.time.return_value = 130
+
+    # When the time is up, then a single call should probe the handler
+    breaker.allow().should.be.true
+    breaker.allow().should.be.false
+
+    # And it should be skipped again if the probe fails
+    breaker.failure().should.be.false
+    breaker.allow().should.be.false
+
+    # Or be back to work after a successful probe
+    time.time.return_value = 160
+    breaker.allow().should.be.true
+    breaker.success().should.be.true
+    breaker.allow().should.be.true
+    breaker.failure().should.be.false
+
+
+@patch('eventlib.core.logger')
+@patch('eventlib.conf.settings')
+def test_run_handler_skips_handlers_that_keep_failing(settings, logger):
+    core.cleanup_handlers()
+    guards.reset_breakers()
+    handler_settings(settings, EVENTLIB_BREAKER_THRESHOLD=2,
+                     EVENTLIB_BREAKER_RESET_TIMEOUT=30)
+    sink = Mock()
+
+    handler = Mock(__name__='flaky', side_effect=ValueError('Down'))
+    eventlib.external_handler('app.Event')(handler)
+
+    # When the handler fails as many times as the threshold
+    for i in range(3):
+        core.run_handler('app.Event', handler, {}, sink)
+
+    # Then it should be skipped in the following events
+    handler.call_count.should.equal(2)
+    name = core.handler_name(handler)
+    sink.incr.assert_any_call('handlers.{}.skipped'.format(name))
+    logger.warning.assert_called_with(
+        'The handler "{}" failed 2 times in a row and will be '
+        'skipped for 30s'.format(name))
+    guards.reset_breakers()
+
+
+@patch('eventlib.core.logger')
+@patch('eventlib.conf.settings')
+def test_run_handler_counts_timeouts(settings, logger):
+    handler_settings(settings, EVENTLIB_HANDLER_TIMEOUT=1,
+                     EVENTLIB_HANDLER_TIMEOUTS={
+                         'tests.unit.test_guards.sleepy': 0.05})
+    sink = Mock()
+
+    core.run_handler('app.Event', sleepy, 1, sink)
+
+    sink.incr.assert_any_call('handlers.tests.unit.test_guards.sleepy.timeout')
+    logger.warning.assert_called_once_with(
+        'One of the handlers for the event "app.Event" has failed with the '
+        'following exception: The handler took more than 0.05s')
@@ -43,6 +43,25 @@ def test_handler_with_methods():
     core.HANDLER_REGISTRY['tests.MyEvent'].should.be.equals([MyEvent.handle_stuff])
 
 
+def test_batch_handlers():
+    core.cleanup_handlers()
+
+    @eventlib.handler('stuff.Klass', batch=True)
+    def do_nothing(items):
+        pass
+
+    class MyEvent(eventlib.BaseEvent):
+
+        @eventlib.handler(batch=True)
+        def handle_stuff(self):
+            pass
+
+    core.is_batch_handler(do_nothing).should.be.true
+    core.is_batch_handler(MyEvent.handle_stuff).should.be.true
+    core.HANDLER_REGISTRY['tests.MyEvent'].should.be.equals(
+        [MyEvent.handle_stuff])
+
+
 def test_wildcard_handler():
     core.cleanup_handlers()
 
@@ -165,3 +184,77 @@ def test_find_handlers_with_mixed_objects_and_strings(find_event):
     core.find_handlers('tests.MyEvent').should.be.equals([
         MyEvent.handle_stuff, do_nothing
     ])
+
+
+def test_find_handlers_keeps_registration_order_between_patterns():
+    core.cleanup_handlers()
+
+    @eventlib.handler('app.*')
+    def wildcard(data):
+        pass
+
+    @eventlib.handler('app.Event')
+    def exact(data):
+        pass
+
+    @eventlib.handler('app.Ev?nt')
+    def single_char(data):
+        pass
+
+    core.find_handlers('app.Event').should.be.equals(
+        [wildcard, exact, single_char])
+    core.find_handlers('app.Other').should.be.equals([wildcard])
+
+
+def test_find_handlers_cache_is_invalidated_by_the_registry():
+    core.cleanup_handlers()
+
+    @eventlib.handler('app.Event')
+    def stuff(data):
+        pass
+
+    # Given that the handlers of the event were already resolved once
+    core.find_handlers('app.Event').should.be.equals([stuff])
+    index = core.get_dispatch_index(core.HANDLER_REGISTRY)
+    index.cache.should.have.key('app.Event')
+
+    # When a new handler is registered, then it should be found too
+    @eventlib.handler('app.*')
+    def more_stuff(data):
+        pass
+    core.find_handlers('app.Event').should.be.equals([stuff, more_stuff])
+
+    # And when the registry is cleaned up, then nothing should be found
+    core.cleanup_handlers('app.Event')
+    core.find_handlers('app.Event').should.be.equals([more_stuff])
+    core.cleanup_handlers()
+    core.find_handlers('app.Event').should.be.equals([])
+
+
+def test_pattern_index():
+    mapping = {'app.Event': 1}
+    index = core.PatternIndex(mapping)
+    index.resolve('app.Event').should.be.equals([1])
+    index.resolve('app.Other').should.be.equals([])
+
+    # The result is cached until the index is invalidated
+    mapping['app.*'] = 2
+    index.resolve('app.Other').should.be.equals([])
+    index.invalidate()
+    index.resolve('app.Other').should.be.equals([2])
+
+
+def test_pattern_index_does_not_cache_results_of_an_old_generation():
+    mapping = {'app.*': [1]}
+
+    # Given that the index is invalidated while a name is resolved,
+    # like when another thread registers a handler
+    def combine(values):
+        index.invalidate()
+        return core._flatten(values)
+    index = core.PatternIndex(mapping, combine=combine)
+
+    # When the name is resolved, then the result should be returned but
+    # not cached, since it may be stale already
+    index.resolve('app.Event').should.equal([1])
+    index.cache.should.be.empty
@@ -14,7 +14,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import ejson
-from mock import call, patch
+from mock import Mock, call, patch
+from eventlib import listener, transport
 from eventlib.listener import listen_for_events
 
 
@@ -25,6 +26,14 @@ def gen():
         yield {'type': 'message', 'data': test_data}
 
 
+def gen_framed():
+    """Generate framed events for the test_read_framed_events function"""
+    for i in range(2):
+        test_data = ejson.dumps({'a': 'b'})
+        yield {'type': 'message',
+               'data': transport.encode_frame(u'app.TestEvent', test_data)}
+
+
 def gen_non_message_events():
     """Generate events for the test_read_events_skip_non_messages function"""
     for i in range(2):
@@ -35,6 +44,8 @@ def gen_non_message_events():
 @patch('eventlib.listener.process_external')
 @patch('eventlib.conf.settings')
 def test_read_events(settings, process_external, redis_connection):
+    settings.EVENTLIB_LISTENER_WORKERS = 0
+    settings.EVENTLIB_LISTENER_BATCH_SIZE = 0
     pubsub = redis_connection.get_connection.return_value.pubsub
     pubsub.return_value.listen.side_effect = gen
     listen_for_events()
@@ -45,10 +56,28 @@ def test_read_events(settings, process_external, redis_connection):
     ])
 
 
+@patch('eventlib.listener.redis_connection')
+@patch('eventlib.listener.process_external')
+@patch('eventlib.conf.settings')
+def test_read_framed_events(settings, process_external, redis_connection):
+    settings.EVENTLIB_LISTENER_WORKERS = 0
+    settings.EVENTLIB_LISTENER_BATCH_SIZE = 0
+    pubsub = redis_connection.get_connection.return_value.pubsub
+    pubsub.return_value.listen.side_effect = gen_framed
+    listen_for_events()
+
+    process_external.assert_has_calls([
+        call(u'app.TestEvent', {'a': 'b'}),
+        call(u'app.TestEvent', {'a': 'b'}),
+    ])
+
+
 @patch('eventlib.listener.redis_connection')
 @patch('eventlib.listener.process_external')
 @patch('eventlib.conf.settings')
 def test_read_events_skip_non_messages(settings, process_external, conn):
+    settings.EVENTLIB_LISTENER_WORKERS = 0
+    settings.EVENTLIB_LISTENER_BATCH_SIZE = 0
 
     # Given I mock the pubsub connection to return only messages with
     # types different from "message"
@@ -60,3 +89,197 @@ def test_read_events_skip_non_messages(settings, process_external, conn):
 
     # Then No messages should be processed
     process_external.assert_has_calls([])
+
+
+@patch('eventlib.listener.redis_connection')
+@patch('eventlib.listener.process_external')
+@patch('eventlib.conf.settings')
+def test_read_events_with_a_worker_pool(settings, process_external,
+                                        redis_connection):
+    settings.EVENTLIB_LISTENER_WORKERS = 2
+    settings.EVENTLIB_LISTENER_BATCH_SIZE = 0
+    settings.EVENTLIB_LISTENER_BACKEND = 'thread'
+    settings.EVENTLIB_LISTENER_QUEUE_SIZE = 10
+    settings.EVENTLIB_LISTENER_OVERFLOW = 'block'
+    settings.EVENTLIB_LISTENER_ORDERED = False
+    pubsub = redis_connection.get_connection.return_value.pubsub
+    pubsub.return_value.listen.side_effect = gen
+
+    # When I listen to the events using a pool of workers
+    listen_for_events()
+
+    # Then all the events should be processed before the listener exits
+    process_external.assert_has_calls([
+        call(u'app.TestEvent', {'a': 'b'}),
+        call(u'app.TestEvent', {'a': 'b'}),
+    ])
+
+
+@patch('eventlib.listener.process_external')
+def test_worker_pool_keeps_the_order_per_event_name(process_external):
+    handled = []
+    process_external.side_effect = lambda name, data: handled.append(
+        (name, data['i']))
+
+    # Given I have an ordered pool with a queue per worker
+    pool = listener.WorkerPool(3, ordered=True)
+    len(pool.queues).should.equal(3)
+
+    # When I submit events with different names
+    for i in range(20):
+        pool.submit('app.Event{}'.format(i % 4), {'i': i})
+    pool.close()
+
+    # Then the events of each name should be handled in order
+    for n in range(4):
+        name = 'app.Event{}'.format(n)
+        [i for event, i in handled if event == name].should.be.equal(
+            list(range(n, 20, 4)))
+
+
+@patch('eventlib.listener.logger')
+def test_worker_pool_drops_events_when_full(logger):
+    # Given I have a pool with a queue that is already full
+    pool = listener.WorkerPool(0, queue_size=1, overflow='drop')
+    pool.submit('app.Event', {})
+
+    # When I submit another event, then it should be dropped
+    pool.submit('app.Event', {})
+    pool.queues[0].qsize().should.equal(1)
+    logger.warning.assert_called_once_with(
+        'The listener queue is full, dropping the event "app.Event"')
+
+
+@patch('eventlib.listener.logger')
+@patch('eventlib.listener.process_external')
+def test_worker_survives_handler_failures(process_external, logger):
+    process_external.side_effect = [ValueError('P0wned!!!'), None]
+    pool = listener.WorkerPool(1)
+    pool.submit('app.Event', {'a': 1})
+    pool.submit('app.Event', {'a': 2})
+    pool.close()
+
+    process_external.call_count.should.equal(2)
+    logger.exception.assert_called_once_with(
+        'The listener failed to process the event "app.Event"')
+
+
+@patch('eventlib.conf.settings')
+def test_no_worker_pool_by_default(settings):
+    settings.EVENTLIB_LISTENER_WORKERS = 0
+    listener.get_worker_pool().should.be.none
+
+
+@patch('eventlib.listener.get_stream_reader')
+@patch('eventlib.listener.redis_connection')
+@patch('eventlib.listener.process_external_batch')
+@patch('eventlib.conf.settings')
+def test_read_events_from_a_stream(settings, process_external_batch,
+                                   redis_connection, get_stream_reader):
+    settings.EVENTLIB_LISTENER_WORKERS = 0
+    settings.EVENTLIB_TRANSPORT = 'streams'
+    reader = get_stream_reader.return_value
+    message = ejson.dumps({'name': 'app.TestEvent', 'a': 'b'})
+    reader.read.return_value = iter([[('1-0', message), ('2-0', None)]])
+
+    # When I listen to the events of the stream
+    listen_for_events()
+
+    # Then the messages should be processed and acknowledged
+    process_external_batch.assert_called_once_with(
+        [(u'app.TestEvent', {'a': 'b'})])
+    reader.ack.assert_called_once_with(['1-0', '2-0'])
+    redis_connection.get_connection.return_value.pubsub.called.should.be.false
+
+
+@patch('eventlib.listener.EXTERNAL_HANDLER_REGISTRY',
+       {'app.TestEvent': [], 'other.*': []})
+@patch('eventlib.listener.redis_connection')
+@patch('eventlib.listener.process_external')
+@patch('eventlib.conf.settings')
+def test_read_events_from_routed_channels(settings, process_external,
+                                          redis_connection):
+    settings.EVENTLIB_LISTENER_WORKERS = 0
+    settings.EVENTLIB_LISTENER_BATCH_SIZE = 0
+    settings.EVENTLIB_TRANSPORT = 'pubsub'
+    settings.EVENTLIB_BROADCAST_ROUTING = 'event'
+    pubsub = redis_connection.get_connection.return_value.pubsub
+    message = ejson.dumps({'name': 'other.Event', 'a': 'b'})
+    pubsub.return_value.listen.return_value = iter([
+        {'type': 'pmessage', 'data': message}])
+
+    # When I listen to the events routed to a channel per event
+    listen_for_events()
+
+    # Then only the channels of the handled events are subscribed
+    pubsub.return_value.subscribe.assert_called_once_with(
+        u'eventlib:app.TestEvent')
+    pubsub.return_value.psubscribe.assert_called_once_with(
+        u'eventlib:other.*')
+
+    # And messages matching patterns are processed too
+    process_external.assert_called_once_with(u'other.Event', {'a': 'b'})
+
+
+class FakePubSub(object):
+    """Returns the given messages with `get_message()`, then unsubscribes
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.subscribe = Mock()
+
+    @property
+    def subscribed(self):
+        return bool(self.messages)
+
+    def get_message(self, timeout=0):
+        return self.messages.pop(0)
+
+
+@patch('eventlib.listener.redis_connection')
+@patch('eventlib.listener.process_external_batch')
+@patch('eventlib.conf.settings')
+def test_read_events_in_batches(settings, process_external_batch,
+                                redis_connection):
+    settings.EVENTLIB_LISTENER_WORKERS = 0
+    settings.EVENTLIB_TRANSPORT = 'pubsub'
+    settings.EVENTLIB_BROADCAST_ROUTING = None
+    settings.EVENTLIB_LISTENER_BATCH_SIZE = 2
+    settings.EVENTLIB_LISTENER_BATCH_TIMEOUT = 60
+    message = ejson.dumps({'name': 'app.TestEvent', 'a': 'b'})
+    pubsub = FakePubSub([
+        {'type': 'subscribe', 'data': 1},
+        {'type': 'message', 'data': message},
+        None,
+        {'type': 'message', 'data': message},
+        {'type': 'message', 'data': message},
+        None,
+    ])
+    redis_connection.get_connection.return_value.pubsub.return_value = pubsub
+
+    # When I listen to the events in batches of two messages
+    listen_for_events()
+
+    # Then the messages are handled in batches
+    process_external_batch.assert_has_calls([
+        call([(u'app.TestEvent', {'a': 'b'})] * 2),
+        call([(u'app.TestEvent', {'a': 'b'})]),
+    ])
+    process_external_batch.call_count.should.equal(2)
+
+
+@patch('eventlib.listener.process_external_batch')
+def test_worker_pool_handles_batches(process_external_batch):
+    pool = listener.WorkerPool(2, ordered=True)
+    events = [('app.Event{}'.format(i % 2), {'i': i}) for i in range(4)]
+    pool.submit_batch(events)
+    pool.close()
+
+    # Each worker handles the events of its queue in a single batch
+    batches = {}
+    for event_name, data in events:
+        batches.setdefault(hash(event_name) % 2, []).append((event_name, data))
+    process_external_batch.call_count.should.equal(len(batches))
+    process_external_batch.assert_has_calls(
+        [call(batch) for batch in batches.values()], any_order=True)
@@ -16,7 +16,7 @@
 import ejson
 import eventlib
 from mock import Mock, patch
-from eventlib import core
+from eventlib import core, exceptions
 
 
 @patch('eventlib.core.datetime')
@@ -64,3 +64,189 @@ def test_log_insert_datetime(conf, find_event, process, datetime):
     data = {'name': 'Event System', 'code': 42}
     eventlib.log('app.Event', data)
     data['__datetime__'].should.be.equals('tea time')
+
+
+@patch('eventlib.api.tasks')
+@patch('eventlib.core.find_event')
+@patch('eventlib.core.datetime')
+@patch('eventlib.api.conf')
+def test_log_many(conf, datetime, find_event, tasks):
+    conf.getsetting.return_value = False
+    datetime.now.return_value = 'tea time'
+
+    # When I log more than one event at once
+    eventlib.log_many([
+        ('app.Event', {'a': 1}),
+        ('app.Other', {'b': 2}),
+    ])
+
+    # Then all of them should be validated locally
+    find_event.return_value.return_value.validate.call_count.should.equal(2)
+
+    # And sent through a single celery task
+    tasks.process_task.delay.called.should.be.false
+    tasks.process_batch_task.delay.assert_called_once_with([
+        ('app.Event', ejson.dumps({
+            'a': 1, '__ip_address__': '0.0.0.0', '__datetime__': 'tea time'})),
+        ('app.Other', ejson.dumps({
+            'b': 2, '__ip_address__': '0.0.0.0', '__datetime__': 'tea time'})),
+    ])
+
+
+@patch('eventlib.api.tasks')
+@patch('eventlib.core.find_event')
+@patch('eventlib.api.conf')
+def test_log_many_does_not_send_anything_when_an_event_is_invalid(
+        conf, find_event, tasks):
+    conf.getsetting.return_value = False
+
+    # Given that the second event won't pass the validation
+    find_event.return_value.return_value.validate.side_effect = \
+        [None, exceptions.ValidationError('P0wned!!!')]
+
+    # When I log them, then the validation error should be raised
+    eventlib.log_many.when.called_with([
+        ('app.Event', {'a': 1}),
+        ('app.Event', {'a': 2}),
+    ]).should.throw(exceptions.ValidationError, 'P0wned!!!')
+
+    # And no events should be sent
+    tasks.process_batch_task.delay.called.should.be.false
+
+
+@patch('eventlib.core.datetime')
+@patch('eventlib.core.process_batch')
+@patch('eventlib.core.find_event')
+@patch('eventlib.api.conf')
+def test_log_batch(conf, find_event, process_batch, datetime):
+    conf.getsetting.return_value = True
+    datetime.now.return_value = 'tea time'
+
+    with eventlib.LogBatch() as batch:
+        batch.log('app.Event', {'a': 1})
+
+        # Events are validated as soon as they're added to the batch
+        find_event.assert_called_once_with('app.Event')
+        process_batch.called.should.be.false
+
+    process_batch.assert_called_once_with([
+        ('app.Event', ejson.dumps({
+            'a': 1, '__ip_address__': '0.0.0.0', '__datetime__': 'tea time'})),
+    ])
+
+    # Flushing an empty batch does nothing
+    batch.flush()
+    process_batch.call_count.should.equal(1)
+
+
+@patch('eventlib.api.shipper')
+@patch('eventlib.api.tasks')
+@patch('eventlib.core.find_event')
+@patch('eventlib.core.datetime')
+@patch('eventlib.api.conf')
+def test_log_in_the_background(conf, datetime, find_event, tasks, shipper):
+    settings = {'EVENTLIB_LOG_MODE': 'background'}
+    conf.getsetting.side_effect = settings.get
+    core.cleanup_handlers()
+    datetime.now.return_value = 'tea time'
+
+    eventlib.log('app.Event')
+
+    tasks.process_task.delay.called.should.be.false
+    shipper.get_shipper.return_value.put.assert_called_once_with(
+        'app.Event', ejson.dumps({
+            '__ip_address__': '0.0.0.0', '__datetime__': 'tea time',
+        }))
+
+
+@patch('eventlib.api.spill')
+@patch('eventlib.api.tasks')
+@patch('eventlib.core.find_event')
+@patch('eventlib.core.datetime')
+@patch('eventlib.api.conf')
+def test_log_spills_events_when_the_broker_is_down(
+        conf, datetime, find_event, tasks, spill):
+    conf.getsetting.return_value = False
+    core.cleanup_handlers()
+    datetime.now.return_value = 'tea time'
+    tasks.process_task.delay.side_effect = IOError('Connection refused')
+
+    # When the spill buffer is enabled, the event goes to disk
+    spill.spill_events.return_value = True
+    eventlib.log('app.Event')
+    spill.spill_events.assert_called_once_with([
+        ('app.Event', ejson.dumps({
+            '__ip_address__': '0.0.0.0', '__datetime__': 'tea time'}))])
+
+    # Otherwise the error is raised
+    spill.spill_events.return_value = False
+    eventlib.log.when.called_with('app.Event').should.throw(
+        IOError, 'Connection refused')
+
+
+@patch('eventlib.api.tasks')
+@patch('eventlib.core.find_event')
+@patch('eventlib.core.datetime')
+@patch('eventlib.api.conf')
+@patch('eventlib.conf.settings')
+def test_log_sends_the_task_options_of_the_events(
+        settings, conf, datetime, find_event, tasks):
+    conf.getsetting.return_value = False
+    settings.EVENTLIB_EVENT_ROUTES = {'app.Bulk*': {'queue': 'bulk'}}
+    settings.EVENTLIB_SERIALIZER = 'ejson'
+    settings.EVENTLIB_SPILL_DIR = None
+    datetime.now.return_value = 'tea time'
+
+    # Given an event class that declares its task options
+    class Event(eventlib.BaseEvent):
+        task_options = {'priority': 9, 'expires': 60}
+    find_event.return_value = Event
+
+    # When I log it, then the task should be sent with the options
+    eventlib.log('app.Event')
+    tasks.process_task.apply_async.assert_called_once_with(
+        ('app.Event', ejson.dumps({
+            '__ip_address__': '0.0.0.0', '__datetime__': 'tea time'})),
+        priority=9, expires=60)
+
+    # And the events logged at once should be split by their options
+    eventlib.log_many([
+        ('app.Event', {'a': 1}),
+        ('app.BulkEvent', {'a': 2}),
+        ('app.Event', {'a': 3}),
+    ])
+    tasks.process_batch_task.apply_async.call_count.should.equal(2)
+    first, second = tasks.process_batch_task.apply_async.call_args_list
+    [name for name, data in first[0][0][0]].should.equal(
+        ['app.Event', 'app.Event'])
+    first[1].should.equal({'priority': 9, 'expires': 60})
+    [name for name, data in second[0][0][0]].should.equal(['app.BulkEvent'])
+    second[1].should.equal({'priority': 9, 'expires': 60, 'queue': 'bulk'})
+
+
+@patch('eventlib.api.tasks')
+@patch('eventlib.core.find_event')
+@patch('eventlib.api.conf')
+@patch('eventlib.conf.settings')
+def test_log_many_with_dict_task_options(settings, conf, find_event, tasks):
+    conf.getsetting.return_value = False
+    settings.EVENTLIB_SERIALIZER = 'ejson'
+    settings.EVENTLIB_SPILL_DIR = None
+    settings.EVENTLIB_EVENT_ROUTES = {
+        'app.*': {'queue': 'bulk', 'retry_policy': {'max_retries': 3}},
+        'app.Other': {'headers': {'source': 'web'}},
+    }
+
+    eventlib.log_many([
+        ('app.Event', {'a': 1}),
+        ('app.Other', {'a': 2}),
+        ('app.Event', {'a': 3}),
+    ])
+
+    # Dict options don't stop the events from being grouped
+    first, second = tasks.process_batch_task.apply_async.call_args_list
+    len(first[0][0][0]).should.equal(2)
+    first[1].should.equal(
+        {'queue': 'bulk', 'retry_policy': {'max_retries': 3}})
+    len(second[0][0][0]).should.equal(1)
+    second[1]['headers'].should.equal({'source': 'web'})
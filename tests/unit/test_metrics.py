@@ -0,0 +1,174 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ejson
+import functools
+from mock import Mock, patch
+
+import eventlib
+from eventlib import conf, core, exceptions, metrics
+
+from .helpers import handler_settings
+
+
+def test_in_memory_sink():
+    sink = metrics.InMemorySink()
+    sink.incr('events.app.Event.processed')
+    sink.incr('events.app.Event.processed', 2)
+    sink.timing('handlers.app.handlers.stuff', 1.5)
+
+    dict(sink.counters).should.equal({'events.app.Event.processed': 3})
+    dict(sink.timings).should.equal({'handlers.app.handlers.stuff': [1.5]})
+
+    sink.reset()
+    sink.counters.should.be.empty
+
+
+@patch('eventlib.metrics.socket.socket')
+def test_statsd_sink(socket):
+    sink = metrics.StatsdSink(host='statsd', port=9999, prefix='myapp')
+    sink.incr('events.app.Event.processed')
+    sink.timing('handlers.app.handlers.stuff', 1.5)
+
+    socket.return_value.sendto.assert_any_call(
+        b'myapp.events.app.Event.processed:1|c', ('statsd', 9999))
+    socket.return_value.sendto.assert_any_call(
+        b'myapp.handlers.app.handlers.stuff:1.500|ms', ('statsd', 9999))
+
+
+@patch('eventlib.conf.settings')
+def test_get_sink(settings):
+    settings.EVENTLIB_METRICS_SINK = None
+    metrics.get_sink().should.be.a(metrics.MetricsSink)
+
+    settings.EVENTLIB_METRICS_SINK = 'eventlib.metrics.StatsdSink'
+    settings.EVENTLIB_METRICS_OPTIONS = {'port': 9999}
+    conf.refresh_settings()
+    sink = metrics.get_sink()
+    sink.should.be.a(metrics.StatsdSink)
+    sink.address.should.equal(('localhost', 9999))
+
+    # The sink is reused until the setting changes
+    metrics.get_sink().should.be(sink)
+
+    in_memory = metrics.InMemorySink()
+    settings.EVENTLIB_METRICS_SINK = in_memory
+    conf.refresh_settings()
+    metrics.get_sink().should.be(in_memory)
+
+
+def test_handler_name():
+    def stuff(data):
+        pass
+    core.handler_name(stuff).should.equal('tests.unit.test_metrics.stuff')
+    core.handler_name(Mock()).should.equal(
+        '{}.Mock'.format(Mock.__module__))
+
+
+def test_handler_names_are_unambiguous():
+    core.cleanup_handlers()
+
+    def notify(data, team):
+        pass
+
+    class Event(eventlib.BaseEvent):
+        @eventlib.handler
+        def save(self, data):
+            pass
+
+    # Partials are named after the function they wrap and methods after
+    # their classes
+    eventlib.handler('app.Event')(functools.partial(notify, team='sales'))
+    core.handler_name(core.find_handlers('app.Event')[0]).should.equal(
+        'tests.unit.test_metrics.notify')
+    core.handler_name(Event.save).should.equal(
+        'tests.unit.test_metrics.Event.save')
+
+    # Handlers sharing a name can be registered, but not sent to the
+    # workers or found in the settings by that name
+    eventlib.handler('app.Event')(functools.partial(notify, team='ops'))
+    error = (
+        'The handler name "tests.unit.test_metrics.notify" is shared by 2 '
+        'handlers, register them with names of their own')
+    core.fan_out.when.called_with(
+        'app.Event', core.find_handlers('app.Event'), [{}]).should.throw(
+            exceptions.HandlerNameError, error)
+    core.get_handler_timeout.when.called_with(
+        'tests.unit.test_metrics.notify').should_not.throw(Exception)
+    with patch('eventlib.conf.settings') as settings:
+        settings.EVENTLIB_HANDLER_TIMEOUTS = {
+            'tests.unit.test_metrics.notify': 1}
+        core.get_handler_timeout.when.called_with(
+            'tests.unit.test_metrics.notify').should.throw(
+                exceptions.HandlerNameError, error)
+
+    # Until they get names of their own
+    ops = functools.partial(notify, team='ops')
+    eventlib.handler('app.Event', name='app.notify_ops')(ops)
+    core.handler_name(ops).should.equal('app.notify_ops')
+    core.check_handler_name('app.notify_ops')
+    core.cleanup_handlers()
+
+
+@patch('eventlib.core.find_event')
+@patch('eventlib.core.logger')
+@patch('eventlib.conf.settings')
+def test_process_reports_metrics(settings, logger, find_event):
+    core.cleanup_handlers()
+    sink = metrics.InMemorySink()
+    handler_settings(settings, EVENTLIB_METRICS_SINK=sink)
+
+    def ok(data):
+        pass
+
+    def fail(data):
+        raise ValueError('P0wned!!!')
+
+    eventlib.handler('app.Event')(ok)
+    eventlib.handler('app.Event')(fail)
+
+    core.process('app.Event', ejson.dumps({'a': 1}))
+
+    dict(sink.counters).should.equal({
+        'events.app.Event.processed': 1,
+        'events.app.Event.failed': 1,
+        'handlers.tests.unit.test_metrics.fail.failed': 1,
+    })
+    sorted(sink.timings.keys()).should.equal([
+        'events.app.Event.broadcast',
+        'events.app.Event.clean',
+        'events.app.Event.handlers',
+        'handlers.tests.unit.test_metrics.fail',
+        'handlers.tests.unit.test_metrics.ok',
+    ])
+
+
+@patch('eventlib.core.time')
+@patch('eventlib.core.logger')
+@patch('eventlib.conf.settings')
+def test_slow_handlers_are_logged(settings, logger, time):
+    core.cleanup_handlers()
+    handler_settings(settings, EVENTLIB_SLOW_HANDLER_THRESHOLD=500)
+    time.time.side_effect = [10, 11]
+
+    def slow(data):
+        pass
+    eventlib.external_handler('app.Event')(slow)
+
+    core.process_external('app.Event', {})
+
+    logger.warning.assert_called_once_with(
+        'The handler "tests.unit.test_metrics.slow" took 1000.0ms to '
+        'process the event "app.Event"')
@@ -15,8 +15,10 @@
 
 import ejson
 import eventlib
-from mock import Mock, patch
-from eventlib import core, exceptions
+from mock import Mock, call, patch
+from eventlib import conf, core, exceptions
+
+from .helpers import handler_settings
 
 
 @patch('eventlib.core.find_event')
@@ -91,7 +93,7 @@ def test_process_data_clean_raise_errors(logger, find_event):
 @patch('eventlib.conf.settings')
 def test_process_fails_gracefully(settings, logger, find_event):
     core.cleanup_handlers()
-    settings.DEBUG = False
+    handler_settings(settings)
 
     handler_fail = Mock()
     handler_fail.side_effect = ValueError('P0wned!!!')
@@ -115,7 +117,7 @@ def test_process_fails_gracefully(settings, logger, find_event):
 @patch('eventlib.conf.settings')
 def test_process_external_fails_gracefully(settings, logger, find_event):
     core.cleanup_handlers()
-    settings.DEBUG = False
+    handler_settings(settings)
 
     handler_fail = Mock()
     handler_fail.side_effect = ValueError('P0wned!!!')
@@ -138,7 +140,7 @@ def test_process_external_fails_gracefully(settings, logger, find_event):
 @patch('eventlib.conf.settings')
 def test_process_raises_the_exception_when_debugging(settings, find_event):
     core.cleanup_handlers()
-    settings.DEBUG = True
+    handler_settings(settings, DEBUG=True)
 
     handler_fail = Mock()
     handler_fail.side_effect = ValueError('P0wned!!!')
@@ -153,7 +155,7 @@ def test_process_raises_the_exception_when_debugging(settings, find_event):
 def test_process_external_raises_the_exception_when_debugging(
         settings, find_event):
     core.cleanup_handlers()
-    settings.DEBUG = True
+    handler_settings(settings, DEBUG=True)
 
     handler_fail = Mock()
     handler_fail.side_effect = ValueError('P0wned!!!')
@@ -161,3 +163,195 @@ def test_process_external_raises_the_exception_when_debugging(
     name, data = 'myapp.CoolEvent', {'a': 1}
     core.process_external.when.called_with(name, data).should.throw(
         ValueError, 'P0wned!!!')
+
+
+@patch('eventlib.core.find_event')
+@patch('eventlib.core.logger')
+@patch('eventlib.conf.settings')
+def test_process_batch(settings, logger, find_event):
+    core.cleanup_handlers()
+    handler_settings(settings)
+
+    handler = Mock()
+    eventlib.handler('app.Event')(handler)
+
+    # Given that the class of one of the events can't be found
+    find_event.side_effect = [
+        Mock(), exceptions.EventNotFoundError('Not here'), Mock()]
+
+    # When I process a batch of events
+    core.process_batch([
+        ('app.Event', ejson.dumps({'a': 1})),
+        ('app.Event', ejson.dumps({'a': 2})),
+        ('app.Event', ejson.dumps({'a': 3})),
+    ])
+
+    # Then the failure should be logged and the other events should
+    # be processed anyway
+    logger.warning.assert_called_once_with(
+        'The event "app.Event" could not be processed in a batch and '
+        'failed with the following exception: Not here')
+    handler.call_args_list.should.have.length_of(2)
+    handler.assert_has_calls([call({'a': 1}), call({'a': 3})])
+
+
+@patch('eventlib.core.find_event')
+@patch('eventlib.conf.settings')
+def test_process_batch_raises_the_exception_when_debugging(
+        settings, find_event):
+    core.cleanup_handlers()
+    settings.DEBUG = True
+    find_event.side_effect = exceptions.EventNotFoundError('Not here')
+    core.process_batch.when.called_with(
+        [('app.Event', ejson.dumps({}))]
+    ).should.throw(exceptions.EventNotFoundError, 'Not here')
+
+
+def test_process_external_batch():
+    core.cleanup_handlers()
+
+    handler = Mock()
+    eventlib.external_handler('app.*')(handler)
+
+    batch_handler = Mock()
+    eventlib.external_handler('app.*', batch=True)(batch_handler)
+
+    # When I process a batch with events of different names
+    core.process_external_batch([
+        ('app.Event', {'a': 1}),
+        ('app.Other', {'a': 2}),
+        ('app.Event', {'a': 3}),
+    ])
+
+    # Then regular handlers should be called once per event
+    handler.assert_has_calls([call({'a': 1}), call({'a': 2}), call({'a': 3})])
+
+    # And batch handlers once per event name, with all the data at once
+    batch_handler.assert_has_calls([
+        call([{'a': 1}, {'a': 3}]),
+        call([{'a': 2}]),
+    ])
+    batch_handler.call_count.should.equal(2)
+
+    # Batch handlers receive lists even for single events
+    core.process_external('app.Event', {'a': 4})
+    batch_handler.assert_called_with([{'a': 4}])
+
+
+@patch('eventlib.core.find_event')
+@patch('eventlib.conf.settings')
+def test_process_batch_with_batch_handlers(settings, find_event):
+    core.cleanup_handlers()
+    handler_settings(settings)
+
+    handler = Mock()
+    eventlib.handler('app.*', batch=True)(handler)
+
+    # When I process a batch of events
+    core.process_batch([
+        ('app.Event', ejson.dumps({'a': 1})),
+        ('app.Other', ejson.dumps({'a': 2})),
+        ('app.Event', ejson.dumps({'a': 3})),
+    ])
+
+    # Then the batch handler should be called once per event name
+    handler.call_count.should.equal(2)
+    handler.assert_has_calls([
+        call([{'a': 1}, {'a': 3}]),
+        call([{'a': 2}]),
+    ])
+
+    # And with a list of a single item for events processed alone
+    core.process('app.Event', ejson.dumps({'a': 4}))
+    handler.assert_called_with([{'a': 4}])
+
+
+def save(data):
+    pass
+
+
+def resize(data):
+    pass
+
+
+def index(items):
+    pass
+
+
+@patch('eventlib.core.find_event')
+@patch('eventlib.core.tasks')
+@patch('eventlib.core.celery')
+@patch('eventlib.conf.settings')
+def test_process_fans_out_the_handlers(settings, celery, tasks, find_event):
+    core.cleanup_handlers()
+    settings.DEBUG = False
+    settings.EVENTLIB_DISPATCH_MODE = 'handler'
+    settings.EVENTLIB_SERIALIZER = 'ejson'
+    settings.EVENTLIB_EVENT_ROUTES = None
+    find_event.return_value.task_options = {'queue': 'bulk', 'priority': 1}
+    settings.EVENTLIB_HANDLER_ROUTES = {
+        'tests.unit.test_process.resize': {
+            'queue': 'images', 'retry_policy': {'max_retries': 3}},
+    }
+    eventlib.handler('app.Event')(save)
+    eventlib.handler('app.Event')(resize)
+    eventlib.handler('app.Event', batch=True)(index)
+
+    # When I process an event
+    core.process('app.Event', ejson.dumps({'a': 1}))
+
+    # Then one task per handler should be sent in a group, with the
+    # options of the event overridden by the routes of the handlers
+    payload = ejson.dumps([{'a': 1}])
+    tasks.run_handlers_task.subtask.assert_has_calls([
+        call(('app.Event', ['tests.unit.test_process.save'], payload),
+             queue='bulk', priority=1),
+        call(('app.Event', ['tests.unit.test_process.resize'], payload),
+             queue='images', priority=1, retry_policy={'max_retries': 3}),
+        call(('app.Event', ['tests.unit.test_process.index'], payload),
+             queue='bulk', priority=1),
+    ])
+    celery.group.return_value.apply_async.assert_called_once_with()
+
+    # And when the handlers are split by route, the ones sharing the
+    # default route go in the same task
+    settings.EVENTLIB_DISPATCH_MODE = 'route'
+    conf.refresh_settings()
+    tasks.reset_mock()
+    core.process('app.Event', ejson.dumps({'a': 1}))
+    tasks.run_handlers_task.subtask.assert_has_calls([
+        call(('app.Event', ['tests.unit.test_process.save',
+                            'tests.unit.test_process.index'], payload),
+             queue='bulk', priority=1),
+        call(('app.Event', ['tests.unit.test_process.resize'], payload),
+             queue='images', priority=1, retry_policy={'max_retries': 3}),
+    ])
+    celery.group.call_args[0][0].should.have.length_of(2)
+
+
+@patch('eventlib.core.logger')
+@patch('eventlib.conf.settings')
+def test_run_handlers(settings, logger):
+    core.cleanup_handlers()
+    handler_settings(settings)
+
+    handler = Mock(__name__='save')
+    eventlib.handler('app.Event')(handler)
+    batch_handler = Mock(__name__='index')
+    eventlib.handler('app.Event', batch=True)(batch_handler)
+    other = Mock(__name__='other')
+    eventlib.handler('app.Event')(other)
+
+    # When the handlers sent by the fan out run in the worker
+    names = [core.handler_name(handler), core.handler_name(batch_handler)]
+    core.run_handlers('app.Event', names, [{'a': 1}, {'a': 2}])
+
+    # Then only the handlers informed should run
+    handler.assert_has_calls([call({'a': 1}), call({'a': 2})])
+    batch_handler.assert_called_once_with([{'a': 1}, {'a': 2}])
+    other.called.should.be.false
+
+    # And missing handlers should be reported
+    core.run_handlers('app.Event', ['mock.gone'], [{'a': 1}])
+    logger.warning.assert_called_once_with(
+        'None of the handlers mock.gone was found for the event "app.Event"')
@@ -0,0 +1,97 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+from decimal import Decimal
+
+import ejson
+import json
+from mock import patch
+from nose.plugins.skip import SkipTest
+
+from eventlib import exceptions, serializers
+
+
+@patch('eventlib.conf.settings')
+def test_ejson_payloads_are_not_marked(settings):
+    settings.EVENTLIB_SERIALIZER = 'ejson'
+    data = {'a': 1, 'when': datetime(2013, 1, 1, 10, 30)}
+
+    payload = serializers.dumps(data)
+
+    payload.should.equal(ejson.dumps(data))
+    serializers.loads(payload).should.equal(data)
+
+
+@patch('eventlib.conf.settings')
+def test_msgpack_round_trip(settings):
+    if serializers.msgpack is None:
+        raise SkipTest('msgpack is not installed')
+    settings.EVENTLIB_SERIALIZER = 'msgpack'
+    data = {
+        u'a': 1,
+        u'when': datetime(2013, 1, 1, 10, 30),
+        u'price': Decimal('9.99'),
+    }
+
+    payload = serializers.dumps(data)
+
+    payload.startswith(b'\x00msgpack\x00').should.be.true
+    serializers.loads(payload).should.equal(data)
+
+    # Payloads written by the default serializer can still be read
+    serializers.loads(ejson.dumps(data)).should.equal(data)
+
+
+@patch('eventlib.conf.settings')
+def test_msgpack_task_payloads_are_text(settings):
+    if serializers.msgpack is None:
+        raise SkipTest('msgpack is not installed')
+    settings.EVENTLIB_SERIALIZER = 'msgpack'
+    data = {u'a': 1, u'when': datetime(2013, 1, 1, 10, 30)}
+
+    payload = serializers.task_payload(serializers.dumps(data))
+
+    # Binary payloads are encoded with base64, so the JSON serializer of
+    # the celery tasks can send them
+    payload.startswith(u'\x01').should.be.true
+    serializers.loads(json.loads(json.dumps(payload))).should.equal(data)
+    serializers.binary_payload(payload).should.equal(
+        serializers.dumps(data))
+
+    # Text payloads are kept as they are
+    serializers.task_payload(ejson.dumps(data)).should.equal(
+        ejson.dumps(data))
+    serializers.task_payload(b'{"a": 1}').should.equal(u'{"a": 1}')
+
+
+@patch('eventlib.conf.settings')
+def test_unknown_serializer(settings):
+    settings.EVENTLIB_SERIALIZER = 'pickle'
+    serializers.dumps.when.called_with({}).should.throw(
+        exceptions.SerializerNotFoundError,
+        'There is no serializer called "pickle" registered')
+    serializers.loads.when.called_with(b'\x00pickle\x00stuff').should.throw(
+        exceptions.SerializerNotFoundError,
+        'There is no serializer called "pickle" registered')
+
+
+def test_register_serializer():
+    serializers.register_serializer('reversed', lambda d: d[::-1],
+                                    lambda p: p[::-1])
+    try:
+        serializers.loads(b'\x00reversed\x00olleh').should.equal(b'hello')
+    finally:
+        del serializers.REGISTRY['reversed']
@@ -0,0 +1,103 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from mock import call, patch
+
+from eventlib import shipper
+
+
+@patch('eventlib.shipper.tasks')
+def test_shipper_ships_events_in_batches(tasks):
+    ship = shipper.Shipper(batch_size=2)
+
+    # Given I queue events before the thread runs
+    ship.start()
+    ship.queue.put(('app.Event', '{"a": 1}'))
+    ship.queue.put(('app.Event', '{"a": 2}'))
+    ship.put('app.Event', '{"a": 3}')
+
+    # When the shipper is flushed
+    ship.flush()
+
+    # Then the events should be sent in batches
+    tasks.process_batch_task.delay.assert_called_once_with([
+        ('app.Event', '{"a": 1}'), ('app.Event', '{"a": 2}')])
+    tasks.process_task.delay.assert_called_once_with(
+        'app.Event', '{"a": 3}')
+    ship.thread.is_alive().should.be.false
+
+
+@patch('eventlib.shipper.logger')
+@patch('eventlib.shipper.tasks')
+def test_shipper_drops_events_when_full(tasks, logger):
+    ship = shipper.Shipper(queue_size=1)
+    ship.pid = os.getpid()
+    ship.queue = shipper.Queue(1)
+
+    ship.put('app.Event', '{}')
+    ship.put('app.Event', '{}')
+
+    ship.queue.qsize().should.equal(1)
+    logger.warning.assert_called_once_with(
+        'The shipper queue is full, dropping the event "app.Event"')
+
+
+@patch('eventlib.shipper.spill_events')
+@patch('eventlib.shipper.logger')
+@patch('eventlib.shipper.tasks')
+def test_shipper_spills_events(tasks, logger, spill_events):
+    ship = shipper.Shipper(overflow='spill')
+
+    # Given that celery is down
+    tasks.process_task.delay.side_effect = IOError('Connection refused')
+    ship.ship([(u'app.Event', '{"a": 1}')])
+
+    # And the queue is full
+    ship.pid = os.getpid()
+    ship.queue = shipper.Queue(1)
+    ship.put(u'app.Event', '{"a": 2}')
+    ship.put(u'app.Other', '{"a": 3}')
+
+    # Then the events should be written to the spill buffer
+    spill_events.assert_has_calls([
+        call([(u'app.Event', '{"a": 1}')]),
+        call([(u'app.Other', '{"a": 3}')]),
+    ])
+    logger.warning.assert_called_once_with(
+        'The event system could not ship 1 events and failed with the '
+        'following exception: Connection refused')
+
+
+@patch('eventlib.conf.settings')
+def test_flush_shipper(settings):
+    settings.EVENTLIB_SHIPPER_QUEUE_SIZE = 10
+    settings.EVENTLIB_SHIPPER_BATCH_SIZE = 5
+    settings.EVENTLIB_SHIPPER_OVERFLOW = 'block'
+    settings.EVENTLIB_SHIPPER_EXIT_TIMEOUT = 1
+    shipper._shipper = None
+
+    # Flushing does nothing until the shipper is used
+    shipper.flush_shipper()
+
+    ship = shipper.get_shipper()
+    ship.queue_size.should.equal(10)
+    ship.overflow.should.equal('block')
+    with patch('eventlib.shipper.tasks') as tasks:
+        ship.put('app.Event', '{}')
+        shipper.flush_shipper()
+    tasks.process_task.delay.assert_called_once_with('app.Event', '{}')
+    shipper._shipper = None
@@ -0,0 +1,195 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import time
+
+import eventlib
+from mock import Mock, call, patch
+
+from eventlib import spill
+
+
+def with_directory(test):
+    def wrapper(*args):
+        directory = tempfile.mkdtemp()
+        try:
+            return test(*(args + (directory,)))
+        finally:
+            shutil.rmtree(directory)
+    wrapper.__name__ = test.__name__
+    return wrapper
+
+
+@with_directory
+def test_segment_keeps_records_across_reopenings(directory):
+    path = os.path.join(directory, '1-1.spill')
+    segment = spill.Segment(path, 64)
+
+    # Given I write records to a segment
+    record = spill.RECORD_HEADER.pack(spill.EVENT, 5, 8) + b'app.E{"a": 1}'
+    segment.append(record).should.be.true
+    segment.append(record).should.be.true
+
+    # Then records that don't fit are refused
+    segment.append(record).should.be.false
+    segment.close()
+
+    # And the records are found when the file is opened again
+    segment = spill.Segment(path)
+    list(segment.records()).should.equal(
+        [(spill.EVENT, u'app.E', b'{"a": 1}')] * 2)
+    segment.offset.should.equal(len(record) * 2)
+    segment.close()
+
+
+@patch('eventlib.spill.logger')
+@with_directory
+def test_spill_buffer_is_capped(logger, directory):
+    buf = spill.SpillBuffer(directory, segment_size=40, max_segments=2)
+
+    # Two records fit in each segment
+    for i in range(4):
+        buf.add_event(u'app.Event', '{}').should.be.true
+    len(buf.segments).should.equal(2)
+    len(os.listdir(directory)).should.equal(2)
+
+    # When all the segments are full, new records are dropped
+    buf.add_message(u'eventlib', '{}').should.be.false
+    logger.warning.assert_called_once_with(
+        'The spill buffer is full, dropping a record of 19 bytes')
+
+
+@patch('eventlib.spill.logger')
+@with_directory
+def test_spill_buffer_replay(logger, directory):
+    buf = spill.SpillBuffer(directory, segment_size=1024, batch_size=2)
+    buf.add_event(u'app.Event', '{"a": 1}')
+    buf.add_message(u'eventlib', '{"b": 1}')
+    buf.add_event(u'app.Event', '{"a": 2}')
+    buf.pending().should.be.true
+
+    # Given that the broker is still down
+    send_events = Mock(side_effect=IOError('Connection refused'))
+    send_messages = Mock()
+    buf.replay(send_events, send_messages)
+
+    # Then the segment is kept for the next try
+    logger.warning.assert_called_once_with(
+        'The event system could not replay the spill buffer and failed '
+        'with the following exception: Connection refused')
+    len(buf.segments).should.equal(1)
+
+    # When the broker is back, the records are sent in batches
+    send_events.side_effect = None
+    buf.replay(send_events, send_messages)
+    send_events.assert_called_with([
+        (u'app.Event', b'{"a": 1}'), (u'app.Event', b'{"a": 2}')])
+    send_messages.assert_called_with([(u'eventlib', b'{"b": 1}')])
+
+    # And the segments are removed
+    buf.segments.should.be.empty
+    os.listdir(directory).should.be.empty
+    buf.pending().should.be.false
+
+
+@patch('eventlib.spill.pid_exists')
+@with_directory
+def test_spill_buffer_replays_segments_of_dead_processes(
+        pid_exists, directory):
+    # Given a segment left by a process that is gone
+    orphan = spill.SpillBuffer(directory)
+    orphan.segment_path = lambda sequence: os.path.join(
+        directory, '1-{:010d}.spill'.format(sequence))
+    orphan.add_event(u'app.Event', '{}')
+    pid_exists.return_value = False
+
+    # When another process replays its buffer
+    buf = spill.SpillBuffer(directory)
+    buf.pending().should.be.true
+    send_events = Mock()
+    buf.replay(send_events, Mock())
+
+    # Then the orphan segment should be claimed and sent
+    send_events.assert_called_once_with([(u'app.Event', b'{}')])
+    os.listdir(directory).should.be.empty
+    pid_exists.assert_has_calls([call(1)])
+
+
+@patch('eventlib.spill._buffer', None)
+@patch('eventlib.spill.send_events')
+@patch('eventlib.spill.pid_exists')
+@patch('eventlib.spill.getsetting')
+@patch('eventlib.api.tasks')
+@patch('eventlib.core.find_event')
+@patch('eventlib.api.conf')
+@with_directory
+def test_log_replays_segments_of_dead_processes(
+        conf, find_event, tasks, getsetting, pid_exists, send_events,
+        directory):
+    conf.getsetting.return_value = False
+    getsetting.side_effect = {
+        'EVENTLIB_SPILL_DIR': directory,
+        'EVENTLIB_SPILL_REPLAY_INTERVAL': 0.01,
+    }.get
+
+    # Given a segment left by a process that is gone
+    orphan = spill.SpillBuffer(directory)
+    orphan.segment_path = lambda sequence: os.path.join(
+        directory, '1-{:010d}.spill'.format(sequence))
+    orphan.add_event(u'app.Event', '{}')
+    pid_exists.return_value = False
+
+    # When this process logs an event without spilling anything
+    eventlib.log('app.Event')
+    tasks.process_task.delay.called.should.be.true
+    for i in range(100):
+        if send_events.called:
+            break
+        time.sleep(0.01)
+    spill.stop_replayer()
+
+    # Then the orphan segment should be replayed anyway
+    send_events.assert_called_once_with([(u'app.Event', b'{}')])
+    os.listdir(directory).should.be.empty
+
+
+@patch('eventlib.conf.settings')
+def test_spill_events_when_disabled(settings):
+    settings.EVENTLIB_SPILL_DIR = None
+    spill.spill_events([(u'app.Event', '{}')]).should.be.false
+    spill.spill_messages([(u'eventlib', '{}')]).should.be.false
+
+
+@patch('eventlib.core.apply_task')
+@patch('eventlib.core.find_event')
+def test_send_events_sends_text_payloads(find_event, apply_task):
+    find_event.return_value = None
+
+    # Records are read back as bytes, but the task serializer might not
+    # be able to send them
+    spill.send_events([(u'app.Event', b'{"a": 1}')])
+
+    apply_task.call_args[0][1].should.equal(([(u'app.Event', u'{"a": 1}')],))
+
+
+@patch('eventlib.spill._buffer', None)
+@patch('eventlib.conf.settings')
+def test_spill_buffer_needs_a_directory_name(settings):
+    # Settings mocked in the tests don't create directories
+    spill.get_spill_buffer().should.be.none
+    spill._buffer.should.be.none
@@ -0,0 +1,129 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import eventlib
+from mock import patch
+from eventlib import conf, metrics, throttle
+
+
+class PageViewed(eventlib.BaseEvent):
+    sample_rate = 0.5
+    rate_limit = '2/s'
+
+
+def test_parse_rate():
+    throttle.parse_rate('100/s').should.equal((100, 1))
+    throttle.parse_rate('30/m').should.equal((30, 60))
+    throttle.parse_rate('1/h').should.equal((1, 3600))
+    throttle.parse_rate(5).should.equal((5, 1))
+
+
+@patch('eventlib.throttle.time')
+def test_token_bucket(time):
+    time.time.return_value = 100
+    bucket = throttle.TokenBucket(rate=2, capacity=2)
+
+    # The bucket starts full
+    bucket.consume().should.be.true
+    bucket.consume().should.be.true
+    bucket.consume().should.be.false
+
+    # And gets a token every half a second
+    time.time.return_value = 100.5
+    bucket.consume().should.be.true
+    bucket.consume().should.be.false
+
+    # But never more than its capacity
+    time.time.return_value = 200
+    [bucket.consume() for i in range(3)].should.equal([True, True, False])
+
+
+@patch('eventlib.throttle.random')
+@patch('eventlib.throttle.time')
+@patch('eventlib.conf.settings')
+def test_throttle_follows_the_event_classes(settings, time, random):
+    sink = metrics.InMemorySink()
+    settings.EVENTLIB_METRICS_SINK = sink
+    settings.EVENTLIB_SAMPLE_RATES = None
+    settings.EVENTLIB_RATE_LIMITS = None
+    time.time.return_value = 100
+    throttle.reset_throttle()
+
+    # Events are sampled out when the random number is above the rate
+    random.random.return_value = 0.7
+    throttle.admit('app.PageViewed', PageViewed).should.be.false
+    sink.counters['events.app.PageViewed.sampled_out'].should.equal(1)
+
+    # And the ones sampled in are rate limited
+    random.random.return_value = 0.2
+    [throttle.admit('app.PageViewed', PageViewed)
+     for i in range(3)].should.equal([True, True, False])
+    sink.counters['events.app.PageViewed.rate_limited'].should.equal(1)
+
+    # Events without a sampling rate or a rate limit are always logged
+    throttle.admit('app.Other', eventlib.BaseEvent).should.be.true
+
+
+@patch('eventlib.throttle.random')
+@patch('eventlib.conf.settings')
+def test_throttle_settings_take_precedence(settings, random):
+    settings.EVENTLIB_METRICS_SINK = None
+    settings.EVENTLIB_SAMPLE_RATES = {'app.*': 0.1, 'app.PageViewed': 0.9}
+    settings.EVENTLIB_RATE_LIMITS = None
+    random.random.return_value = 0.7
+
+    throttle.admit('app.PageViewed', PageViewed).should.be.true
+    throttle.admit('app.Other', eventlib.BaseEvent).should.be.false
+    throttle.admit('other.Event', eventlib.BaseEvent).should.be.true
+
+    # When the settings change, the rules are built again
+    settings.EVENTLIB_SAMPLE_RATES = {'app.*': 1}
+    conf.refresh_settings()
+    throttle.admit('app.Other', eventlib.BaseEvent).should.be.true
+
+
+@patch('eventlib.throttle.time')
+@patch('eventlib.conf.settings')
+def test_throttle_with_less_than_one_event_per_period(settings, time):
+    settings.EVENTLIB_METRICS_SINK = None
+    settings.EVENTLIB_SAMPLE_RATES = None
+    settings.EVENTLIB_RATE_LIMITS = {'app.Rare': '0.5/s'}
+    time.time.return_value = 100
+    throttle.reset_throttle()
+
+    # The bucket still holds one event
+    throttle.admit('app.Rare', eventlib.BaseEvent).should.be.true
+    throttle.admit('app.Rare', eventlib.BaseEvent).should.be.false
+
+    # And gets the next one after two seconds
+    time.time.return_value = 101
+    throttle.admit('app.Rare', eventlib.BaseEvent).should.be.false
+    time.time.return_value = 102
+    throttle.admit('app.Rare', eventlib.BaseEvent).should.be.true
+
+
+@patch('eventlib.api.tasks')
+@patch('eventlib.api.core.find_event')
+@patch('eventlib.api.throttle')
+def test_log_drops_the_events_before_serializing_them(throttle, find_event,
+                                                      tasks):
+    throttle.admit.return_value = False
+
+    eventlib.log('app.PageViewed', {'unserializable': object()})
+    eventlib.log_many([('app.PageViewed', {})])
+
+    find_event.return_value.called.should.be.false
+    tasks.process_task.delay.called.should.be.false
+    tasks.process_batch_task.delay.called.should.be.false
@@ -0,0 +1,289 @@
+# eventlib - Copyright (c) 2012  Yipit, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import Mock, call, patch
+from redis.exceptions import ResponseError
+
+from eventlib import conf, transport
+
+
+def test_framed_messages():
+    message = transport.encode_frame(u'app.Event', '{"a": 1}')
+    message.should.equal(b'\x01app.Event\x01{"a": 1}')
+    transport.decode_message(message).should.equal((u'app.Event', {'a': 1}))
+
+
+def test_decode_messages_with_the_name_in_the_data():
+    transport.decode_message('{"a": 1, "name": "app.Event"}').should.equal(
+        (u'app.Event', {'a': 1}))
+    transport.decode_message('{"a": 1}').should.equal((None, {'a': 1}))
+
+
+def test_broadcast_buffer_flushes_when_full():
+    client = Mock()
+    buf = transport.BroadcastBuffer(max_size=2, max_delay=60)
+
+    # Given I add a message to the buffer
+    buf.add(client, 'eventlib', 'message 1')
+
+    # Then nothing should be published yet
+    client.pipeline.called.should.be.false
+
+    # When the buffer gets full
+    buf.add(client, 'eventlib', 'message 2')
+
+    # Then all messages should be published through a pipeline
+    client.pipeline.assert_called_once_with(transaction=False)
+    pipeline = client.pipeline.return_value
+    pipeline.publish.assert_has_calls([
+        call('eventlib', 'message 1'),
+        call('eventlib', 'message 2'),
+    ])
+    pipeline.execute.assert_called_once_with()
+    buf.messages.should.be.empty
+
+
+@patch('eventlib.transport.time')
+def test_broadcast_buffer_flushes_after_the_delay(time):
+    client = Mock()
+    buf = transport.BroadcastBuffer(max_size=100, max_delay=1)
+
+    time.time.return_value = 10
+    buf.add(client, 'eventlib', 'message 1')
+    client.pipeline.called.should.be.false
+
+    time.time.return_value = 11
+    buf.add(client, 'eventlib', 'message 2')
+    client.pipeline.return_value.publish.call_count.should.equal(2)
+
+
+@patch('eventlib.transport.logger')
+def test_broadcast_buffer_logs_failures(logger):
+    client = Mock()
+    client.pipeline.return_value.execute.side_effect = ValueError('P0wned!!!')
+    buf = transport.BroadcastBuffer(max_size=100, max_delay=60)
+    buf.add(client, 'eventlib', 'message')
+
+    buf.flush()
+
+    logger.warning.assert_called_once_with(
+        'The event system could not broadcast 1 buffered messages and '
+        'failed with the following exception: P0wned!!!')
+    buf.messages.should.be.empty
+
+
+@patch('eventlib.transport.os')
+def test_broadcast_buffer_drops_messages_of_the_parent_process(os):
+    client = Mock()
+    os.getpid.return_value = 1
+    buf = transport.BroadcastBuffer(max_size=100, max_delay=60)
+    buf.add(client, 'eventlib', 'message')
+
+    # When the process forks, the child should not publish the messages
+    # buffered by its parent
+    os.getpid.return_value = 2
+    buf.flush()
+    client.pipeline.called.should.be.false
+
+
+@patch('eventlib.conf.settings')
+def test_flush_buffer(settings):
+    settings.EVENTLIB_BROADCAST_BUFFER_SIZE = 10
+    settings.EVENTLIB_BROADCAST_BUFFER_DELAY = 60
+    transport._buffer = None
+
+    # Flushing does nothing until the buffer is used
+    transport.flush_buffer()
+
+    client = Mock()
+    transport.get_buffer().add(client, 'eventlib', 'message')
+    transport.get_buffer().max_size.should.equal(10)
+    transport.flush_buffer()
+    client.pipeline.return_value.publish.assert_called_once_with(
+        'eventlib', 'message')
+    transport._buffer = None
+
+
+@patch('eventlib.conf.settings')
+def test_publish_to_a_stream(settings):
+    settings.EVENTLIB_TRANSPORT = 'streams'
+    settings.EVENTLIB_STREAM_MAXLEN = 1000
+    client = Mock()
+
+    transport.publish(client, 'eventlib', 'message')
+
+    client.publish.called.should.be.false
+    client.xadd.assert_called_once_with(
+        'eventlib', {b'message': 'message'}, maxlen=1000, approximate=True)
+
+
+def test_stream_reader_reads_pending_messages_first():
+    client = Mock()
+    client.xpending_range.return_value = []
+    client.xreadgroup.side_effect = [
+        [['eventlib', [('1-0', {b'message': 'pending'})]]],
+        [['eventlib', []]],
+        [['eventlib', [('2-0', {b'message': 'new'}), ('3-0', None)]]],
+    ]
+    reader = transport.StreamReader(client, 'eventlib', 'group', 'me')
+    batches = reader.read()
+
+    # The pending messages come first
+    next(batches).should.equal([('1-0', 'pending')])
+
+    # Then the new ones, with the trimmed entries carrying no message
+    next(batches).should.equal([('2-0', 'new'), ('3-0', None)])
+
+    client.xgroup_create.assert_called_once_with(
+        'eventlib', 'group', id='0', mkstream=True)
+    client.xreadgroup.assert_has_calls([
+        call('group', 'me', {'eventlib': '0'}, count=100, block=5000),
+        call('group', 'me', {'eventlib': '1-0'}, count=100, block=5000),
+        call('group', 'me', {'eventlib': '>'}, count=100, block=5000),
+    ])
+
+
+def test_stream_reader_uses_existing_groups():
+    client = Mock()
+    client.xgroup_create.side_effect = ResponseError(
+        'BUSYGROUP Consumer Group name already exists')
+    transport.StreamReader(client, 'eventlib', 'group', 'me').create_group()
+
+    client.xgroup_create.side_effect = ResponseError('ERR')
+    transport.StreamReader(client, 'eventlib', 'group', 'me').create_group.\
+        when.called_with().should.throw(ResponseError)
+
+
+def test_stream_reader_claims_idle_messages():
+    client = Mock()
+    client.xpending_range.side_effect = [
+        [{'message_id': '1-0', 'time_since_delivered': 90000},
+         {'message_id': '2-0', 'time_since_delivered': 10}],
+        [{'message_id': '3-0', 'time_since_delivered': 90000}],
+    ]
+    client.xclaim.side_effect = [
+        [('1-0', {b'message': 'lost'})],
+        [('3-0', None)],
+    ]
+    reader = transport.StreamReader(
+        client, 'eventlib', 'group', 'me', count=2, claim_idle=60000)
+
+    # The pending entries are listed page by page, until the last one
+    reader.claim().should.equal([[('1-0', 'lost')], [('3-0', None)]])
+    client.xpending_range.assert_has_calls([
+        call('eventlib', 'group', '-', '+', 2),
+        call('eventlib', 'group', '2-1', '+', 2),
+    ])
+    client.xclaim.assert_has_calls([
+        call('eventlib', 'group', 'me', 60000, ['1-0']),
+        call('eventlib', 'group', 'me', 60000, ['3-0']),
+    ])
+
+    reader.ack(['1-0', '2-0'])
+    client.xack.assert_called_once_with('eventlib', 'group', '1-0', '2-0')
+
+
+@patch('eventlib.transport.time')
+def test_stream_reader_claims_idle_messages_while_reading(time):
+    client = Mock()
+    client.xpending_range.return_value = []
+    client.xreadgroup.side_effect = [
+        [['eventlib', []]],
+        [['eventlib', [('2-0', {b'message': 'new'})]]],
+        [['eventlib', [('3-0', {b'message': 'new'})]]],
+    ]
+    reader = transport.StreamReader(
+        client, 'eventlib', 'group', 'me', claim_idle=60000)
+    batches = reader.read()
+
+    # Given that the reader claimed messages when it started
+    time.time.return_value = 100
+    next(batches).should.equal([('2-0', 'new')])
+    client.xpending_range.call_count.should.equal(1)
+
+    # When the claim idle time is over, messages are claimed again
+    client.xpending_range.return_value = [
+        {'message_id': '1-0', 'time_since_delivered': 60000}]
+    client.xclaim.return_value = [('1-0', {b'message': 'lost'})]
+    time.time.return_value = 160
+    next(batches).should.equal([('1-0', 'lost')])
+    next(batches).should.equal([('3-0', 'new')])
+    client.xpending_range.call_count.should.equal(2)
+
+
+@patch('eventlib.conf.settings')
+def test_channel_for(settings):
+    settings.EVENTLIB_TRANSPORT = 'pubsub'
+    settings.EVENTLIB_BROADCAST_ROUTING = None
+    transport.channel_for('deal.ActionLog').should.equal('eventlib')
+
+    settings.EVENTLIB_BROADCAST_ROUTING = 'app'
+    conf.refresh_settings()
+    transport.channel_for('deal.ActionLog').should.equal('eventlib:deal')
+
+    settings.EVENTLIB_BROADCAST_ROUTING = 'event'
+    conf.refresh_settings()
+    transport.channel_for('deal.ActionLog').should.equal(
+        'eventlib:deal.ActionLog')
+
+    # Streams are not routed
+    settings.EVENTLIB_TRANSPORT = 'streams'
+    conf.refresh_settings()
+    transport.channel_for('deal.ActionLog').should.equal('eventlib')
+
+
+@patch('eventlib.conf.settings')
+def test_subscriptions(settings):
+    settings.EVENTLIB_TRANSPORT = 'pubsub'
+    names = ['deal.ActionLog', 'deal.*', 'user.Login', 'us*.Logout',
+             '[!d]*.Other']
+
+    settings.EVENTLIB_BROADCAST_ROUTING = None
+    conf.refresh_settings()
+    transport.subscriptions(names).should.equal((['eventlib'], []))
+
+    settings.EVENTLIB_BROADCAST_ROUTING = 'app'
+    conf.refresh_settings()
+    transport.subscriptions(names).should.equal((
+        [],
+        ['eventlib:*'],
+    ))
+
+    settings.EVENTLIB_BROADCAST_ROUTING = 'event'
+    conf.refresh_settings()
+    transport.subscriptions(names).should.equal((
+        ['eventlib:user.Login'],
+        ['eventlib:[^d]*.Other', 'eventlib:deal.*', 'eventlib:us*.Logout'],
+    ))
+
+    # Listeners without handlers keep listening to the default channel
+    transport.subscriptions([]).should.equal((['eventlib'], []))
+
+
+@patch('eventlib.conf.settings')
+def test_subscriptions_do_not_overlap(settings):
+    settings.EVENTLIB_TRANSPORT = 'pubsub'
+    settings.EVENTLIB_BROADCAST_ROUTING = 'event'
+    conf.refresh_settings()
+
+    # Channels and patterns already matched by a pattern are left out,
+    # otherwise redis would deliver their messages twice
+    transport.subscriptions(
+        ['deal.ActionLog', 'deal.*', 'deal.Act*', 'user.Lo?in', 'user.*',
+         'user.Login', 'other.[!a]*', 'other.all']
+    ).should.equal((
+        ['eventlib:other.all'],
+        ['eventlib:deal.*', 'eventlib:other.[^a]*', 'eventlib:user.*'],
+    ))
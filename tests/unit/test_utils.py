@@ -13,9 +13,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+
 from mock import Mock, patch
 
 from eventlib import util
+from eventlib.lazy import LazyImport
 
 
 @patch('eventlib.conf.settings')
@@ -63,10 +66,11 @@ def test_get_ip_helper(settings):
     util.get_ip(request).should.equal('0.0.0.0')
 
 
+@patch('eventlib.util.redis.ConnectionPool')
 @patch('eventlib.util.redis.StrictRedis')
 @patch('eventlib.conf.settings')
-def test_redis_connect(settings, StrictRedis):
-    util.redis_connection.conn = None
+def test_redis_connect(settings, StrictRedis, ConnectionPool):
+    util.redis_connection.reset()
 
     settings.EVENTLIB_REDIS_CONFIG_NAME = 'default'
     settings.REDIS_CONNECTIONS = {
@@ -77,10 +81,67 @@ def test_redis_connect(settings, StrictRedis):
     }
 
     conn = util.redis_connection.get_connection()
-    StrictRedis.assert_called_once_with(host='localhost', port=6379)
+    ConnectionPool.assert_called_once_with(host='localhost', port=6379)
+    StrictRedis.assert_called_once_with(
+        connection_pool=ConnectionPool.return_value)
 
     new_conn = util.redis_connection.get_connection()
     new_conn.should.equal(conn)
+    util.redis_connection.reset()
+
+
+@patch('eventlib.util.redis.ConnectionPool')
+@patch('eventlib.util.redis.StrictRedis')
+@patch('eventlib.conf.settings')
+def test_redis_connect_with_pool_options(settings, StrictRedis,
+                                         ConnectionPool):
+    util.redis_connection.reset()
+
+    settings.REDIS_CONNECTIONS = {
+        'default': {'HOST': 'localhost', 'PORT': 6379},
+        'events': {
+            'HOST': 'redis-events',
+            'PORT': 6380,
+            'DB': 2,
+            'MAX_CONNECTIONS': 50,
+            'SOCKET_TIMEOUT': 5,
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_KEEPALIVE': True,
+        },
+    }
+
+    util.redis_connection.get_connection('events')
+    ConnectionPool.assert_called_once_with(
+        host='redis-events', port=6380, db=2, max_connections=50,
+        socket_timeout=5, socket_connect_timeout=1, socket_keepalive=True)
+    util.redis_connection.reset()
+
+
+@patch('eventlib.util.os')
+@patch('eventlib.util.redis.ConnectionPool')
+@patch('eventlib.util.redis.StrictRedis')
+@patch('eventlib.conf.settings')
+def test_redis_reconnects_after_fork(settings, StrictRedis, ConnectionPool,
+                                     os):
+    os.getpid.return_value = 1
+    util.redis_connection.reset()
+    settings.EVENTLIB_REDIS_CONFIG_NAME = 'default'
+    settings.REDIS_CONNECTIONS = {
+        'default': {'HOST': 'localhost', 'PORT': 6379},
+    }
+
+    # Given I connect to redis
+    util.redis_connection.get_connection()
+
+    # When the process forks
+    os.getpid.return_value = 2
+
+    # Then a new pool should be created for the child process
+    util.redis_connection.get_connection()
+    ConnectionPool.call_count.should.equal(2)
+    util.redis_connection.get_connection()
+    ConnectionPool.call_count.should.equal(2)
+    util.redis_connection.reset()
 
 
 @patch('eventlib.conf.settings')
@@ -88,10 +149,23 @@ def test_no_redis_settings(settings):
     settings.EVENTLIB_REDIS_CONFIG_NAME = None
     settings.REDIS_CONNECTIONS = None
 
-    util.redis_connection.conn = None
+    util.redis_connection.reset()
 
     conn = util.redis_connection.get_connection()
     conn.should.equal(None)
 
+    # Settings are not read again
+    settings.REDIS_CONNECTIONS = {'default': {'HOST': 'h', 'PORT': 1}}
     new_conn = util.redis_connection.get_connection()
     new_conn.should.equal(conn)
+    util.redis_connection.reset()
+
+
+def test_lazy_import():
+    # Nothing is imported until an attribute is accessed
+    path = LazyImport('os', 'path')
+    path._target.should.be.none
+    path.join('a', 'b').should.equal(os.path.join('a', 'b'))
+    path._target.should.be(os.path)
+
+    LazyImport('os').sep.should.equal(os.sep)